@@ -1,10 +1,11 @@
-from database.mongo import init_db_structure, check_mongo_structure
+from database.mongo import init_db_structure, init_indexes, check_mongo_structure, index_report
 from database.chroma import create_collections
+from database.migrations import MIGRATIONS
 from ultraprint.logging import logger
-from ultraconfiguration import UltraConfig
+from utilities.settings import config
+import sys
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('init_log', 
             filename='debug/init.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
@@ -13,6 +14,8 @@ log = logger('init_log',
 def init():
     log.info("Initializing MongoDB structure...")
     init_db_structure()
+    log.info("Initializing MongoDB indexes...")
+    init_indexes()
     if check_mongo_structure(verbose=True):
         log.success("MongoDB structure initialized successfully.")
     else:
@@ -22,5 +25,31 @@ def init():
     create_collections()
     log.success("ChromaDB collections initialized successfully.")
 
+def report():
+    log.info("Collecting MongoDB index report...")
+    for namespace, details in index_report().items():
+        log.info(f"\n{namespace}")
+        for keys in details["missing"]:
+            log.error(f"Missing index: {keys}")
+        for name in details["unused"]:
+            log.warning(f"Unused index: {name}")
+        for name in details["undeclared"]:
+            log.warning(f"Index not declared in config: {name}")
+        log.info(f"Usage since last restart: {details['usage']}")
+
+def migrate(names=None, restart=False):
+    for name in names or MIGRATIONS:
+        if name not in MIGRATIONS:
+            log.error(f"Unknown migration '{name}'. Available: {', '.join(MIGRATIONS)}")
+            continue
+        log.info(f"Running migration '{name}'...")
+        state = MIGRATIONS[name](restart=restart)
+        log.info(f"Status: {state['status']}, counters: {state.get('counters', {})}")
+
 if __name__ == "__main__":
-    init()
+    if len(sys.argv) > 1 and sys.argv[1] == "report":
+        report()
+    elif len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        migrate([arg for arg in sys.argv[2:] if not arg.startswith("--")], restart="--restart" in sys.argv)
+    else:
+        init()
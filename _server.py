@@ -1,15 +1,28 @@
+from utilities.startup import mark, startup_report
 from fastapi import FastAPI, Request
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from datetime import datetime, timezone
 from routes.agent_route import router as agent_router
 from routes.session_route import router as session_router
 from routes.chat_route import router as chat_router
 from routes.file_route import router as file_router
 from errors.error_logger import log_exception_with_request
-from database.mongo import pingtest as mongo_pingtest
-from database.chroma import pingtest as chroma_pingtest 
+from database.mongo import ensure_indexes
+from database.migrations import start_configured_migrations
+from database.cache import cache_stats, start_invalidation_listener
+from llm.prompt_builder import usage_stats, warm_up_tokenizers
+from rag.rag import ingestion_pool, start_ingestion
+from utilities.timing import timing_stats
+from utilities.object_cache import object_cache
+from utilities import metrics, health, clients
 from keys.keys import environment
+from utilities.settings import config, start_watcher as start_config_watcher
 import uvicorn
+import threading
+import time
 
+mark("imports")
 app = FastAPI()
 
 app.include_router(agent_router, prefix="/agents", tags=["agents"])
@@ -17,18 +30,88 @@ app.include_router(session_router, prefix="/sessions", tags=["sessions"])
 app.include_router(chat_router, prefix="/chat", tags=["chat"])
 app.include_router(file_router, prefix="/files", tags=["files"])
 
+@app.on_event("startup")
+async def startup():
+    if config.get("mongo.ensure_indexes_on_startup", True):
+        ensure_indexes()
+    start_configured_migrations()
+    start_invalidation_listener()
+    metrics.start_snapshot_writer()
+    health.start_prober()
+    start_config_watcher()
+    start_ingestion()
+    # Create the SDK clients off the request path so the first chat does not pay for the imports
+    threading.Thread(target=clients.warm_up, name="client-warm-up", daemon=True).start()
+    threading.Thread(target=warm_up_tokenizers, name="tokenizer-warm-up", daemon=True).start()
+    mark("ready")
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Let running ingestion jobs finish; unfinished ones go back to the queue for other workers
+    await run_in_threadpool(ingestion_pool.shutdown, config.get("ingestion.shutdown_timeout", 30))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if not metrics.enabled:
+        return await call_next(request)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.inc("http_requests_total", route=route_template(request), method=request.method, status="500")
+        raise
+    route = route_template(request)
+    metrics.inc("http_requests_total", route=route, method=request.method, status=str(response.status_code))
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - start, route=route)
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        response.body_iterator = track_stream(response.body_iterator, route, start)
+    return response
+
+def route_template(request: Request):
+    """Return the path template of the matched route, so metrics are not split per ID."""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+async def track_stream(body_iterator, route, start):
+    """Count a streaming response as in flight until its last chunk has been sent."""
+    metrics.add("http_streams_in_flight", 1, route=route)
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        metrics.add("http_streams_in_flight", -1, route=route)
+        metrics.observe("http_stream_duration_seconds", time.perf_counter() - start, route=route)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # A plain def runs in the threadpool, since collecting reads MongoDB and the snapshot files
+    return PlainTextResponse(metrics.render(metrics.collect_all()), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/status")
 @app.get("/")
-async def status(request: Request):
+async def status(request: Request, deep: bool = False):
     try:
-        mongo_status = "up" if mongo_pingtest() else "down"
-        chroma_status = "up" if chroma_pingtest() else "down"
+        # The background prober keeps a snapshot, so polling /status never waits on a dependency.
+        # deep=true probes now and also verifies the configured collections and indexes.
+        if deep:
+            dependencies = await run_in_threadpool(health.probe_all, "deep")
+        else:
+            dependencies = health.snapshot()
+            if not config.get("health.enabled", True):
+                dependencies = await run_in_threadpool(health.probe_all, "light")
         return {
             "message": "Service status retrieved successfully.",
             "server": "AIML",
             "time": datetime.now(timezone.utc).isoformat() + "Z",
-            "mongodb": mongo_status,
-            "chromadb": chroma_status
+            "mongodb": dependencies["mongodb"]["status"],
+            "chromadb": dependencies["chromadb"]["status"],
+            "health": dependencies,
+            "caches": cache_stats(),
+            "object_cache": object_cache.stats(),
+            "token_usage": usage_stats(),
+            "timings": timing_stats(),
+            "ingestion": ingestion_pool.stats(),
+            "startup": startup_report()
         }
     except Exception as e:
         log_exception_with_request(e, status, request)
@@ -0,0 +1,36 @@
+from rag.rag import ingestion_pool, start_artifact_sweeper
+from llm.prompt_builder import warm_up_tokenizers
+from utilities.settings import config, start_watcher as start_config_watcher
+from utilities import metrics
+from ultraprint.logging import logger
+import signal
+import threading
+
+#! Initialize ---------------------------------------------------------------
+log = logger('worker_log',
+            filename='debug/worker.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False))
+
+# Standalone ingestion worker: claims jobs from jobs.files alongside (or instead of) the API
+# processes. Run as many as needed on any node, e.g. `python _worker.py`, and set
+# ingestion.run_in_api to false to keep the API nodes for chat only.
+def main():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    start_config_watcher()
+    metrics.start_snapshot_writer()
+    # Spreadsheet rows are chunked by token count
+    warm_up_tokenizers()
+    ingestion_pool.start()
+    start_artifact_sweeper()
+    log.success(f"Ingestion worker {ingestion_pool.worker_id} running")
+
+    stop.wait()
+    log.info("Shutting down, waiting for running jobs...")
+    ingestion_pool.shutdown(config.get("ingestion.shutdown_timeout", 30))
+
+if __name__ == "__main__":
+    main()
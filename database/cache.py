@@ -0,0 +1,381 @@
+from cachetools import TTLCache, LRUCache
+from bson import ObjectId
+from database.mongo import client as mongo_client
+from keys.keys import environment
+from utilities.settings import config
+from ultraprint.logging import logger
+from utilities import metrics
+from collections import deque
+import copy
+import threading
+import time
+
+#! Initialize ---------------------------------------------------------------
+log = logger('cache_log',
+            filename='debug/cache.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False),
+            log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+
+#! Document cache -------------------------------------------------------------
+class DocumentCache:
+    """
+    Thread-safe, process-local read-through cache for MongoDB documents keyed by _id.
+
+    Entries expire after `ttl` seconds and can be dropped explicitly with `invalidate`.
+    Callers always receive copies, so they are free to mutate what they get back.
+    """
+
+    def __init__(self, name, collection, maxsize=1024, ttl=300, enabled=True):
+        self.name = name
+        self.collection = collection
+        self.enabled = enabled
+        self.ttl = ttl
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.max_age_served = 0.0
+
+    @staticmethod
+    def _copy(document, projection=None):
+        """Return a private copy of a cached document, restricted to `projection` if given."""
+        if not projection:
+            return copy.deepcopy(document)
+        if not any(include for field, include in projection.items() if field != "_id"):
+            # Exclusion projection, e.g. {"files": 0}
+            return {field: copy.deepcopy(value) for field, value in document.items() if field not in projection or projection[field]}
+        projected = {"_id": document["_id"]} if projection.get("_id", 1) else {}
+        for field, include in projection.items():
+            if include and field in document:
+                projected[field] = copy.deepcopy(document[field])
+        return projected
+
+    def _lookup(self, key):
+        """Return the cached document for `key` and record hit statistics, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        loaded_at, document = entry
+        self.hits += 1
+        self.max_age_served = max(self.max_age_served, time.monotonic() - loaded_at)
+        return document
+
+    def get(self, doc_id, projection=None):
+        """
+        Return a single document, loading it from MongoDB on a miss.
+
+        Args:
+            doc_id (str | ObjectId): The _id of the document.
+            projection (dict, optional): Inclusion projection applied to the returned copy. Defaults to None.
+
+        Returns:
+            dict | None: A copy of the document, or None if it does not exist.
+        """
+        object_id = ObjectId(doc_id)
+        if not self.enabled:
+            return self.collection.find_one({"_id": object_id}, projection)
+
+        key = str(object_id)
+        with self._lock:
+            document = self._lookup(key)
+            generation = self._generation
+        if document is None:
+            document = self.collection.find_one({"_id": object_id})
+            if document is None:
+                return None
+            self._store({key: document}, generation)
+        return self._copy(document, projection)
+
+    def get_many(self, doc_ids, projection=None):
+        """
+        Return several documents, fetching all misses in a single `$in` query.
+
+        Args:
+            doc_ids (list): The _ids of the documents. Duplicates are fetched once.
+            projection (dict, optional): Inclusion projection applied to the returned copies. Defaults to None.
+
+        Returns:
+            dict: A mapping of _id (str) to document copy. Missing documents are left out.
+        """
+        object_ids = list(dict.fromkeys(ObjectId(doc_id) for doc_id in doc_ids))
+        if not object_ids:
+            return {}
+        if not self.enabled:
+            documents = self.collection.find({"_id": {"$in": object_ids}}, projection)
+            return {str(document["_id"]): document for document in documents}
+
+        found = {}
+        missing = []
+        with self._lock:
+            for object_id in object_ids:
+                document = self._lookup(str(object_id))
+                if document is None:
+                    missing.append(object_id)
+                else:
+                    found[str(object_id)] = document
+            generation = self._generation
+        if missing:
+            loaded = {str(document["_id"]): document for document in self.collection.find({"_id": {"$in": missing}})}
+            self._store(loaded, generation)
+            found.update(loaded)
+        return {key: self._copy(document, projection) for key, document in found.items()}
+
+    def _store(self, documents, generation):
+        """Insert freshly loaded documents unless an invalidation happened while they were loading."""
+        loaded_at = time.monotonic()
+        with self._lock:
+            if generation != self._generation:
+                return
+            for key, document in documents.items():
+                self._entries[key] = (loaded_at, document)
+
+    def invalidate(self, doc_id):
+        """
+        Drop a document from the cache.
+
+        Args:
+            doc_id (str | ObjectId): The _id of the document to drop.
+        """
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.pop(str(doc_id), None)
+
+    def clear(self):
+        """Drop every cached document."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return hit ratio and staleness statistics for this cache.
+
+        Returns:
+            dict: Counters, the hit ratio, the current size and the oldest entry served (seconds).
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "max_age_served": round(self.max_age_served, 3)
+            }
+
+#! Recent history buffers -------------------------------------------------------
+class HistoryBuffer:
+    """
+    Thread-safe, process-local LRU of per-session ring buffers holding the latest messages.
+
+    Each buffer remembers the session's message_count at the time it was last brought up to
+    date. A buffer is only served while that count still matches the session's counter, so a
+    message written by another worker makes it fall back to MongoDB and refill.
+
+    Messages are passed in with their `_id`, which the buffer keeps to itself: a message is
+    written before the counter is incremented, so a refill in between can already hold the
+    message the writer is about to append.
+    """
+
+    def __init__(self, max_sessions=1024, window=50, enabled=True):
+        self.enabled = enabled
+        self.window = window
+        self._buffers = LRUCache(maxsize=max_sessions)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id, limit, message_count):
+        """
+        Return the latest `limit` messages of a session, oldest first, if the buffer can serve them.
+
+        Args:
+            session_id (str): The ID of the session.
+            limit (int): The number of messages wanted. 0 means all of them.
+            message_count (int): The session's current message counter.
+
+        Returns:
+            list | None: Copies of the messages, or None if MongoDB has to be queried.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._buffers.get(str(session_id))
+            complete = entry is not None and len(entry[1]) == entry[0]
+            if entry is None or entry[0] != message_count or not (complete or 0 < limit <= len(entry[1])):
+                self.misses += 1
+                return None
+            self.hits += 1
+            messages = list(entry[1])
+        if limit:
+            messages = messages[-limit:]
+        return [dict(message) for message in messages]
+
+    def fill(self, session_id, messages, message_count):
+        """
+        Replace the buffer of a session with messages read from MongoDB.
+
+        Args:
+            session_id (str): The ID of the session.
+            messages (list): The latest messages of the session with their _id, oldest first.
+            message_count (int): The counter read before the messages were queried.
+        """
+        if not self.enabled:
+            return
+        buffer = deque((_without_id(message) for message in messages), maxlen=self.window)
+        ids = deque((message.get("_id") for message in messages), maxlen=self.window)
+        with self._lock:
+            self._buffers[str(session_id)] = [message_count, buffer, ids]
+
+    def append(self, session_id, message, message_count):
+        """
+        Record a message this process just wrote.
+
+        The buffer is extended only if `message_count` follows on directly from the count it
+        holds; otherwise another worker wrote in between and the buffer is dropped. A message
+        a refill already picked up only moves the count on.
+
+        Args:
+            session_id (str): The ID of the session.
+            message (dict): The message that was written, with its _id.
+            message_count (int | None): The counter after the write, or None if unknown.
+        """
+        if not self.enabled:
+            return
+        key = str(session_id)
+        with self._lock:
+            entry = self._buffers.get(key)
+            if entry is not None and message_count is not None and entry[0] + 1 == message_count:
+                entry[0] = message_count
+                if message.get("_id") not in entry[2]:
+                    entry[1].append(_without_id(message))
+                    entry[2].append(message.get("_id"))
+            elif message_count == 1:
+                # First message of a new session: the buffer is trivially complete
+                self._buffers[key] = [1, deque([_without_id(message)], maxlen=self.window),
+                                      deque([message.get("_id")], maxlen=self.window)]
+            else:
+                self._buffers.pop(key, None)
+
+    def invalidate(self, session_id):
+        """Drop the buffer of a session."""
+        with self._lock:
+            self._buffers.pop(str(session_id), None)
+
+    def stats(self):
+        """
+        Return hit ratio statistics for the history buffers.
+
+        Returns:
+            dict: Counters, the hit ratio and the number of buffered sessions.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._buffers),
+                "window": self.window,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+def _without_id(message):
+    return {field: value for field, value in message.items() if field != "_id"}
+
+#! Shared caches ---------------------------------------------------------------
+agent_cache = DocumentCache(
+    "agents",
+    mongo_client.ai.agents,
+    maxsize=config.get("caching.documents.max_size", 2048),
+    ttl=config.get("caching.documents.ttl", 300),
+    enabled=config.get("caching.documents.enabled", True))
+
+session_cache = DocumentCache(
+    "sessions",
+    mongo_client.ai.sessions,
+    maxsize=config.get("caching.documents.max_size", 2048),
+    ttl=config.get("caching.documents.ttl", 300),
+    enabled=config.get("caching.documents.enabled", True))
+
+history_buffer = HistoryBuffer(
+    max_sessions=config.get("caching.history.max_sessions", 1024),
+    window=config.get("caching.history.window", 50),
+    enabled=config.get("caching.history.enabled", True))
+
+_caches_by_collection = {
+    "agents": agent_cache,
+    "sessions": session_cache
+}
+
+def cache_stats():
+    """
+    Return statistics for every document cache and the history buffers.
+
+    Returns:
+        dict: A mapping of cache name to its statistics.
+    """
+    stats = {name: cache.stats() for name, cache in _caches_by_collection.items()}
+    stats["history"] = history_buffer.stats()
+    return stats
+
+def cache_metrics():
+    """Export the cache counters in metrics snapshot form."""
+    stats = cache_stats()
+    def family(kind, field):
+        return {"type": kind, "help": "", "samples": [[{"cache": name}, values[field]] for name, values in stats.items()]}
+    return {
+        "cache_hits_total": family("counter", "hits"),
+        "cache_misses_total": family("counter", "misses"),
+        "cache_entries": family("gauge", "size")
+    }
+
+metrics.register_collector(cache_metrics)
+
+#! Cross-worker invalidation ----------------------------------------------------
+def _watch_for_invalidations():
+    """Invalidate cached documents whenever any worker changes them (requires a replica set)."""
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": list(_caches_by_collection)},
+        "operationType": {"$in": ["update", "replace", "delete"]}
+    }}]
+    resume_token = None
+    while True:
+        try:
+            with mongo_client.ai.watch(pipeline, resume_after=resume_token) as stream:
+                for change in stream:
+                    resume_token = stream.resume_token
+                    cache = _caches_by_collection.get(change["ns"]["coll"])
+                    if cache:
+                        cache.invalidate(change["documentKey"]["_id"])
+        except Exception as e:
+            log.error(f"Cache invalidation stream error: {str(e)}")
+            # Everything may have changed while we were disconnected
+            for cache in _caches_by_collection.values():
+                cache.clear()
+            time.sleep(config.get("caching.documents.retry_delay", 5))
+
+def start_invalidation_listener():
+    """
+    Start the cross-worker invalidation channel if it is enabled in config.
+
+    With `caching.documents.invalidation` set to "change_stream", a daemon thread follows
+    a MongoDB change stream on the `ai` database and drops any agent or session that another
+    worker modified. Otherwise only local invalidation and the TTL apply.
+
+    Returns:
+        bool: True if the listener was started.
+    """
+    if config.get("caching.documents.invalidation", "local") != "change_stream":
+        return False
+    threading.Thread(target=_watch_for_invalidations, name="cache-invalidation", daemon=True).start()
+    log.info("Started document cache invalidation listener")
+    return True
@@ -1,26 +1,18 @@
-import chromadb
 from bson import ObjectId
-from keys.keys import chroma_host, chroma_port, environment, openai_api_key
-from ultraconfiguration import UltraConfig
+from keys.keys import environment
+from utilities.settings import config, settings
 from ultraprint.logging import logger
-from openai import OpenAI
+from utilities.clients import chroma_client, openai_client
+from utilities.timing import timed
+from utilities import metrics
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('chroma_log', 
             filename='debug/chroma.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
-# Create the chroma client
-client = chromadb.HttpClient(
-    host=chroma_host,
-    port=chroma_port)
-
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=openai_api_key)
-
 #! ChromaDB functions ---------------------------------------------------------
 #* Check if ChromaDB connection is successful ---------------------------------
 def pingtest():
@@ -32,7 +24,7 @@ def pingtest():
     """
     # Send a ping to confirm a successful connection
     try:
-        client.list_collections()
+        chroma_client().list_collections()
         return True
     except Exception as e:
         print(e)
@@ -45,14 +37,14 @@ def create_collections():
     """
     all_collections = [col for col in config.get("chroma.structure", [])]
     # In v0.6.0, list_collections() directly returns collection names
-    existing_collections = client.list_collections()
+    existing_collections = chroma_client().list_collections()
     log.info(f"Existing collections: {existing_collections}")
     
     for collection in all_collections:
         if collection not in existing_collections:
             try:
                 log.success(f"Creating collection: {collection}")
-                client.create_collection(collection)
+                chroma_client().create_collection(collection)
             except Exception as e:
                 if "already exists" in str(e):
                     log.info(f"Collection {collection} already exists")
@@ -60,6 +52,7 @@ def create_collections():
                     log.error(f"Error creating collection {collection}: {str(e)}")
 
 #! Embedding Insertion & Querying ---------------------------------------------
+@timed("embed")
 def embed(texts):
     """
     Generate embeddings for single or multiple texts using OpenAI's API.
@@ -75,9 +68,12 @@ def embed(texts):
         if isinstance(texts, str):
             texts = [texts]
             
-        response = openai_client.embeddings.create(
+        model = settings().models.embedding
+        metrics.inc("embedding_requests_total", model=model)
+        metrics.inc("embedding_texts_total", len(texts), model=model)
+        response = openai_client().embeddings.create(
             input=texts,
-            model=config.get("models.embedding", "text-embedding-3-small")
+            model=model
         )
         
         # Return single embedding if input was single string
@@ -87,33 +83,39 @@ def embed(texts):
         return [item.embedding for item in response.data]
     except Exception as e:
         log.error(f"Error generating embeddings: {str(e)}")
+        metrics.inc("embedding_errors_total", model=settings().models.embedding)
         return None
 
-def insert_documents(agent_id, collection_id, documents, user_id=None, additional_metadata=None):
+@timed("chroma.insert")
+def insert_documents(agent_id, collection_id, documents, user_id=None, additional_metadata=None, ids=None):
     """
     Insert document(s) into shared collection with agent and collection identifiers.
 
+    With explicit `ids` the documents are upserted, so writing the same IDs again (e.g. when
+    a job is retried) replaces them instead of adding duplicates.
+
     Args:
         agent_id (str): The ID of the agent.
         collection_id (str): The ID of the collection.
         documents (str or list): The document(s) to insert.
         user_id (str, optional): The ID of the user. Defaults to None.
         additional_metadata (dict, optional): Additional metadata to store with the document(s). Defaults to None.
+        ids (list, optional): Stable IDs for the documents. Defaults to None (new IDs).
 
     Returns:
         tuple: A tuple containing a boolean indicating success and a list of inserted IDs.
     """
     try:
-        collection = client.get_collection("documents")
+        collection = chroma_client().get_collection("documents")
         
         # Handle single document vs list of documents
         if isinstance(documents, str):
             documents = [documents]
             additional_metadata = [additional_metadata] if additional_metadata else [{}]
-            ids = [str(ObjectId())]
         else:
             additional_metadata = additional_metadata if additional_metadata else [{} for _ in documents]
-            ids = [str(ObjectId()) for _ in documents]
+        write = collection.upsert if ids else collection.add
+        ids = list(ids) if ids else [str(ObjectId()) for _ in documents]
         
         # Generate embeddings
         embeddings = embed(documents)
@@ -133,7 +135,7 @@ def insert_documents(agent_id, collection_id, documents, user_id=None, additiona
             metadatas.append(metadata)
         
         # Insert into collection
-        collection.add(
+        write(
             embeddings=embeddings,
             documents=documents,
             metadatas=metadatas,
@@ -145,7 +147,8 @@ def insert_documents(agent_id, collection_id, documents, user_id=None, additiona
         log.error(f"Error inserting document(s): {str(e)}")
         return False, None
 
-def search_documents(agent_id, collection_id, query, n_results=5, similarity_threshold=config.get("chroma.threshold", 0.5)):
+@timed("chroma.search")
+def search_documents(agent_id, collection_id, query, n_results=5, similarity_threshold=None):
     """
     Search for similar documents in the shared collection filtered by agent and collection IDs.
 
@@ -154,13 +157,15 @@ def search_documents(agent_id, collection_id, query, n_results=5, similarity_thr
         collection_id (str): The ID of the collection.
         query (str or list): The query string(s) to search for.
         n_results (int, optional): The number of results to return. Defaults to 5.
-        similarity_threshold (float, optional): The minimum similarity threshold for a match. Defaults to config.get("chroma.threshold", 0.5).
+        similarity_threshold (float, optional): The minimum similarity threshold for a match. Defaults to `chroma.threshold`.
 
     Returns:
         dict or list: A dictionary or list of dictionaries containing the search results.
     """
+    if similarity_threshold is None:
+        similarity_threshold = settings().chroma.threshold
     try:
-        collection = client.get_collection("documents")
+        collection = chroma_client().get_collection("documents")
         
         # Handle single query vs multiple queries
         if isinstance(query, str):
@@ -235,7 +240,7 @@ def delete_agent_documents(agent_id):
         bool: True if the documents are successfully deleted, False otherwise.
     """
     try:
-        collection = client.get_collection("documents")
+        collection = chroma_client().get_collection("documents")
         collection.delete(where={"agent_id": str(agent_id)})
         log.success(f"Deleted all documents for agent {agent_id}")
         return True
@@ -255,7 +260,7 @@ def delete_file_documents(agent_id, file_id):
         bool: True if the documents are successfully deleted, False otherwise.
     """
     try:
-        collection = client.get_collection("documents")
+        collection = chroma_client().get_collection("documents")
         collection.delete(where={
             "agent_id": str(agent_id),
             "file_id": str(file_id)
@@ -278,7 +283,7 @@ def delete_collection_documents(agent_id, collection_id):
         bool: True if the documents are successfully deleted, False otherwise.
     """
     try:
-        collection = client.get_collection("documents")
+        collection = chroma_client().get_collection("documents")
         collection.delete(where={
             "agent_id": str(agent_id),
             "collection_id": collection_id
@@ -0,0 +1,235 @@
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from database.mongo import client as mongo_client
+from keys.keys import environment
+from utilities.settings import config
+from ultraprint.logging import logger
+import threading
+import time
+
+#! Initialize ---------------------------------------------------------------
+log = logger('migrations_log',
+            filename='debug/migrations.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False),
+            log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+
+migrations = mongo_client.jobs.migrations
+
+#! Checkpoints ----------------------------------------------------------------
+def get_checkpoint(name):
+    """Return the stored state of a migration, or None if it has never run."""
+    return migrations.find_one({"_id": name})
+
+def save_checkpoint(name, **fields):
+    """Upsert the state of a migration."""
+    fields["updated_at"] = datetime.now(timezone.utc)
+    migrations.update_one({"_id": name}, {"$set": fields}, upsert=True)
+
+#! Runner ---------------------------------------------------------------------
+def run_migration(name, collection, query, migrate_batch, projection=None, batch_size=None, pause=None, max_batches=None, restart=False):
+    """
+    Run a resumable, batched migration over the documents matching `query`.
+
+    Documents are processed in _id order, one batch at a time, and the last _id handled is
+    checkpointed in `jobs.migrations` after every batch, so a migration can be stopped and
+    resumed at any point and is safe to run while the API is serving traffic.
+
+    Args:
+        name (str): The checkpoint name.
+        collection: The pymongo collection to migrate.
+        query (dict): The filter selecting documents that still need migrating.
+        migrate_batch (callable): Called with a list of documents; returns a dict of counters to add.
+        projection (dict, optional): The fields migrate_batch needs. Defaults to None (full documents).
+        batch_size (int, optional): Documents per batch. Defaults to `mongo.migrations.batch_size`.
+        pause (float, optional): Seconds to sleep between batches. Defaults to `mongo.migrations.pause`.
+        max_batches (int, optional): Stop after this many batches. Defaults to None (run to completion).
+        restart (bool, optional): Ignore the stored checkpoint and scan from the beginning. Defaults to False.
+
+    Returns:
+        dict: The checkpoint after the run (last_id, counters, status).
+    """
+    batch_size = batch_size or config.get("mongo.migrations.batch_size", 500)
+    pause = config.get("mongo.migrations.pause", 0.05) if pause is None else pause
+
+    checkpoint = None if restart else get_checkpoint(name)
+    if checkpoint and checkpoint.get("status") == "completed":
+        log.info(f"Migration '{name}' already completed")
+        return checkpoint
+
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    counters = dict(checkpoint.get("counters", {})) if checkpoint else {}
+    save_checkpoint(name, status="running", last_id=last_id, counters=counters)
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        documents = list(collection.find(batch_query, projection).sort("_id", 1).limit(batch_size))
+        if not documents:
+            save_checkpoint(name, status="completed", last_id=last_id, counters=counters)
+            log.success(f"Migration '{name}' completed: {counters}")
+            return get_checkpoint(name)
+
+        for counter, value in migrate_batch(documents).items():
+            counters[counter] = counters.get(counter, 0) + value
+
+        last_id = documents[-1]["_id"]
+        batches += 1
+        save_checkpoint(name, status="running", last_id=last_id, counters=counters)
+        log.debug(f"Migration '{name}': {counters} so far (last _id {last_id})")
+        if pause:
+            time.sleep(pause)
+
+    save_checkpoint(name, status="paused", last_id=last_id, counters=counters)
+    log.info(f"Migration '{name}' paused after {batches} batches: {counters}")
+    return get_checkpoint(name)
+
+def start_migration(migration, **kwargs):
+    """
+    Run a migration function on a daemon thread.
+
+    Args:
+        migration (callable): The migration to run, e.g. `migrate_history_timestamps`.
+        **kwargs: Passed through to the migration.
+
+    Returns:
+        threading.Thread: The started thread.
+    """
+    def run():
+        try:
+            migration(**kwargs)
+        except Exception as e:
+            log.error(f"Migration {migration.__name__} failed: {str(e)}")
+
+    thread = threading.Thread(target=run, name=migration.__name__, daemon=True)
+    thread.start()
+    return thread
+
+#! History timestamps ---------------------------------------------------------
+def parse_timestamp(value):
+    """
+    Parse a legacy ISO 8601 history timestamp into a UTC datetime.
+
+    Args:
+        value (str): The stored timestamp.
+
+    Returns:
+        datetime | None: The parsed datetime, or None if the string is not a valid timestamp.
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def _convert_history_timestamps(documents):
+    """Convert one batch of history timestamps. Each update is conditional on the string it read."""
+    operations = []
+    skipped = 0
+    for document in documents:
+        parsed = parse_timestamp(document["timestamp"])
+        if parsed is None:
+            skipped += 1
+            continue
+        operations.append(UpdateOne(
+            {"_id": document["_id"], "timestamp": document["timestamp"]},
+            {"$set": {"timestamp": parsed}}
+        ))
+    converted = mongo_client.ai.history.bulk_write(operations, ordered=False).modified_count if operations else 0
+    return {"converted": converted, "skipped": skipped}
+
+def migrate_history_timestamps(**kwargs):
+    """
+    Convert history timestamps stored as ISO strings into BSON dates.
+
+    Values that cannot be parsed are counted as skipped and left untouched.
+
+    Args:
+        **kwargs: Passed through to `run_migration` (batch_size, pause, max_batches, restart).
+
+    Returns:
+        dict: The checkpoint after the run.
+    """
+    return run_migration("history_timestamps", mongo_client.ai.history,
+                         {"timestamp": {"$type": "string"}},
+                         _convert_history_timestamps, projection={"timestamp": 1}, **kwargs)
+
+#! Agent file lists -----------------------------------------------------------
+def _strip_agent_files(documents):
+    """Replace the legacy files array on a batch of agents with per-collection file counts."""
+    agent_ids = [document["_id"] for document in documents]
+    counts = {agent_id: {} for agent_id in agent_ids}
+    for group in mongo_client.ai.files.aggregate([
+        {"$match": {"agent_id": {"$in": agent_ids}}},
+        {"$group": {"_id": {"agent_id": "$agent_id", "collection_id": "$collection_id"}, "count": {"$sum": 1}}}
+    ]):
+        counts[group["_id"]["agent_id"]][str(group["_id"]["collection_id"])] = group["count"]
+
+    operations = []
+    for document in documents:
+        file_counts = {collection_id: counts[document["_id"]].get(collection_id, 0)
+                       for collection_id in document.get("collection_ids", [])}
+        # Files filed under a collection the agent no longer lists still count
+        for collection_id, count in counts[document["_id"]].items():
+            file_counts.setdefault(collection_id, count)
+        operations.append(UpdateOne(
+            {"_id": document["_id"]},
+            {"$set": {"file_counts": file_counts}, "$unset": {"files": ""}}
+        ))
+    migrated = mongo_client.ai.agents.bulk_write(operations, ordered=False).modified_count if operations else 0
+    return {"migrated": migrated}
+
+def migrate_agent_files(**kwargs):
+    """
+    Remove the legacy `files` array from agent documents and store `file_counts` instead.
+
+    File membership lives only in the `files` collection; the counts are recomputed from it,
+    so running the migration again with restart=True also repairs drifted counters.
+
+    Args:
+        **kwargs: Passed through to `run_migration` (batch_size, pause, max_batches, restart).
+
+    Returns:
+        dict: The checkpoint after the run.
+    """
+    query = {} if kwargs.get("restart") else {"$or": [{"files": {"$exists": True}}, {"file_counts": {"$exists": False}}]}
+    return run_migration("agent_files", mongo_client.ai.agents, query, _strip_agent_files,
+                         projection={"collection_ids": 1}, **kwargs)
+
+MIGRATIONS = {
+    "history_timestamps": migrate_history_timestamps,
+    "agent_files": migrate_agent_files
+}
+
+def start_configured_migrations():
+    """
+    Start the migrations listed in `mongo.migrations.run_on_startup` in the background.
+
+    Every API worker calls this at startup, so a migration whose checkpoint another process
+    updated in the last `mongo.migrations.stale_after` seconds is left to that process. A
+    completed migration returns at once.
+
+    Returns:
+        list: The names of the migrations started.
+    """
+    started = []
+    stale_after = config.get("mongo.migrations.stale_after", 60)
+    for name in config.get("mongo.migrations.run_on_startup", []):
+        if name not in MIGRATIONS:
+            log.error(f"Unknown migration '{name}' in mongo.migrations.run_on_startup")
+            continue
+        checkpoint = get_checkpoint(name)
+        if checkpoint and checkpoint.get("status") == "running":
+            updated_at = checkpoint["updated_at"]
+            if updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            if (datetime.now(timezone.utc) - updated_at).total_seconds() < stale_after:
+                log.info(f"Migration '{name}' is already running elsewhere")
+                continue
+        start_migration(MIGRATIONS[name])
+        started.append(name)
+    return started
@@ -1,17 +1,32 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from keys.keys import mongo_uri, environment
 from ultraprint.logging import logger
-from ultraconfiguration import UltraConfig
+from utilities.settings import config
+from utilities import metrics
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('mongo_log', 
             filename='debug/mongo.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
-client = MongoClient(mongo_uri)
+class CommandTimer(monitoring.CommandListener):
+    """Record the latency of every MongoDB command in the metrics registry."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.observe("mongo_command_duration_seconds", event.duration_micros / 1e6,
+                        database=event.database_name, command=event.command_name)
+
+    def failed(self, event):
+        metrics.observe("mongo_command_duration_seconds", event.duration_micros / 1e6,
+                        database=event.database_name, command=event.command_name)
+        metrics.inc("mongo_command_errors_total", database=event.database_name, command=event.command_name)
+
+client = MongoClient(mongo_uri, event_listeners=[CommandTimer()] if metrics.enabled else [])
 
 #! MongoDB functions ---------------------------------------------------------
 #* Check if MongoDB connection is successful ---------------------------------
@@ -92,5 +107,95 @@ def check_mongo_structure(verbose=True):
             
             if verbose:                
                 log.success(f"Collection '{collection_name}' exists")
+
+    if verbose:
+        log.info("\nChecking indexes...")
+    if not check_indexes(verbose=verbose):
+        all_ok = False
     return all_ok
 
+
+#* Ensure required indexes exist ----------------------------------------------
+def get_required_indexes():
+    """Get the required MongoDB indexes, as {db: {collection: [spec, ...]}}."""
+    return config.get("mongo.indexes", {})
+
+def index_keys(spec):
+    """Return the index keys of an index spec as a list of (field, direction) tuples."""
+    return [(field, direction) for field, direction in spec["keys"]]
+
+def existing_index_keys(db_name, collection_name):
+    """Return {index name: [(field, direction), ...]} for the indexes present on a collection."""
+    info = client[db_name][collection_name].index_information()
+    # Directions may come back as floats (1.0) depending on how the index was created
+    return {
+        name: [(field, int(direction) if isinstance(direction, float) else direction) for field, direction in index["key"]]
+        for name, index in info.items()
+    }
+
+def init_indexes():
+    """Create every index declared in config. Existing indexes are left untouched."""
+    for db_name, collections in get_required_indexes().items():
+        for collection_name, specs in collections.items():
+            collection = client[db_name][collection_name]
+            for spec in specs:
+                options = {k: v for k, v in spec.items() if k != "keys"}
+                name = collection.create_index(index_keys(spec), **options)
+                log.success(f"Ensured index '{name}' on '{db_name}.{collection_name}'")
+
+def check_indexes(verbose=True):
+    """Verify that every index declared in config exists."""
+    all_ok = True
+    for db_name, collections in get_required_indexes().items():
+        for collection_name, specs in collections.items():
+            existing = existing_index_keys(db_name, collection_name).values() if collection_exists(db_name, collection_name) else []
+            for spec in specs:
+                keys = index_keys(spec)
+                if keys in existing:
+                    if verbose:
+                        log.success(f"Index {keys} exists on '{db_name}.{collection_name}'")
+                else:
+                    log.error(f"Index {keys} is missing on '{db_name}.{collection_name}'!")
+                    all_ok = False
+    return all_ok
+
+def ensure_indexes():
+    """Apply and verify the configured indexes, as done at server startup."""
+    try:
+        init_indexes()
+        return check_indexes(verbose=False)
+    except Exception as e:
+        log.error(f"Error ensuring indexes: {str(e)}")
+        return False
+
+def index_report():
+    """
+    Report missing, unused and undeclared indexes for every configured collection.
+
+    Usage counts come from $indexStats and are reset whenever mongod restarts,
+    so an index reported as unused has not been used since then.
+
+    Returns:
+        dict: {"db.collection": {"missing": [...], "unused": [...], "undeclared": [...], "usage": {...}}}
+    """
+    report = {}
+    for db_name, collections in get_required_indexes().items():
+        for collection_name, specs in collections.items():
+            namespace = f"{db_name}.{collection_name}"
+            if not collection_exists(db_name, collection_name):
+                report[namespace] = {"missing": [index_keys(spec) for spec in specs], "unused": [], "undeclared": [], "usage": {}}
+                continue
+
+            existing = existing_index_keys(db_name, collection_name)
+            declared = [index_keys(spec) for spec in specs]
+            usage = {
+                stats["name"]: stats["accesses"]["ops"]
+                for stats in client[db_name][collection_name].aggregate([{"$indexStats": {}}])
+            }
+            report[namespace] = {
+                "missing": [keys for keys in declared if keys not in existing.values()],
+                "unused": [name for name, ops in usage.items() if ops == 0 and name != "_id_"],
+                "undeclared": [name for name, keys in existing.items() if keys not in declared and name != "_id_"],
+                "usage": usage
+            }
+    return report
@@ -5,10 +5,9 @@ from datetime import datetime, timezone
 import traceback
 from keys.keys import environment
 from ultraprint.logging import logger
-from ultraconfiguration import UltraConfig
+from utilities.settings import config
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('error_log', 
             filename='debug/error.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
@@ -1,24 +1,52 @@
 from database.mongo import client as mongo_client
 from keys.keys import environment
-from ultraconfiguration import UltraConfig
+from utilities.settings import config
 from ultraprint.logging import logger
 from datetime import datetime, timezone
 from bson import ObjectId
 from database.chroma import delete_agent_documents
+from database.cache import agent_cache
 import importlib  # added for dynamic tool import
 import importlib.util
 from pathlib import Path
 import os
 from utilities.save_json import convert_objectid_to_str
+from utilities.pagination import find_page
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('agents_log', 
             filename='debug/agents.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
+# Projection profiles for agent reads:
+#   chat    - only the fields the chat engines read on every turn
+#   listing - agents shown in lists
+#   detail  - a single agent with everything it stores
+# File membership lives in the files collection; "files" is only excluded to hide the legacy
+# array on agents that database.migrations.migrate_agent_files has not reached yet.
+AGENT_PROJECTIONS = {
+    "chat": {
+        "name": 1,
+        "role": 1,
+        "capabilities": 1,
+        "rules": 1,
+        "model_provider": 1,
+        "model": 1,
+        "max_history": 1,
+        "tools": 1,
+        "collection_ids": 1,
+        "max_memory_size": 1,
+        "agent_type": 1,
+        "user_id": 1,
+        "created_at": 1,
+        "updated_at": 1
+    },
+    "listing": {"files": 0},
+    "detail": {"files": 0}
+}
+
 #! Agent functions ---------------------------------------------------------
 def create_agent(name,
                 role="",
@@ -98,7 +126,7 @@ def create_agent(name,
         "max_history": max_history,
         "tools": tools,
         "collection_ids": collection_ids,  # Replace chroma_collections with collection_ids
-        "files": [],
+        "file_counts": {collection_id: 0 for collection_id in collection_ids},
         "max_memory_size": max_memory_size, 
         "created_at": datetime.now(timezone.utc),
         "agent_type": agent_type  # Replace system_agent with agent_type
@@ -125,7 +153,7 @@ def delete_agent(agent_id, user_id=None):
         ValueError: If the agent is not found or if the user is not authorized to delete the agent.
     """
     db = mongo_client.ai
-    agent = db.agents.find_one({"_id": ObjectId(agent_id)})
+    agent = db.agents.find_one({"_id": ObjectId(agent_id)}, {"user_id": 1})
     
     if not agent:
         raise ValueError("Agent not found")
@@ -141,8 +169,9 @@ def delete_agent(agent_id, user_id=None):
     
     # Delete agent record
     db.agents.delete_one({"_id": ObjectId(agent_id)})
+    agent_cache.invalidate(agent_id)
 
-def get_all_agents_for_user(user_id: str, limit=20, skip=0, sort_by="created_at", sort_order=-1):
+def get_all_agents_for_user(user_id: str, limit=20, skip=0, sort_by="created_at", sort_order=-1, cursor: str = None):
     """
     Return paginated and sorted list of agents that belong to a specific user.
 
@@ -152,23 +181,25 @@ def get_all_agents_for_user(user_id: str, limit=20, skip=0, sort_by="created_at"
         skip (int, optional): The number of agents to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the agents by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
 
     Returns:
-        list: A list of agents belonging to the user.
+        list: A list of agents belonging to the user. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
-    agents = list(db.agents.find({"user_id": str(user_id)}).sort(sort_by, sort_order).skip(skip).limit(limit))
+    agents, next_cursor = find_page(db.agents, {"user_id": str(user_id)}, sort_by, sort_order, limit, skip, cursor,
+                                   projection=AGENT_PROJECTIONS["listing"])
     for agent in agents:
         agent["_id"] = convert_objectid_to_str(agent["_id"])
         if "created_at" in agent:
             agent["created_at"] = agent["created_at"].isoformat() if hasattr(agent["created_at"], "isoformat") else convert_objectid_to_str(agent["created_at"])
         if "updated_at" in agent:
             agent["updated_at"] = agent["updated_at"].isoformat() if hasattr(agent["updated_at"], "isoformat") else convert_objectid_to_str(agent["updated_at"])
-        if "files" in agent:  # Added conversion for files list
-            agent["files"] = [convert_objectid_to_str(f) for f in agent["files"]]
+    if cursor is not None:
+        return {"data": agents, "next_cursor": next_cursor}
     return agents
 
-def get_all_nonprivate_agents_for_user(user_id: str, limit=20, skip=0, sort_by="created_at", sort_order=-1):
+def get_all_nonprivate_agents_for_user(user_id: str, limit=20, skip=0, sort_by="created_at", sort_order=-1, cursor: str = None):
     """
     Return paginated and sorted list of agents that belong to a specific user, excluding private agents.
 
@@ -178,26 +209,25 @@ def get_all_nonprivate_agents_for_user(user_id: str, limit=20, skip=0, sort_by="
         skip (int, optional): The number of agents to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the agents by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
 
     Returns:
-        list: A list of non-private agents belonging to the user.
+        list: A list of non-private agents belonging to the user. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
-    agents = list(db.agents.find({"user_id": str(user_id), "agent_type": {"$ne": "private"}})
-                .sort(sort_by, sort_order)
-                .skip(skip)
-                .limit(limit))
+    agents, next_cursor = find_page(db.agents, {"user_id": str(user_id), "agent_type": {"$ne": "private"}}, sort_by, sort_order, limit, skip, cursor,
+                                   projection=AGENT_PROJECTIONS["listing"])
     for agent in agents:
         agent["_id"] = convert_objectid_to_str(agent["_id"])
         if "created_at" in agent:
             agent["created_at"] = agent["created_at"].isoformat() if hasattr(agent["created_at"], "isoformat") else convert_objectid_to_str(agent["created_at"])
         if "updated_at" in agent:
             agent["updated_at"] = agent["updated_at"].isoformat() if hasattr(agent["updated_at"], "isoformat") else convert_objectid_to_str(agent["updated_at"])
-        if "files" in agent:  # Added conversion for files list
-            agent["files"] = [convert_objectid_to_str(f) for f in agent["files"]]
+    if cursor is not None:
+        return {"data": agents, "next_cursor": next_cursor}
     return agents
 
-def get_all_public_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1, user_id: str = None):
+def get_all_public_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1, user_id: str = None, cursor: str = None):
     """
     Return paginated and sorted list of public agents.
 
@@ -206,28 +236,27 @@ def get_all_public_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1,
         skip (int, optional): The number of agents to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the agents by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
         user_id (str, optional): The ID of the user requesting the agents. Defaults to None.
 
     Returns:
-        list: A list of public agents.
+        list: A list of public agents. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
-    agents = list(db.agents.find({"agent_type": "public"})
-                .sort(sort_by, sort_order)
-                .skip(skip)
-                .limit(limit))
+    agents, next_cursor = find_page(db.agents, {"agent_type": "public"}, sort_by, sort_order, limit, skip, cursor,
+                                   projection=AGENT_PROJECTIONS["listing"])
     for agent in agents:
         agent["_id"] = convert_objectid_to_str(agent["_id"])
         if "created_at" in agent:
             agent["created_at"] = agent["created_at"].isoformat() if hasattr(agent["created_at"], "isoformat") else convert_objectid_to_str(agent["created_at"])
         if "updated_at" in agent:
             agent["updated_at"] = agent["updated_at"].isoformat() if hasattr(agent["updated_at"], "isoformat") else convert_objectid_to_str(agent["updated_at"])
-        if "files" in agent:
-            agent["files"] = [convert_objectid_to_str(f) for f in agent["files"]]
         agent["own"] = True if user_id and agent.get("user_id") and str(agent["user_id"]) == user_id else False
+    if cursor is not None:
+        return {"data": agents, "next_cursor": next_cursor}
     return agents
 
-def get_all_approved_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1, user_id: str = None):
+def get_all_approved_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1, user_id: str = None, cursor: str = None):
     """
     Return paginated and sorted list of approved agents.
 
@@ -236,28 +265,27 @@ def get_all_approved_agents(limit=20, skip=0, sort_by="created_at", sort_order=-
         skip (int, optional): The number of agents to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the agents by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
         user_id (str, optional): The ID of the user requesting the agents. Defaults to None.
 
     Returns:
-        list: A list of approved agents.
+        list: A list of approved agents. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
-    agents = list(db.agents.find({"agent_type": "approved"})
-                .sort(sort_by, sort_order)
-                .skip(skip)
-                .limit(limit))
+    agents, next_cursor = find_page(db.agents, {"agent_type": "approved"}, sort_by, sort_order, limit, skip, cursor,
+                                   projection=AGENT_PROJECTIONS["listing"])
     for agent in agents:
         agent["_id"] = convert_objectid_to_str(agent["_id"])
         if "created_at" in agent:
             agent["created_at"] = agent["created_at"].isoformat() if hasattr(agent["created_at"], "isoformat") else convert_objectid_to_str(agent["created_at"])
         if "updated_at" in agent:
             agent["updated_at"] = agent["updated_at"].isoformat() if hasattr(agent["updated_at"], "isoformat") else convert_objectid_to_str(agent["updated_at"])
-        if "files" in agent:
-            agent["files"] = [convert_objectid_to_str(f) for f in agent["files"]]
         agent["own"] = True if user_id and agent.get("user_id") and str(agent["user_id"]) == user_id else False
+    if cursor is not None:
+        return {"data": agents, "next_cursor": next_cursor}
     return agents
 
-def get_all_system_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1, user_id: str = None):
+def get_all_system_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1, user_id: str = None, cursor: str = None):
     """
     Return paginated and sorted list of system agents.
 
@@ -266,28 +294,27 @@ def get_all_system_agents(limit=20, skip=0, sort_by="created_at", sort_order=-1,
         skip (int, optional): The number of agents to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the agents by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
         user_id (str, optional): The ID of the user requesting the agents. Defaults to None.
 
     Returns:
-        list: A list of system agents.
+        list: A list of system agents. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
-    agents = list(db.agents.find({"agent_type": "system"})
-                .sort(sort_by, sort_order)
-                .skip(skip)
-                .limit(limit))
+    agents, next_cursor = find_page(db.agents, {"agent_type": "system"}, sort_by, sort_order, limit, skip, cursor,
+                                   projection=AGENT_PROJECTIONS["listing"])
     for agent in agents:
         agent["_id"] = convert_objectid_to_str(agent["_id"])
         if "created_at" in agent:
             agent["created_at"] = agent["created_at"].isoformat() if hasattr(agent["created_at"], "isoformat") else convert_objectid_to_str(agent["created_at"])
         if "updated_at" in agent:
             agent["updated_at"] = agent["updated_at"].isoformat() if hasattr(agent["updated_at"], "isoformat") else convert_objectid_to_str(agent["updated_at"])
-        if "files" in agent:
-            agent["files"] = [convert_objectid_to_str(f) for f in agent["files"]]
         agent["own"] = True if user_id and agent.get("user_id") and str(agent["user_id"]) == user_id else False
+    if cursor is not None:
+        return {"data": agents, "next_cursor": next_cursor}
     return agents
 
-def get_agent(agent_id, user_id=None):
+def get_agent(agent_id, user_id=None, profile="detail"):
     """
     Return details of a single agent by agent_id.
 
@@ -296,6 +323,7 @@ def get_agent(agent_id, user_id=None):
     Args:
         agent_id (str): The ID of the agent to retrieve.
         user_id (str, optional): The ID of the user requesting the agent. Defaults to None.
+        profile (str, optional): The projection profile ("chat", "listing" or "detail"). Defaults to "detail".
 
     Returns:
         dict: The details of the agent.
@@ -303,8 +331,7 @@ def get_agent(agent_id, user_id=None):
     Raises:
         ValueError: If the agent is not found or if the user is not authorized to view the agent.
     """
-    db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    agent = agent_cache.get(agent_id, AGENT_PROJECTIONS[profile])
     if not agent:
         raise ValueError("Agent not found")
 
@@ -327,11 +354,23 @@ def get_agent(agent_id, user_id=None):
         agent["created_at"] = agent["created_at"].isoformat() if hasattr(agent["created_at"], "isoformat") else convert_objectid_to_str(agent["created_at"])
     if "updated_at" in agent:
         agent["updated_at"] = agent["updated_at"].isoformat() if hasattr(agent["updated_at"], "isoformat") else convert_objectid_to_str(agent["updated_at"])
-    if "files" in agent:
-        agent["files"] = [convert_objectid_to_str(file) for file in agent["files"]]
     
     return agent
 
+def get_agents_by_ids(agent_ids: list, profile: str = "detail", projection: dict = None) -> dict:
+    """
+    Load several agents in a single round trip. Cached agents are served without touching MongoDB.
+
+    Args:
+        agent_ids (list): The IDs of the agents to load. Duplicates are fetched once.
+        profile (str, optional): The projection profile ("chat", "listing" or "detail"). Defaults to "detail".
+        projection (dict, optional): An explicit projection, overriding the profile. Defaults to None.
+
+    Returns:
+        dict: A mapping of agent ID (str) to agent document. Agents that do not exist are left out.
+    """
+    return agent_cache.get_many(agent_ids, projection or AGENT_PROJECTIONS[profile])
+
 def get_available_tools():
     """
     Return a list of all available tools and their metadata.
@@ -397,7 +436,7 @@ def update_agent(agent_id, user_id=None, **updates):
         ValueError: If the agent is not found, if the user is not authorized to update the agent, or if any of the update parameters are invalid.
     """
     db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    agent = db.find_one({"_id": ObjectId(agent_id)}, {"user_id": 1})
     
     if not agent:
         raise ValueError("Agent not found")
@@ -431,12 +470,14 @@ def update_agent(agent_id, user_id=None, **updates):
         {"$set": valid_updates}
     )
 
+    agent_cache.invalidate(agent_id)
+
     if result.modified_count == 0:
         raise ValueError("No changes were made to the agent")
 
     return True
 
-def search_agents(query: str, limit: int = 20, skip: int = 0, types: list = None, sort_by: str = "created_at", sort_order: int = -1, user_id: str = None):
+def search_agents(query: str, limit: int = 20, skip: int = 0, types: list = None, sort_by: str = "created_at", sort_order: int = -1, user_id: str = None, cursor: str = None):
     """
     Search for agents matching the query in name, role, capabilities or rules.
 
@@ -451,10 +492,11 @@ def search_agents(query: str, limit: int = 20, skip: int = 0, types: list = None
         types (list, optional): A list of agent types to filter by. Defaults to None.
         sort_by (str, optional): The field to sort the agents by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
         user_id (str, optional): The ID of the user requesting the agents. Defaults to None.
 
     Returns:
-        list: A list of agents matching the search criteria.
+        list: A list of agents matching the search criteria. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai.agents
     regex = {"$regex": query, "$options": "i"}
@@ -475,14 +517,15 @@ def search_agents(query: str, limit: int = 20, skip: int = 0, types: list = None
         types = ["public", "approved", "system"]
     search_filter["agent_type"] = {"$in": types}
     
-    agents = list(db.find(search_filter).sort(sort_by, sort_order).skip(skip).limit(limit))
+    agents, next_cursor = find_page(db, search_filter, sort_by, sort_order, limit, skip, cursor,
+                                   projection=AGENT_PROJECTIONS["listing"])
     for agent in agents:
         agent["_id"] = convert_objectid_to_str(agent["_id"])
         if "created_at" in agent:
             agent["created_at"] = agent["created_at"].isoformat() if hasattr(agent["created_at"], "isoformat") else str(agent["created_at"])
         if "updated_at" in agent:
             agent["updated_at"] = agent["updated_at"].isoformat() if hasattr(agent["updated_at"], "isoformat") else str(agent["updated_at"])
-        if "files" in agent:
-            agent["files"] = [convert_objectid_to_str(f) for f in agent["files"]]
         agent["own"] = True if user_id and agent.get("user_id") and str(agent["user_id"]) == user_id else False
+    if cursor is not None:
+        return {"data": agents, "next_cursor": next_cursor}
     return agents
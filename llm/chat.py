@@ -1,35 +1,34 @@
-from database.mongo import client as mongo_client
-from keys.keys import environment, openai_api_key, cohere_api_key
-from ultraconfiguration import UltraConfig
+from keys.keys import environment
+from utilities.settings import config
 from ultraprint.logging import logger
 from bson import ObjectId, errors
-from openai import OpenAI
-import cohere
 from typing import Generator
-from llm.prompts import format_context, make_basic_prompt, format_system_message, make_system_injection_prompt
+from llm.prompts import format_context, format_system_message, make_system_injection_prompt
+from llm.prompt_builder import build_messages, persona_prompt, record_usage
 from database.chroma import search_documents
-from llm.sessions import update_session_history, get_recent_history
+from llm.sessions import update_session_history, get_recent_history, SESSION_PROJECTIONS
 from llm.tools import execute_tools  # Update import
 from concurrent.futures import ThreadPoolExecutor
 from llm.decision import analyze_for_memory, summarize_chat_history
 from datetime import datetime
+import time
 from llm.memory import get_memory, update_memory
 from llm.sessions import get_team_session_history, update_team_session_history
+from llm.agents import get_agents_by_ids, AGENT_PROJECTIONS
+from database.cache import agent_cache, session_cache
+from utilities.timing import span, timed, traced, record, current_trace, in_context
+from utilities import metrics
+from utilities.clients import openai_client, cohere_client
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('chat_log', 
             filename='debug/chat.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
-# Initialize clients
-openai_client = OpenAI(api_key=openai_api_key)
-cohere_client = cohere.Client(cohere_api_key)
-
 #! Getters and setters -------------------------------------------------------
-def get_relevant_context(agent_id: str, query: str, session_id: str) -> list:
+def get_relevant_context(agent_id: str, query: str, session_id: str, agent: dict = None) -> list:
     """
     Get relevant context using collection IDs.
 
@@ -37,16 +36,17 @@ def get_relevant_context(agent_id: str, query: str, session_id: str) -> list:
         agent_id (str): The ID of the agent.
         query (str): The query to search for.
         session_id (str): The ID of the session.
+        agent (dict, optional): The already loaded agent document. Defaults to None (loaded from MongoDB).
 
     Returns:
         list: A list of relevant context results.
     """
-    db = mongo_client.ai
-    agent = db.agents.find_one({"_id": ObjectId(agent_id)})
+    if agent is None:
+        agent = agent_cache.get(agent_id, AGENT_PROJECTIONS["chat"])
     if not agent:
         raise ValueError("Agent not found")
     
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})  # Changed from session_id to _id
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     
@@ -72,7 +72,7 @@ def format_history_for_cohere(history: list) -> list:
         list: A list of chat history messages in Cohere format.
     """
     cohere_history = []
-    preamble = ""
+    system_parts = []
     for msg in history:
         if msg["role"] != "system":  # Skip system messages
             role = "USER" if msg["role"] == "user" else "ASSISTANT"
@@ -81,99 +81,154 @@ def format_history_for_cohere(history: list) -> list:
                 "message": msg["content"]
             })
         else:
-            preamble = msg["content"]
-    return cohere_history, preamble
+            # The prefix-cache layout sends the persona and the turn's context as separate system messages
+            system_parts.append(msg["content"])
+    return cohere_history, "\n\n".join(system_parts)
+
+def openai_usage(usage) -> dict:
+    """Extract prompt, cached and completion token counts from an OpenAI usage object."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        "completion_tokens": usage.completion_tokens
+    }
+
+def cohere_usage(meta) -> dict:
+    """Extract prompt and completion token counts from a Cohere response meta object."""
+    billed_units = getattr(meta, "billed_units", None)
+    return {
+        "prompt_tokens": int(getattr(billed_units, "input_tokens", 0) or 0),
+        "cached_tokens": 0,
+        "completion_tokens": int(getattr(billed_units, "output_tokens", 0) or 0)
+    }
+
+def report_usage(provider: str, model: str, values: dict, usage: dict = None):
+    """Record provider token usage for a request and copy it into the caller's usage dict."""
+    record_usage(model, values)
+    for token_type in ("prompt", "cached", "completion"):
+        metrics.inc("llm_tokens_total", values.get(f"{token_type}_tokens") or 0, provider=provider, model=model, type=token_type)
+    if usage is not None:
+        usage.update(values)
 
 #? Chat functions ------------------------------------------------------------
-def chat_with_openai_sync(agent_id: str, messages: list):
+@timed("llm.openai")
+def chat_with_openai_sync(agent_id: str, messages: list, agent: dict = None, usage: dict = None):
     """
     Chat with OpenAI models (non-streaming).
 
     Args:
         agent_id (str): The ID of the agent.
         messages (list): A list of messages to send to the model.
+        agent (dict, optional): The already loaded agent document. Defaults to None (loaded from MongoDB).
+        usage (dict, optional): Filled with the token usage the provider reports. Defaults to None.
 
     Returns:
         str: The response from the OpenAI model.
     """
-    db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    if agent is None:
+        agent = agent_cache.get(agent_id, {"model": 1})
     
+    metrics.inc("llm_requests_total", provider="openai", model=agent["model"], mode="sync")
     try:
-        response = openai_client.chat.completions.create(
+        response = openai_client().chat.completions.create(
             model=agent["model"],
             messages=messages,
             stream=False
         )
+        if response.usage:
+            report_usage("openai", agent["model"], openai_usage(response.usage), usage)
         return str(response.choices[0].message.content)
     except Exception as e:
         log.error("OpenAI chat error: %s", str(e))
+        metrics.inc("llm_errors_total", provider="openai", model=agent["model"])
         raise
 
-def chat_with_openai_stream(agent_id: str, messages: list):
+def chat_with_openai_stream(agent_id: str, messages: list, agent: dict = None, usage: dict = None):
     """
     Chat with OpenAI models (streaming).
 
     Args:
         agent_id (str): The ID of the agent.
         messages (list): A list of messages to send to the model.
+        agent (dict, optional): The already loaded agent document. Defaults to None (loaded from MongoDB).
+        usage (dict, optional): Filled with the token usage the provider reports. Defaults to None.
 
     Yields:
         str: A stream of responses from the OpenAI model.
     """
-    db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    if agent is None:
+        agent = agent_cache.get(agent_id, {"model": 1})
     
-    response = openai_client.chat.completions.create(
+    metrics.inc("llm_requests_total", provider="openai", model=agent["model"], mode="stream")
+    response = openai_client().chat.completions.create(
         model=agent["model"],
         messages=messages,
-        stream=True
+        stream=True,
+        stream_options={"include_usage": True}
     )
     for chunk in response:
-        if chunk.choices[0].delta.content:
+        # The usage chunk comes last and has no choices
+        if chunk.usage:
+            report_usage("openai", agent["model"], openai_usage(chunk.usage), usage)
+        if chunk.choices and chunk.choices[0].delta.content:
             yield chunk.choices[0].delta.content
 
-def chat_with_cohere_sync(agent_id: str, messages: list):
+@timed("llm.cohere")
+def chat_with_cohere_sync(agent_id: str, messages: list, agent: dict = None, usage: dict = None):
     """
     Chat with Cohere models (non-streaming).
 
     Args:
         agent_id (str): The ID of the agent.
         messages (list): A list of messages to send to the model.
+        agent (dict, optional): The already loaded agent document. Defaults to None (loaded from MongoDB).
+        usage (dict, optional): Filled with the token usage the provider reports. Defaults to None.
 
     Returns:
         str: The response from the Cohere model.
     """
-    db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    if agent is None:
+        agent = agent_cache.get(agent_id, {"model": 1})
     
     chat_history, preamble = format_history_for_cohere(messages)
     
-    response = cohere_client.chat(
-        message=messages[-1]["content"],
-        model=agent["model"],
-        chat_history=chat_history[:-1],
-        preamble=preamble
-    )
+    metrics.inc("llm_requests_total", provider="cohere", model=agent["model"], mode="sync")
+    try:
+        response = cohere_client().chat(
+            message=messages[-1]["content"],
+            model=agent["model"],
+            chat_history=chat_history[:-1],
+            preamble=preamble
+        )
+    except Exception as e:
+        log.error("Cohere chat error: %s", str(e))
+        metrics.inc("llm_errors_total", provider="cohere", model=agent["model"])
+        raise
+    if getattr(response, "meta", None):
+        report_usage("cohere", agent["model"], cohere_usage(response.meta), usage)
     return str(response.text)
 
-def chat_with_cohere_stream(agent_id: str, messages: list):
+def chat_with_cohere_stream(agent_id: str, messages: list, agent: dict = None, usage: dict = None):
     """
     Chat with Cohere models (streaming).
 
     Args:
         agent_id (str): The ID of the agent.
         messages (list): A list of messages to send to the model.
+        agent (dict, optional): The already loaded agent document. Defaults to None (loaded from MongoDB).
+        usage (dict, optional): Filled with the token usage the provider reports. Defaults to None.
 
     Yields:
         str: A stream of responses from the Cohere model.
     """
-    db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    if agent is None:
+        agent = agent_cache.get(agent_id, {"model": 1})
     
     chat_history, preamble = format_history_for_cohere(messages)
     
-    response = cohere_client.chat(
+    metrics.inc("llm_requests_total", provider="cohere", model=agent["model"], mode="stream")
+    response = cohere_client().chat(
         message=messages[-1]["content"],
         model=agent["model"],
         chat_history=chat_history[:-1],
@@ -181,11 +236,14 @@ def chat_with_cohere_stream(agent_id: str, messages: list):
         stream=True
     )
     for event in response:
-        if event.text:
+        if getattr(event, "event_type", None) == "stream-end":
+            if getattr(event.response, "meta", None):
+                report_usage("cohere", agent["model"], cohere_usage(event.response.meta), usage)
+        elif getattr(event, "text", None):
             yield event.text
 
 #! Driver function -----------------------------------------------------------
-def handle_stream_response(session_id, response_stream, metadata=None):
+def handle_stream_response(session_id, response_stream, metadata=None, trace=None):
     """
     Wrap the streaming response to yield text first, then optional metadata.
 
@@ -193,12 +251,19 @@ def handle_stream_response(session_id, response_stream, metadata=None):
         session_id (str): The ID of the session.
         response_stream: The stream of responses.
         metadata (dict, optional): Additional metadata to include. Defaults to None.
+        trace (Trace, optional): The request trace; its timings are added to the metadata. Defaults to None.
 
     Yields:
         str: A stream of text and metadata.
     """
     full_response = ""
+    started = time.perf_counter()
+    first_token = True
     for chunk in response_stream:
+        if first_token:
+            # The provider request goes out on the first iteration, so this is the time to first token
+            record("llm.first_token", time.perf_counter() - started, started, trace)
+            first_token = False
         if isinstance(chunk, str):
             full_response += chunk
             yield chunk
@@ -210,6 +275,10 @@ def handle_stream_response(session_id, response_stream, metadata=None):
                     full_response += content
                     yield content
     
+    record("llm.stream", time.perf_counter() - started, started, trace)
+    if metadata and trace:
+        metadata["timings"] = trace.report()
+    
     # Update history with complete message
     update_session_history(session_id, "assistant", full_response, metadata=metadata)
     if metadata:
@@ -245,8 +314,7 @@ def verify_session_access(session_id: str, user_id: str = None) -> bool:
     if not user_id:
         return True
         
-    db = mongo_client.ai
-    session = db.sessions.find_one({"_id": session_id_obj})
+    session = session_cache.get(session_id_obj, SESSION_PROJECTIONS["chat"])
     if not session:
         return False
         
@@ -255,13 +323,14 @@ def verify_session_access(session_id: str, user_id: str = None) -> bool:
         return session["user_id"] == user_id  # Direct string comparison
         
     # If session doesn't have user_id, check agent ownership
-    agent = db.agents.find_one({"_id": session["agent_id"]})
+    agent = agent_cache.get(session["agent_id"], {"user_id": 1})
     if agent and "user_id" in agent:
         return agent["user_id"] == user_id  # Direct string comparison
         
     return True
 
 #* Main chat function --------------------------------------------------------
+@traced("chat")
 def chat(
     agent_id: str,
     session_id: str,
@@ -282,6 +351,7 @@ def chat(
         use_rag (bool, optional): Whether to use RAG. Defaults to True.
         user_id (str, optional): The ID of the user. Defaults to None.
         include_rich_response (bool, optional): Whether to include rich response. Defaults to True.
+        include_timings (bool, optional): Whether to add per-stage "timings" to the rich response. Defaults to False.
 
     Returns:
         Generator[str, None, None] | str: The response from the chat function.
@@ -290,14 +360,14 @@ def chat(
     if not verify_session_access(session_id, user_id):
         raise ValueError("Not authorized to access this session")
 
-    db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    agent = agent_cache.get(agent_id, AGENT_PROJECTIONS["chat"])
     if not agent:
         raise ValueError("Agent not found")
 
     # Get recent history and add system message
     try:
-        history_response = get_recent_history(session_id, user_id, limit=agent.get("max_history", 10))
+        with span("chat.history_read"):
+            history_response = get_recent_history(session_id, user_id, limit=agent.get("max_history", 10), include_total=False, profile="chat")
         messages = history_response.get("history", [])
         # Keep only role and content fields, remove timestamps
         messages = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
@@ -311,8 +381,8 @@ def chat(
             log.debug("Analyzing tool need and memory storage")
             log.debug("Agent tools: %s", agent["tools"])
 
-            tool_future = executor.submit(execute_tools, agent, message, messages)
-            memory_future = executor.submit(analyze_for_memory, message)
+            tool_future = executor.submit(in_context(execute_tools), agent, message, messages)
+            memory_future = executor.submit(in_context(analyze_for_memory), message)
             
             memory_result = memory_future.result()
             if memory_result["to_remember"]:
@@ -335,67 +405,70 @@ def chat(
 
     # Get relevant context if RAG is enabled
     try:
-        context_results = get_relevant_context(agent_id, message, session_id) if use_rag else []
+        with span("chat.rag"):
+            context_results = get_relevant_context(agent_id, message, session_id, agent=agent) if use_rag else []
     except Exception as e:
         log.error("Error getting context: %s", str(e))
         context_results = []
     
     try:
-        memory_items = get_memory(agent_id, user_id)
+        with span("chat.memory_read"):
+            memory_items = get_memory(agent_id, user_id)
     except Exception:
         memory_items = []
     
     # Format all messages
-    #* Format context
-    try:
-        formatted_context = format_context(context_results, memory_items)
-    except Exception as e:
-        log.error("Error formatting context: %s", str(e))
-        formatted_context = ""
-
     #* Format basic prompt
     try:
-        prompt = make_basic_prompt(agent["name"], agent["role"], agent["capabilities"], agent["rules"])
+        prompt = persona_prompt(agent)
     except Exception as e:
         log.error("Error making basic prompt: %s", str(e))
         prompt = ""
 
-    #* Format system message
-    try:
-        system_message = format_system_message(prompt, formatted_context, tool_text)
-    except Exception as e:
-        log.error("Error formatting system message: %s", str(e))
-        system_message = ""
-    
-    # Make sure system message and messages are strings
-    system_message = str(system_message)
     message = str(message)
 
-    # Add system message and user message
-    messages.extend([
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": message}
-    ])
+    #* Assemble history, system message and user message within the model's token budget
+    try:
+        # Recent history comes back newest first; the model reads it oldest first
+        messages, prompt_report = build_messages(agent["model"], prompt, message,
+                                                 history=list(reversed(messages)),
+                                                 context_results=context_results,
+                                                 memory=memory_items,
+                                                 tool_response=tool_text)
+    except Exception as e:
+        log.error("Error building prompt: %s", str(e))
+        prompt_report = None
+        system_message = str(format_system_message(prompt, format_context(context_results, memory_items), tool_text))
+        messages.extend([
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": message}
+        ])
 
     # Update history
     #TODO: Do this in parallel
     try:
-        update_session_history(session_id, "user", message)
+        with span("chat.history_write"):
+            update_session_history(session_id, "user", message)
     except Exception as e:
         log.error("Error updating session history: %s", str(e))
 
+    # Provider token usage, including cached prompt tokens, lands in the prompt report
+    usage = {}
+    if prompt_report is not None:
+        prompt_report["usage"] = usage
+
     try:
         # Route to appropriate chat function
         if agent["model_provider"] == "openai":
             if stream:
-                response = chat_with_openai_stream(agent_id, messages)
+                response = chat_with_openai_stream(agent_id, messages, agent=agent, usage=usage)
             else:
-                response = chat_with_openai_sync(agent_id, messages)
+                response = chat_with_openai_sync(agent_id, messages, agent=agent, usage=usage)
         else:  # cohere
             if stream:
-                response = chat_with_cohere_stream(agent_id, messages)
+                response = chat_with_cohere_stream(agent_id, messages, agent=agent, usage=usage)
             else:
-                response = chat_with_cohere_sync(agent_id, messages)
+                response = chat_with_cohere_sync(agent_id, messages, agent=agent, usage=usage)
 
         if stream:
             if include_rich_response:
@@ -404,9 +477,10 @@ def chat(
                     "tools_used": tool_used,
                     "tools_not_used": tool_not_used,
                     "memories_used": memory_items,
-                    "context_results": context_results 
+                    "context_results": context_results,
+                    "prompt_tokens": prompt_report
                 }
-                return handle_stream_response(session_id, response, metadata=tool_info)
+                return handle_stream_response(session_id, response, metadata=tool_info, trace=current_trace())
             else:
                 return handle_stream_response(session_id, response)
         else:
@@ -429,7 +503,8 @@ def chat(
                     "tools_used": tool_used,
                     "tools_not_used": tool_not_used,
                     "memories_used": memory_items,
-                    "context_results": context_results  # Add context results here
+                    "context_results": context_results,  # Add context results here
+                    "prompt_tokens": prompt_report
                 }
                 update_session_history(session_id, "assistant", final_response, metadata=tool_info)
             else:
@@ -442,7 +517,9 @@ def chat(
                     "tools_used": tool_used,
                     "tools_not_used": tool_not_used,
                     "memories_used": memory_items,
-                    "context_results": context_results  # Add context results here
+                    "context_results": context_results,  # Add context results here
+                    "prompt_tokens": prompt_report,
+                    "timings": current_trace().report() if current_trace() else None
                 }
             else:
                 return final_response
@@ -456,7 +533,7 @@ def chat(
 
 #! Team chat functions -------------------------------------------------------
 #* Basic team chat functions -------------------------------------------------
-def handle_team_stream_response(session_id: str, agent_id: str, response_stream, metadata=None, summary=False):
+def handle_team_stream_response(session_id: str, agent_id: str, response_stream, metadata=None, summary=False, trace=None):
     """
     Stream response with a prepended agent tag.
 
@@ -466,6 +543,7 @@ def handle_team_stream_response(session_id: str, agent_id: str, response_stream,
         response_stream: The stream of responses.
         metadata (dict, optional): Additional metadata to include. Defaults to None.
         summary (bool, optional): Whether the response is a summary. Defaults to False.
+        trace (Trace, optional): The request trace; its timings are added to the metadata. Defaults to None.
 
     Yields:
         str: A stream of text and metadata.
@@ -477,7 +555,12 @@ def handle_team_stream_response(session_id: str, agent_id: str, response_stream,
         prefix = f"[agent {agent_id}]\n"
         yield prefix
     full_response = ""
+    started = time.perf_counter()
+    first_token = True
     for chunk in response_stream:
+        if first_token:
+            record("llm.first_token", time.perf_counter() - started, started, trace)
+            first_token = False
         if isinstance(chunk, str):
             full_response += chunk
             yield chunk
@@ -487,11 +570,15 @@ def handle_team_stream_response(session_id: str, agent_id: str, response_stream,
                 if content:
                     full_response += content
                     yield content
+    record("llm.stream", time.perf_counter() - started, started, trace)
+    if metadata and trace:
+        metadata["timings"] = trace.report()
     # Update team session history with full response and metadata
     update_team_session_history(session_id, agent_id, "assistant", full_response, metadata=metadata, summary=summary)
     if metadata:
         yield f"\n[metadata]={metadata}"
 
+@traced("team.agent_chat")
 def each_team_agent_chat(
     agent_id: str,
     session_id: str,
@@ -500,7 +587,8 @@ def each_team_agent_chat(
     use_rag: bool = True,
     user_id: str = None,
     include_rich_response: bool = True,
-    system_msg_injection: str = None
+    system_msg_injection: str = None,
+    agent: dict = None
 ):
     """
     Handle chat for each team agent.
@@ -514,20 +602,23 @@ def each_team_agent_chat(
         user_id (str, optional): The ID of the user. Defaults to None.
         include_rich_response (bool, optional): Whether to include rich response. Defaults to True.
         system_msg_injection (str, optional): System message injection. Defaults to None.
+        agent (dict, optional): The agent document preloaded by the team engine. Defaults to None (loaded from MongoDB).
+        include_timings (bool, optional): Whether to add per-stage "timings" to the rich response. Defaults to False.
 
     Returns:
         Generator[str, None, None] | str: The response from the chat function.
     """
     # Save original message input
     provided_message = message
-    db = mongo_client.ai.agents
-    agent = db.find_one({"_id": ObjectId(agent_id)})
+    if agent is None:
+        agent = agent_cache.get(agent_id, AGENT_PROJECTIONS["chat"])
     if not agent:
         raise ValueError("Agent not found")
 
     # Get recent history and add system message
     try:
-        history_response = get_team_session_history(session_id, user_id, limit=agent.get("max_history", 10))
+        with span("chat.history_read"):
+            history_response = get_team_session_history(session_id, user_id, limit=agent.get("max_history", 10), include_total=False, profile="chat")
         history_messages = history_response.get("history", [])
         processed_messages = []
         for msg in history_messages:
@@ -553,9 +644,9 @@ def each_team_agent_chat(
         with ThreadPoolExecutor(max_workers=2) as executor:
             log.debug("Analyzing tool need and memory storage")
             log.debug("Agent tools: %s", agent["tools"])
-            tool_future = executor.submit(execute_tools, agent, message, messages)
+            tool_future = executor.submit(in_context(execute_tools), agent, message, messages)
             if provided_message:
-                memory_future = executor.submit(analyze_for_memory, message)
+                memory_future = executor.submit(in_context(analyze_for_memory), message)
                 memory_result = memory_future.result()
             else:
                 memory_result = {"to_remember": []}
@@ -579,75 +670,75 @@ def each_team_agent_chat(
     
     # Get relevant context if RAG is enabled
     try:
-        context_results = get_relevant_context(agent_id, message, session_id) if use_rag else []
+        with span("chat.rag"):
+            context_results = get_relevant_context(agent_id, message, session_id, agent=agent) if use_rag else []
     except Exception as e:
         log.error("Error getting context: %s", str(e))
         context_results = []
     
     try:
         if provided_message:
-            memory_items = get_memory(agent_id, user_id)
+            with span("chat.memory_read"):
+                memory_items = get_memory(agent_id, user_id)
         else:
             memory_items = []
     except Exception:
         memory_items = []
     
     # Format all messages
-    #* Format context
-    try:
-        formatted_context = format_context(context_results, memory_items)
-    except Exception as e:
-        log.error("Error formatting context: %s", str(e))
-        formatted_context = ""
-
     #* Format basic prompt
     try:
-        prompt = make_basic_prompt(agent["name"], agent["role"], agent["capabilities"], agent["rules"])
+        prompt = persona_prompt(agent)
     except Exception as e:
         log.error("Error making basic prompt: %s", str(e))
         prompt = ""
 
-    #* Format system message
-    try:
-        system_message = format_system_message(prompt, formatted_context, tool_text)
-    except Exception as e:
-        log.error("Error formatting system message: %s", str(e))
-        system_message = ""
-    
-    # Make sure system message and messages are strings
-    system_message = str(system_message)
-
-    # Inject system message if provided
-    if system_msg_injection:
-        system_message = system_message + "\n" + str(system_msg_injection)
-
     message = str(message)
 
-    # Add system message and user message
-    messages.extend([
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": message}
-    ])
+    #* Assemble history, system message and user message within the model's token budget
+    try:
+        messages, prompt_report = build_messages(agent["model"], prompt, message,
+                                                 history=messages,
+                                                 context_results=context_results,
+                                                 memory=memory_items,
+                                                 tool_response=tool_text,
+                                                 system_injection=system_msg_injection)
+    except Exception as e:
+        log.error("Error building prompt: %s", str(e))
+        prompt_report = None
+        system_message = str(format_system_message(prompt, format_context(context_results, memory_items), tool_text))
+        if system_msg_injection:
+            system_message = system_message + "\n" + str(system_msg_injection)
+        messages.extend([
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": message}
+        ])
 
     # Only update history if a new message was supplied.
     if provided_message:
         try:
-            update_team_session_history(session_id, agent_id, "user", message)
+            with span("chat.history_write"):
+                update_team_session_history(session_id, agent_id, "user", message)
         except Exception as e:
             log.error("Error updating session history: %s", str(e))
 
+    # Provider token usage, including cached prompt tokens, lands in the prompt report
+    usage = {}
+    if prompt_report is not None:
+        prompt_report["usage"] = usage
+
     try:
         # Route to appropriate chat function
         if agent["model_provider"] == "openai":
             if stream:
-                response = chat_with_openai_stream(agent_id, messages)
+                response = chat_with_openai_stream(agent_id, messages, agent=agent, usage=usage)
             else:
-                response = chat_with_openai_sync(agent_id, messages)
+                response = chat_with_openai_sync(agent_id, messages, agent=agent, usage=usage)
         else:  # cohere
             if stream:
-                response = chat_with_cohere_stream(agent_id, messages)
+                response = chat_with_cohere_stream(agent_id, messages, agent=agent, usage=usage)
             else:
-                response = chat_with_cohere_sync(agent_id, messages)
+                response = chat_with_cohere_sync(agent_id, messages, agent=agent, usage=usage)
 
         if stream:
             if include_rich_response:
@@ -656,10 +747,11 @@ def each_team_agent_chat(
                     "tools_used": tool_used,
                     "tools_not_used": tool_not_used,
                     "memories_used": memory_items,
-                    "context_results": context_results 
+                    "context_results": context_results,
+                    "prompt_tokens": prompt_report
                 }
                 # Use the new team streaming handler instead of handle_stream_response
-                return handle_team_stream_response(session_id, agent_id, response, metadata=tool_info)
+                return handle_team_stream_response(session_id, agent_id, response, metadata=tool_info, trace=current_trace())
             else:
                 return handle_team_stream_response(session_id, agent_id, response)
         else:
@@ -682,7 +774,8 @@ def each_team_agent_chat(
                     "tools_used": tool_used,
                     "tools_not_used": tool_not_used,
                     "memories_used": memory_items,
-                    "context_results": context_results  # Add context results here
+                    "context_results": context_results,  # Add context results here
+                    "prompt_tokens": prompt_report
                 }
                 update_team_session_history(session_id, agent_id, "assistant", final_response, metadata=tool_info)
             else:
@@ -696,7 +789,9 @@ def each_team_agent_chat(
                     "tools_used": tool_used,
                     "tools_not_used": tool_not_used,
                     "memories_used": memory_items,
-                    "context_results": context_results  # Add context results here
+                    "context_results": context_results,  # Add context results here
+                    "prompt_tokens": prompt_report,
+                    "timings": current_trace().report() if current_trace() else None
                 }
             else:
                 return final_response
@@ -709,7 +804,8 @@ def each_team_agent_chat(
             return fallback_message
 
 #? Basic team chat function --------------------------------------------------
-def team_chat(session_id: str, message: str, stream: bool = False, use_rag: bool = True, user_id: str = None, include_rich_response: bool = True):
+def team_chat(session_id: str, message: str, stream: bool = False, use_rag: bool = True, user_id: str = None, include_rich_response: bool = True,
+              include_timings: bool = False):
     """
     For a team session, have each selected agent answer the question sequentially.
     In non-stream mode, returns a dict with responses and an aggregated conversation.
@@ -722,13 +818,12 @@ def team_chat(session_id: str, message: str, stream: bool = False, use_rag: bool
         use_rag (bool, optional): Whether to use RAG. Defaults to True.
         user_id (str, optional): The ID of the user. Defaults to None.
         include_rich_response (bool, optional): Whether to include rich response. Defaults to True.
+        include_timings (bool, optional): Whether to add per-stage "timings" to each agent's rich response. Defaults to False.
 
     Returns:
         dict | Generator[str, None, None]: The responses from the team chat function.
     """
-    from bson import ObjectId
-    db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     if session.get("session_type") != "team":
@@ -737,6 +832,9 @@ def team_chat(session_id: str, message: str, stream: bool = False, use_rag: bool
     if not team_agents:
         raise ValueError("No team agents found in session")
     
+    # Load every team agent once for the whole turn
+    loaded_agents = get_agents_by_ids([agent["agent_id"] for agent in team_agents], profile="chat")
+
     #all agents
     all_agents_name = []
     for agent in team_agents:
@@ -761,14 +859,16 @@ def team_chat(session_id: str, message: str, stream: bool = False, use_rag: bool
                 use_rag=use_rag,
                 user_id=user_id,
                 include_rich_response=include_rich_response,
-                system_msg_injection=system_prompt_injection
+                include_timings=include_timings,
+                system_msg_injection=system_prompt_injection,
+                agent=loaded_agents.get(agent_id)
             )
             i += 1
             responses[agent_id] = response
             conversation_lines.append(f"[Agent {agent_id}] : {response}")
         conversation = "\n".join(conversation_lines)
 
-        history_response = get_team_session_history(session_id, user_id, limit=i + 1)
+        history_response = get_team_session_history(session_id, user_id, limit=i + 1, include_total=False, profile="chat")
         summary = summarize_chat_history(history_response.get("history", [])).get("summary", "")
         if summary:
             responses["summary"] = summary
@@ -792,14 +892,16 @@ def team_chat(session_id: str, message: str, stream: bool = False, use_rag: bool
                     use_rag=use_rag,
                     user_id=user_id,
                     include_rich_response=include_rich_response,
-                    system_msg_injection=system_prompt_injection
+                    include_timings=include_timings,
+                    system_msg_injection=system_prompt_injection,
+                    agent=loaded_agents.get(agent_id)
                 )
                 i += 1
                 for chunk in response_gen:
                     yield chunk
                 yield "\n"  # Separate agents' responses
             # get complete history
-            history_response = get_team_session_history(session_id, user_id, limit=i + 1)
+            history_response = get_team_session_history(session_id, user_id, limit=i + 1, include_total=False, profile="chat")
             summary = summarize_chat_history(history_response.get("history", [])).get("summary", "")
             if summary:
                 #handle_team_stream_response to add the summary
@@ -808,7 +910,7 @@ def team_chat(session_id: str, message: str, stream: bool = False, use_rag: bool
         return stream_generator_team()
 
 def team_chat_managed(session_id: str, message: str, stream: bool = False, use_rag: bool = True,
-                        user_id: str = None, include_rich_response: bool = True):
+                        user_id: str = None, include_rich_response: bool = True, include_timings: bool = False):
     """
     Managed team chat: first, use team_managed_decision to determine the order of agents,
     then execute the agents in that order. Otherwise, behavior is similar to team_chat.
@@ -820,15 +922,14 @@ def team_chat_managed(session_id: str, message: str, stream: bool = False, use_r
         use_rag (bool, optional): Whether to use RAG. Defaults to True.
         user_id (str, optional): The ID of the user. Defaults to None.
         include_rich_response (bool, optional): Whether to include rich response. Defaults to True.
+        include_timings (bool, optional): Whether to add per-stage "timings" to each agent's rich response. Defaults to False.
 
     Returns:
         dict | Generator[str, None, None]: The responses from the managed team chat function.
     """
-    from bson import ObjectId
     from llm.decision import team_managed_decision  # new import for managed decision
 
-    db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     if session.get("session_type") != "team-managed":
@@ -837,11 +938,11 @@ def team_chat_managed(session_id: str, message: str, stream: bool = False, use_r
     if not team_agents:
         raise ValueError("No team agents found in session")
     
-    # Original team_agents contains only id and name; load full agent details.
+    # Original team_agents contains only id and name; load full agent details in one round trip.
+    loaded_agents = get_agents_by_ids([agent.get("agent_id") for agent in team_agents], profile="chat")
     full_team_agents = []
     for agent in team_agents:
-        agent_id = agent.get("agent_id")
-        full_agent = db.agents.find_one({"_id": ObjectId(agent_id)})
+        full_agent = loaded_agents.get(agent.get("agent_id"))
         if full_agent:
             full_agent["agent_id"] = str(full_agent["_id"])
             full_team_agents.append(full_agent)
@@ -860,7 +961,7 @@ def team_chat_managed(session_id: str, message: str, stream: bool = False, use_r
     } for agent in full_team_agents]
 
     # Retrieve team session history
-    history_response = get_team_session_history(session_id, user_id, limit=len(team_agents) + 1)
+    history_response = get_team_session_history(session_id, user_id, limit=len(team_agents) + 1, include_total=False, profile="chat")
     chat_history = history_response.get("history", [])
 
     # Determine the execution order using the managed decision function
@@ -888,14 +989,16 @@ def team_chat_managed(session_id: str, message: str, stream: bool = False, use_r
                 use_rag=use_rag,
                 user_id=user_id,
                 include_rich_response=include_rich_response,
-                system_msg_injection=system_prompt_injection
+                include_timings=include_timings,
+                system_msg_injection=system_prompt_injection,
+                agent=loaded_agents.get(agent_id)
             )
             responses[agent_id] = response
             conversation_lines.append(f"[Agent {agent_id}] : {response}")
         conversation = "\n".join(conversation_lines)
 
         # Update summary from team session history
-        history_response = get_team_session_history(session_id, user_id, limit=len(team_agents) + 1)
+        history_response = get_team_session_history(session_id, user_id, limit=len(team_agents) + 1, include_total=False, profile="chat")
         summary = summarize_chat_history(history_response.get("history", [])).get("summary", "")
         if summary:
             responses["summary"] = summary
@@ -919,20 +1022,23 @@ def team_chat_managed(session_id: str, message: str, stream: bool = False, use_r
                     use_rag=use_rag,
                     user_id=user_id,
                     include_rich_response=include_rich_response,
-                    system_msg_injection=system_prompt_injection
+                    include_timings=include_timings,
+                    system_msg_injection=system_prompt_injection,
+                    agent=loaded_agents.get(agent_id)
                 )
                 for chunk in response_gen:
                     yield chunk
                 yield "\n"  # Separate agents' responses
             # After agents, update and stream summary if available
-            history_response = get_team_session_history(session_id, user_id, limit=len(team_agents) + 1)
+            history_response = get_team_session_history(session_id, user_id, limit=len(team_agents) + 1, include_total=False, profile="chat")
             summary = summarize_chat_history(history_response.get("history", [])).get("summary", "")
             if summary:
                 yield from handle_team_stream_response(session_id, None, stream_generator(summary), summary=True)
         return stream_generator_team_managed()
 
 def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag: bool = True,
-                    user_id: str = None, include_rich_response: bool = True, max_steps: int = 50):
+                    user_id: str = None, include_rich_response: bool = True, max_steps: int = 50,
+                    include_timings: bool = False):
     """
     Flow-based team chat where next agent is decided based on conversation context.
     Limits the maximum number of agent responses to prevent infinite loops.
@@ -945,15 +1051,14 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
         user_id (str, optional): The ID of the user. Defaults to None.
         include_rich_response (bool, optional): Whether to include rich response. Defaults to True.
         max_steps (int, optional): The maximum number of steps. Defaults to 50.
+        include_timings (bool, optional): Whether to add per-stage "timings" to each agent's rich response. Defaults to False.
 
     Returns:
         dict | Generator[str, None, None]: The responses from the flow-based team chat function.
     """
-    from bson import ObjectId
     from llm.decision import team_flow_decision
 
-    db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     if session.get("session_type") != "team-flow":
@@ -962,11 +1067,11 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
     if not team_agents:
         raise ValueError("No team agents found in session")
 
-    # Load full agent details
+    # Load full agent details in one round trip
+    loaded_agents = get_agents_by_ids([agent.get("agent_id") for agent in team_agents], profile="chat")
     full_team_agents = []
     for agent in team_agents:
-        agent_id = agent.get("agent_id")
-        full_agent = db.agents.find_one({"_id": ObjectId(agent_id)})
+        full_agent = loaded_agents.get(agent.get("agent_id"))
         if full_agent:
             full_agent["agent_id"] = str(full_agent["_id"])
             full_team_agents.append(full_agent)
@@ -987,7 +1092,7 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
         
         while steps_taken < max_steps:
             # Get current history for decision making
-            history_response = get_team_session_history(session_id, user_id)
+            history_response = get_team_session_history(session_id, user_id, include_total=False, profile="chat")
             chat_history = history_response.get("history", [])
             
             # Create decision agents list
@@ -1007,7 +1112,7 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
             # Find agent info for the selected agent
             agent_info = next((a for a in team_agents if a["agent_id"] == next_agent), 
                             {"agent_name": f"Agent {next_agent}"})
-            agent_name = agent_info.get("agent_name", f"Agent {agent_id}")
+            agent_name = agent_info.get("agent_name", f"Agent {next_agent}")
             system_prompt_injection = make_system_injection_prompt(all_agents_name, agent_name)
             
             # Get agent's response
@@ -1019,7 +1124,9 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
                 use_rag=use_rag,
                 user_id=user_id,
                 include_rich_response=include_rich_response,
-                system_msg_injection=system_prompt_injection
+                include_timings=include_timings,
+                system_msg_injection=system_prompt_injection,
+                agent=loaded_agents.get(next_agent)
             )
             
             responses[next_agent] = response
@@ -1028,7 +1135,7 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
         conversation = "\n".join(conversation_lines)
         
         # Generate and add summary - now including steps_taken + 1 for initial message
-        history_response = get_team_session_history(session_id, user_id, limit=steps_taken + 1)
+        history_response = get_team_session_history(session_id, user_id, limit=steps_taken + 1, include_total=False, profile="chat")
         summary = summarize_chat_history(history_response.get("history", [])).get("summary", "")
         if summary:
             responses["summary"] = summary
@@ -1044,7 +1151,7 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
             
             while steps_taken < max_steps:
                 # Get current history for decision making
-                history_response = get_team_session_history(session_id, user_id)
+                history_response = get_team_session_history(session_id, user_id, include_total=False, profile="chat")
                 chat_history = history_response.get("history", [])
                 
                 # Create decision agents list
@@ -1064,7 +1171,7 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
                 # Find agent info for the selected agent
                 agent_info = next((a for a in team_agents if a["agent_id"] == next_agent), 
                                 {"agent_name": f"Agent {next_agent}"})
-                agent_name = agent_info.get("agent_name", f"Agent {agent_id}")
+                agent_name = agent_info.get("agent_name", f"Agent {next_agent}")
                 system_prompt_injection = make_system_injection_prompt(all_agents_name, agent_name)
 
                 # Stream the next agent's response
@@ -1076,7 +1183,9 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
                     use_rag=use_rag,
                     user_id=user_id,
                     include_rich_response=include_rich_response,
-                    system_msg_injection=system_prompt_injection
+                    include_timings=include_timings,
+                    system_msg_injection=system_prompt_injection,
+                    agent=loaded_agents.get(next_agent)
                 )
                 
                 for chunk in response_gen:
@@ -1084,7 +1193,7 @@ def team_chat_flow(session_id: str, message: str, stream: bool = False, use_rag:
                 yield "\n"  # Separate agents' responses
                 
             # Generate and stream summary - now including steps_taken + 1 for initial message
-            history_response = get_team_session_history(session_id, user_id, limit=steps_taken + 1)
+            history_response = get_team_session_history(session_id, user_id, limit=steps_taken + 1, include_total=False, profile="chat")
             summary = summarize_chat_history(history_response.get("history", [])).get("summary", "")
             if summary:
                 yield from handle_team_stream_response(session_id, None, stream_generator(summary), summary=True)
@@ -1,22 +1,20 @@
-from keys.keys import openai_api_key, environment
+from keys.keys import environment
 import json
-from openai import OpenAI
 from llm.prompts import make_tool_analysis_prompt, make_memory_analysis_prompt, make_summary_prompt, make_agent_decider_prompt_managed, make_agent_decider_prompt_flow
-from ultraconfiguration import UltraConfig
+from utilities.settings import config, settings
 from ultraprint.logging import logger
 from llm.schemas import ToolAnalysisSchema, MemorySchema, SummarySchema, ManagedAgentSchema, FlowAgentSchema
 from utilities.save_json import extract_json_content
+from utilities.timing import timed
+from utilities.clients import openai_client
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('decision_log', 
             filename='debug/decision.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
-client = OpenAI(api_key=openai_api_key)
-
 def analyze_tool_need(message: str, available_tools: list) -> dict:
     """
     Analyze if a tool is needed for the message.
@@ -29,8 +27,8 @@ def analyze_tool_need(message: str, available_tools: list) -> dict:
         dict: A dictionary containing the tools needed for the message.
     """
     prompt = make_tool_analysis_prompt(message, available_tools)
-    response = client.beta.chat.completions.parse(
-        model=config.get("models.dicision"),
+    response = openai_client().beta.chat.completions.parse(
+        model=settings().models.dicision,
         messages=[{"role": "system", "content": prompt}],
         response_format=ToolAnalysisSchema
     )
@@ -40,6 +38,7 @@ def analyze_tool_need(message: str, available_tools: list) -> dict:
         return {"tools": []}
     return extract_json_content(content)
 
+@timed("memory.analyze")
 def analyze_for_memory(message: str) -> dict:
     """
     Analyze if the message contains important information to remember.
@@ -52,8 +51,8 @@ def analyze_for_memory(message: str) -> dict:
     """
     try:
         prompt = make_memory_analysis_prompt(message)
-        response = client.beta.chat.completions.parse(
-            model=config.get("models.dicision"),
+        response = openai_client().beta.chat.completions.parse(
+            model=settings().models.dicision,
             messages=[{"role": "system", "content": prompt}],
             response_format=MemorySchema
         )
@@ -97,8 +96,8 @@ def summarize_chat_history(chat_history: list, num_messages = None) -> dict:
 
     prompt = make_summary_prompt(conversation_text)
     
-    response = client.beta.chat.completions.parse(
-        model=config.get("models.dicision"),
+    response = openai_client().beta.chat.completions.parse(
+        model=settings().models.dicision,
         messages=[{"role": "system", "content": prompt}],
         response_format=SummarySchema
     )
@@ -142,8 +141,8 @@ def team_managed_decision(message, chat_history, num_messages=None, all_agents=N
 
     prompt = make_agent_decider_prompt_managed(message, all_agents=all_agents)
 
-    response = client.beta.chat.completions.parse(
-        model=config.get("models.dicision"),
+    response = openai_client().beta.chat.completions.parse(
+        model=settings().models.dicision,
         messages=[{"role": "system", "content": prompt}],
         response_format=ManagedAgentSchema
     )
@@ -186,8 +185,8 @@ def team_flow_decision(chat_history, num_messages=None, all_agents=None):
 
     prompt = make_agent_decider_prompt_flow(conversation_text, all_agents=all_agents)
 
-    response = client.beta.chat.completions.parse(
-        model=config.get("models.dicision"),
+    response = openai_client().beta.chat.completions.parse(
+        model=settings().models.dicision,
         messages=[{"role": "system", "content": prompt}],
         response_format=FlowAgentSchema
     )
@@ -0,0 +1,344 @@
+from llm.prompts import make_basic_prompt, format_context, format_system_message, format_tool_response
+from cachetools import LRUCache
+from keys.keys import environment
+from utilities.settings import config, settings
+from ultraprint.logging import logger
+from utilities.timing import timed
+from functools import lru_cache
+import math
+import threading
+import tiktoken
+
+#! Initialize ---------------------------------------------------------------
+log = logger('prompt_builder_log',
+            filename='debug/prompt_builder.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False),
+            log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+
+# Chat formats add a few tokens of framing around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Rough average for English text when a tokenizer cannot be loaded
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[...truncated]"
+
+#! Token counting -------------------------------------------------------------
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Return the tiktoken encoding for a model, or None if token counts have to be estimated.
+
+    Models tiktoken does not know (e.g. Cohere) use cl100k_base as a close approximation.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use; without network access we estimate instead
+        log.warning(f"Could not load a tokenizer for {model}, estimating token counts: {str(e)}")
+        return None
+
+def warm_up_tokenizers(names=None):
+    """
+    Load tokenizer encodings ahead of their first use, e.g. on a background thread after startup.
+
+    tiktoken downloads an encoding's BPE file the first time it is loaded, which would
+    otherwise happen inside the first request that counts tokens.
+
+    Args:
+        names (list, optional): Encoding names. Defaults to `startup.warm_encodings`.
+
+    Returns:
+        dict: A mapping of encoding name to None on success or the error message.
+    """
+    results = {}
+    for name in names if names is not None else config.get("startup.warm_encodings", ["o200k_base", "cl100k_base"]):
+        try:
+            tiktoken.get_encoding(name)
+            results[name] = None
+        except Exception as e:
+            log.warning(f"Could not load the {name} tokenizer: {str(e)}")
+            results[name] = str(e)
+    return results
+
+def count_tokens(text, model):
+    """
+    Count the tokens in a piece of text for the given model.
+
+    Args:
+        text (str): The text to count.
+        model (str): The model the text is sent to.
+
+    Returns:
+        int: The number of tokens (estimated if no tokenizer is available).
+    """
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens, model):
+    """
+    Cut text down to at most `max_tokens` tokens, keeping the beginning.
+
+    Args:
+        text (str): The text to truncate.
+        max_tokens (int): The token limit.
+        model (str): The model the text is sent to.
+
+    Returns:
+        str: The text, with a marker appended if anything was cut.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    keep = max(max_tokens - count_tokens(TRUNCATION_MARKER, model), 0)
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:keep * CHARS_PER_TOKEN] + TRUNCATION_MARKER
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:keep]) + TRUNCATION_MARKER
+
+def tokenizer_name(model):
+    """Return the name of the tokenizer used for a model, or "estimate"."""
+    encoding = get_encoding(model)
+    return encoding.name if encoding is not None else "estimate"
+
+#! Persona prompts ------------------------------------------------------------
+_persona_prompts = LRUCache(maxsize=config.get("prompt.persona_cache_size", 1024))
+_persona_lock = threading.Lock()
+
+def persona_prompt(agent):
+    """
+    Return make_basic_prompt for an agent, memoized per agent version.
+
+    The version is the agent's updated_at (or created_at if it was never updated), so an
+    edited agent gets a fresh prompt while every other turn reuses a byte-identical one.
+
+    Args:
+        agent (dict): The agent document (needs _id, name, role, capabilities, rules and its timestamps).
+
+    Returns:
+        str: The persona prompt.
+    """
+    key = (str(agent.get("_id")), agent.get("updated_at") or agent.get("created_at"))
+    with _persona_lock:
+        prompt = _persona_prompts.get(key)
+    if prompt is None:
+        prompt = make_basic_prompt(agent["name"], agent["role"], agent["capabilities"], agent["rules"])
+        with _persona_lock:
+            _persona_prompts[key] = prompt
+    return prompt
+
+#! Provider usage -------------------------------------------------------------
+_usage = {}
+_usage_lock = threading.Lock()
+
+def record_usage(model, usage):
+    """
+    Add the token usage reported by a provider to the per-model totals.
+
+    Args:
+        model (str): The model that served the request.
+        usage (dict): prompt_tokens, cached_tokens and completion_tokens for one request.
+    """
+    with _usage_lock:
+        totals = _usage.setdefault(model, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        totals["requests"] += 1
+        for field in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+            totals[field] += usage.get(field) or 0
+
+def usage_stats():
+    """
+    Return provider token usage per model, including the share of prompt tokens served from cache.
+
+    Returns:
+        dict: A mapping of model to its totals and cached_ratio.
+    """
+    with _usage_lock:
+        return {model: {**totals, "cached_ratio": round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0}
+                for model, totals in _usage.items()}
+
+#! Budgets --------------------------------------------------------------------
+def get_budget(model):
+    """
+    Return the token budget for a prompt sent to `model`.
+
+    The overall limit is the smaller of `prompt.budget.max_input_tokens` and the model's
+    context window minus the tokens reserved for the response.
+
+    Args:
+        model (str): The model the prompt is sent to.
+
+    Returns:
+        dict: "total" plus a limit per section (memory, context, tool, history), or None if disabled.
+    """
+    # One snapshot for the whole lookup, so a config reload cannot mix old and new limits
+    budget_config = settings().get("prompt.budget", {})
+    if not budget_config.get("enabled", True):
+        return None
+    context_windows = budget_config.get("context_windows", {})
+    # Model names may contain dots, so look them up by key rather than by path
+    context_window = context_windows[model] if model in context_windows else 128000
+    total = min(budget_config.get("max_input_tokens", 16000),
+                context_window - budget_config.get("reserve_output_tokens", 4096))
+    budget = {"total": total}
+    budget.update(budget_config.get("sections", {
+        "memory": 1000,
+        "context": 6000,
+        "tool": 4000,
+        "history": 8000
+    }))
+    return budget
+
+#! Prompt assembly ------------------------------------------------------------
+@timed("prompt.build")
+def build_messages(model, prompt, message, history=None, context_results=None, memory=None,
+                   tool_response="", system_injection=None, budget=None, layout=None):
+    """
+    Assemble the chat messages for a turn within a token budget.
+
+    With the "prefix_cache" layout the persona (and any injected system text) comes first,
+    then the history, then a second system message with the retrieved context, memory and
+    tool output, and finally the user message. The leading part of the prompt is then
+    identical from turn to turn, so provider-side prompt caching can reuse it. The "legacy"
+    layout puts a single system message with everything after the history.
+
+    Each section is first held to its own limit: the lowest-similarity context chunks, the
+    oldest history messages and the last memory items are dropped, and tool output is cut
+    short. If the prompt is still over the total, sections give way in the order given by
+    `prompt.budget.drop_order`. The persona, the injected system text and the user message
+    are never cut.
+
+    Args:
+        model (str): The model the prompt is sent to.
+        prompt (str): The agent persona from make_basic_prompt.
+        message (str): The user message.
+        history (list, optional): Previous {role, content} messages, oldest first. Defaults to None.
+        context_results (list, optional): Results from get_relevant_context. Defaults to None.
+        memory (list, optional): Memory items. Defaults to None.
+        tool_response (str, optional): The combined tool output. Defaults to "".
+        system_injection (str, optional): Extra system text, e.g. for team chats. Defaults to None.
+        budget (dict, optional): Overrides get_budget(model). Defaults to None.
+        layout (str, optional): "prefix_cache" or "legacy". Defaults to `prompt.layout`.
+
+    Returns:
+        tuple: (messages, report). report holds the tokens used per section, the total, the
+            budget, and what was dropped or truncated.
+    """
+    budget = get_budget(model) if budget is None else budget
+    layout = layout or config.get("prompt.layout", "prefix_cache")
+    history = list(history or [])
+    memory = list(memory or [])
+    context_results = context_results or []
+    tool_text = tool_response or ""
+
+    def cost(text):
+        return count_tokens(text, model)
+
+    # Every context match, best first, with a reference back to where it came from
+    chunks = sorted(
+        ((match.get("similarity", 0), result_index, match_index, cost(f"- {match['document']}\n"))
+         for result_index, result in enumerate(context_results)
+         for match_index, match in enumerate(result.get("matches") or [])),
+        key=lambda chunk: -chunk[0])
+    memory_costs = [cost(f"- {item}\n") for item in memory]
+    history_costs = [cost(str(item.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS for item in history]
+    dropped = {"context": 0, "memory": 0, "history": 0}
+    truncated = []
+
+    if budget:
+        # Per-section limits
+        while chunks and sum(chunk[3] for chunk in chunks) > budget.get("context", math.inf):
+            chunks.pop()
+            dropped["context"] += 1
+        while memory and sum(memory_costs) > budget.get("memory", math.inf):
+            memory.pop()
+            memory_costs.pop()
+            dropped["memory"] += 1
+        while history and sum(history_costs) > budget.get("history", math.inf):
+            history.pop(0)
+            history_costs.pop(0)
+            dropped["history"] += 1
+        if tool_text and cost(tool_text) > budget.get("tool", math.inf):
+            tool_text = truncate_to_tokens(tool_text, budget["tool"], model)
+            truncated.append("tool")
+
+        # Overall limit
+        fixed = (cost(prompt) + cost(system_injection or "") + cost(message) + 2 * MESSAGE_OVERHEAD_TOKENS)
+        tool_cost = cost(format_tool_response(tool_text))
+
+        def total():
+            return (fixed + sum(chunk[3] for chunk in chunks) + sum(memory_costs)
+                    + sum(history_costs) + tool_cost)
+
+        for section in config.get("prompt.budget.drop_order", ["context", "tool", "history", "memory"]):
+            while total() > budget["total"]:
+                if section == "context" and chunks:
+                    chunks.pop()
+                    dropped["context"] += 1
+                elif section == "history" and history:
+                    history.pop(0)
+                    history_costs.pop(0)
+                    dropped["history"] += 1
+                elif section == "memory" and memory:
+                    memory.pop()
+                    memory_costs.pop()
+                    dropped["memory"] += 1
+                elif section == "tool" and tool_text:
+                    tool_text = ""
+                    tool_cost = 0
+                    truncated.append("tool")
+                else:
+                    break
+
+    # Rebuild the context results with only the chunks that made it, in their original order
+    kept = {(chunk[1], chunk[2]) for chunk in chunks}
+    kept_results = []
+    for result_index, result in enumerate(context_results):
+        matches = [match for match_index, match in enumerate(result.get("matches") or [])
+                   if (result_index, match_index) in kept]
+        if matches:
+            kept_results.append({**result, "matches": matches})
+
+    context = format_context(kept_results, memory)
+    history_messages = [{"role": item["role"], "content": item["content"]} for item in history]
+    if layout == "prefix_cache":
+        static_message = prompt + ("\n" + str(system_injection) if system_injection else "")
+        volatile_message = format_system_message("", context, tool_text).strip()
+        messages = [{"role": "system", "content": static_message}] + history_messages
+        if volatile_message:
+            messages.append({"role": "system", "content": volatile_message})
+        system_tokens = cost(static_message) + cost(volatile_message) + (2 if volatile_message else 1) * MESSAGE_OVERHEAD_TOKENS
+    else:
+        system_message = format_system_message(prompt, context, tool_text)
+        if system_injection:
+            system_message = system_message + "\n" + str(system_injection)
+        messages = history_messages + [{"role": "system", "content": system_message}]
+        system_tokens = cost(system_message) + MESSAGE_OVERHEAD_TOKENS
+    messages.append({"role": "user", "content": message})
+
+    # format_context only includes memory alongside retrieved context
+    memory_tokens = sum(memory_costs) if context else 0
+    sections = {
+        "persona": cost(prompt),
+        "memory": memory_tokens,
+        "context": max(cost(context) - memory_tokens, 0),
+        "tool": cost(format_tool_response(tool_text)),
+        "injection": cost(system_injection or ""),
+        "history": sum(history_costs),
+        "message": cost(message) + MESSAGE_OVERHEAD_TOKENS
+    }
+    report = {
+        "sections": sections,
+        "total": system_tokens + sections["history"] + sections["message"],
+        "budget": budget["total"] if budget else None,
+        "dropped": dropped,
+        "truncated": truncated,
+        "tokenizer": tokenizer_name(model),
+        "layout": layout
+    }
+    log.debug(f"Prompt for {model}: {report}")
+    return messages, report
@@ -1,10 +1,41 @@
 from database.mongo import client as mongo_client
-from ultraconfiguration import UltraConfig
+from utilities.settings import config
 from ultraprint.logging import logger
 from datetime import datetime, timezone
 from bson import ObjectId
 from keys.keys import environment
 from utilities.save_json import convert_objectid_to_str
+from llm.agents import get_agents_by_ids
+from utilities.pagination import find_page, keyset_query, split_page
+from database.cache import agent_cache, session_cache, history_buffer
+from pymongo import ReturnDocument
+
+# Projection profiles for session reads:
+#   chat   - the fields the chat engines and history access checks read
+#   detail - the full document
+SESSION_PROJECTIONS = {
+    "chat": {
+        "agent_id": 1,
+        "user_id": 1,
+        "session_type": 1,
+        "team_agents": 1,
+        "max_context_results": 1
+    },
+    "detail": None
+}
+
+# Projection profiles for history reads:
+#   chat   - what goes into a prompt or a team decision, without stored tool results
+#   detail - the full message
+HISTORY_PROJECTIONS = {
+    "chat": {
+        "role": 1,
+        "content": 1,
+        "agent_name": 1,
+        "type": 1
+    },
+    "detail": None
+}
 
 # NEW HELPER: safely converts an id to string.
 def safe_convert_id(value):
@@ -21,8 +52,34 @@ def safe_convert_id(value):
         return convert_objectid_to_str(value)
     return str(value)
 
+def format_timestamp(value):
+    """
+    Render a history timestamp as an ISO string.
+
+    History timestamps are stored as BSON dates; messages written before the migration
+    still hold ISO strings, which are returned unchanged.
+
+    Args:
+        value (datetime | str): The stored timestamp.
+
+    Returns:
+        str: The ISO 8601 timestamp.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+def chat_fields(message):
+    """Keep only the fields of a history message that the chat engines read (the "chat" profile)."""
+    return {field: message[field] for field in HISTORY_PROJECTIONS["chat"] if field in message}
+
+def buffered_fields(message):
+    """The chat fields plus the _id, which the history buffer uses to recognise a message it already holds."""
+    return {**chat_fields(message), "_id": message.get("_id")}
+
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('sessions_log', 
             filename='debug/sessions.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
@@ -47,7 +104,7 @@ def create_session(agent_id: str, max_context_results: int = 1, user_id: str = N
         ValueError: If the agent is not found or if the user is not authorized to create a session for the agent.
     """
     db = mongo_client.ai
-    agent = db.agents.find_one({"_id": ObjectId(agent_id)})
+    agent = agent_cache.get(agent_id)
     if not agent:
         raise ValueError("Agent not found")
 
@@ -77,7 +134,8 @@ def create_session(agent_id: str, max_context_results: int = 1, user_id: str = N
         "agent_id": ObjectId(agent_id),
         "max_context_results": max_context_results,
         "created_at": datetime.now(timezone.utc),
-        "name": name or "Untitled Session"  # Default name if none provided
+        "name": name or "Untitled Session",  # Default name if none provided
+        "message_count": 0
     }
     if user_id:
         session_doc["user_id"] = str(user_id)  # Store as string
@@ -105,6 +163,7 @@ def update_session_name(session_id: str, new_name: str, user_id: str = None):
     if user_id and session.get("user_id") != user_id:
         raise ValueError("Not authorized to update this session")
     result = db.sessions.update_one({"_id": ObjectId(session_id)}, {"$set": {"name": new_name}})
+    session_cache.invalidate(session_id)
     if result.modified_count == 0:
         raise ValueError("Failed to update session name")
 
@@ -126,11 +185,61 @@ def delete_session(session_id: str, user_id: str = None):
     if user_id and session.get("user_id") != user_id:
         raise ValueError("Not authorized to delete this session")
     result = db.sessions.delete_one({"_id": ObjectId(session_id)})  # Changed from session_id to _id
+    session_cache.invalidate(session_id)
+    history_buffer.invalidate(session_id)
     if result.deleted_count == 0:
         raise ValueError("Session not found")
     db.history.delete_many({"session_id": ObjectId(session_id)})  # Clean up related history
 
-def get_session(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0):
+def get_message_count(session_id: str) -> int:
+    """
+    Return the number of messages in a session from its maintained counter.
+
+    Sessions created before the counter existed are counted once and backfilled.
+
+    Args:
+        session_id (str): The ID of the session.
+
+    Returns:
+        int: The number of history messages in the session.
+    """
+    db = mongo_client.ai
+    session = db.sessions.find_one({"_id": ObjectId(session_id)}, {"message_count": 1})
+    if not session:
+        return 0
+    if "message_count" in session:
+        return session["message_count"]
+
+    total = db.history.count_documents({"session_id": ObjectId(session_id)})
+    db.sessions.update_one(
+        {"_id": ObjectId(session_id), "message_count": {"$exists": False}},
+        {"$set": {"message_count": total}}
+    )
+    return total
+
+def increment_message_count(session_id: str, amount: int = 1):
+    """
+    Atomically bump the message counter of a session.
+
+    Sessions without a counter are left alone; get_message_count backfills them on first use.
+
+    Args:
+        session_id (str): The ID of the session.
+        amount (int, optional): The number of messages added. Defaults to 1.
+
+    Returns:
+        int | None: The counter after the increment, or None if the session has no counter yet.
+    """
+    db = mongo_client.ai
+    session = db.sessions.find_one_and_update(
+        {"_id": ObjectId(session_id), "message_count": {"$exists": True}},
+        {"$inc": {"message_count": amount}},
+        projection={"message_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return session["message_count"] if session else None
+
+def get_session(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0, cursor: str = None, include_total: bool = True):
     """
     Get details of a single session with paginated history.
 
@@ -139,6 +248,8 @@ def get_session(session_id: str, user_id: str = None, limit: int = 20, skip: int
         user_id (str, optional): The ID of the user requesting the session. Defaults to None.
         limit (int, optional): The maximum number of history entries to retrieve. Defaults to 20.
         skip (int, optional): The number of history entries to skip. Defaults to 0.
+        cursor (str, optional): The next_cursor from the previous page; pages further back in time without skipping. Defaults to None.
+        include_total (bool, optional): Whether to report the total number of messages. Defaults to True.
 
     Returns:
         dict: A dictionary containing the session details and paginated history.
@@ -147,7 +258,25 @@ def get_session(session_id: str, user_id: str = None, limit: int = 20, skip: int
         ValueError: If the session is not found or if the user is not authorized to view the session.
     """
     db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})
+
+    # Session, counter and the latest page of history in one round trip
+    # ($lookup with localField and a pipeline needs MongoDB 5.0+; it seeks the history index per session)
+    history_pipeline = [{"$match": keyset_query({}, "timestamp", -1, cursor)}] if cursor else []
+    history_pipeline += [{"$sort": {"timestamp": -1, "_id": -1}}]
+    if skip:
+        history_pipeline.append({"$skip": skip})
+    if limit:
+        history_pipeline.append({"$limit": limit + 1})
+    session = next(db.sessions.aggregate([
+        {"$match": {"_id": ObjectId(session_id)}},
+        {"$lookup": {
+            "from": "history",
+            "localField": "_id",
+            "foreignField": "session_id",
+            "pipeline": history_pipeline,
+            "as": "history"
+        }}
+    ]), None)
     if not session:
         raise ValueError("Session not found")
         
@@ -172,14 +301,16 @@ def get_session(session_id: str, user_id: str = None, limit: int = 20, skip: int
             if agent.get("agent_id"):
                 agent["agent_id"] = safe_convert_id(agent["agent_id"])
     
-    # Get total count first
-    total = db.history.count_documents({"session_id": ObjectId(session_id)})
+    # Sessions created before the counter existed are counted (and backfilled) once
+    message_count = session_data.pop("message_count", None)
+    if not include_total:
+        total = None
+    elif message_count is None:
+        total = get_message_count(session_id)
+    else:
+        total = message_count
     
-    # Get latest entries by sorting in descending order
-    history_docs = list(db.history.find({"session_id": ObjectId(session_id)})
-                       .sort("timestamp", -1)  # Changed to -1 for latest first
-                       .skip(skip)
-                       .limit(limit))
+    history_docs, next_cursor = split_page(session_data.pop("history"), "timestamp", limit)
     
     # Reverse the results to maintain chronological order (oldest to newest)
     history_docs.reverse()
@@ -188,17 +319,20 @@ def get_session(session_id: str, user_id: str = None, limit: int = 20, skip: int
             doc["_id"] = safe_convert_id(doc["_id"])
         if "session_id" in doc:
             doc["session_id"] = safe_convert_id(doc["session_id"])
+        if "timestamp" in doc:
+            doc["timestamp"] = format_timestamp(doc["timestamp"])
     
     session_data["history"] = history_docs
     session_data["history_metadata"] = {
         "total": total,
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
     
     return session_data
 
-def get_session_history(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0) -> dict:
+def get_session_history(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0, cursor: str = None, include_total: bool = True, profile: str = "detail") -> dict:
     """
     Get paginated chat history for a session.
 
@@ -207,6 +341,9 @@ def get_session_history(session_id: str, user_id: str = None, limit: int = 20, s
         user_id (str, optional): The ID of the user requesting the history. Defaults to None.
         limit (int, optional): The maximum number of history entries to retrieve. Defaults to 20.
         skip (int, optional): The number of history entries to skip. Defaults to 0.
+        cursor (str, optional): The next_cursor from the previous page; pages further back in time without skipping. Defaults to None.
+        include_total (bool, optional): Whether to report the total number of messages. Defaults to True.
+        profile (str, optional): The history projection profile ("chat" or "detail"). Defaults to "detail".
 
     Returns:
         dict: A dictionary containing the paginated chat history.
@@ -215,7 +352,7 @@ def get_session_history(session_id: str, user_id: str = None, limit: int = 20, s
         ValueError: If the session is not found or if the user is not authorized to view the session.
     """
     db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})  # Changed from session_id to _id
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     if user_id and session.get("user_id") != user_id:
@@ -225,14 +362,13 @@ def get_session_history(session_id: str, user_id: str = None, limit: int = 20, s
     if "agent_id" in session:
         session["agent_id"] = safe_convert_id(session["agent_id"])
     
-    # Get total count
-    total = db.history.count_documents({"session_id": ObjectId(session_id)})
+    total = get_message_count(session_id) if include_total else None
     
     # Get latest entries
-    history_docs = list(db.history.find({"session_id": ObjectId(session_id)})
-                       .sort("timestamp", -1)  # Latest first
-                       .skip(skip)
-                       .limit(limit))
+    history_docs, next_cursor = find_page(db.history, {"session_id": ObjectId(session_id)},
+                                          sort_by="timestamp", sort_order=-1,
+                                          limit=limit, skip=skip, cursor=cursor,
+                                          projection=HISTORY_PROJECTIONS[profile])
     
     # Reverse to maintain conversation flow
     history_docs.reverse()
@@ -241,12 +377,15 @@ def get_session_history(session_id: str, user_id: str = None, limit: int = 20, s
             doc["_id"] = safe_convert_id(doc["_id"])
         if "session_id" in doc:
             doc["session_id"] = safe_convert_id(doc["session_id"])
+        if "timestamp" in doc:
+            doc["timestamp"] = format_timestamp(doc["timestamp"])
     
     return {
         "history": history_docs,
         "total": total,
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
 def update_session_history(session_id: str, role: str, content: str, metadata: dict = None, user_id: str = None):
@@ -264,7 +403,7 @@ def update_session_history(session_id: str, role: str, content: str, metadata: d
         ValueError: If the session is not found or if the user is not authorized to update the session.
     """
     db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})  # Changed from session_id to _id
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     if user_id and session.get("user_id") != user_id:
@@ -273,13 +412,14 @@ def update_session_history(session_id: str, role: str, content: str, metadata: d
         "session_id": ObjectId(session_id),
         "role": role,
         "content": content,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc)
     }
     if metadata:
         entry["metadata"] = metadata
     db.history.insert_one(entry)  # Instead of pushing to sessions
+    history_buffer.append(session_id, buffered_fields(entry), increment_message_count(session_id))
 
-def get_recent_history(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0) -> dict:
+def get_recent_history(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0, cursor: str = None, include_total: bool = True, profile: str = "detail") -> dict:
     """
     Get paginated recent chat history, newest first.
 
@@ -288,6 +428,9 @@ def get_recent_history(session_id: str, user_id: str = None, limit: int = 20, sk
         user_id (str, optional): The ID of the user requesting the history. Defaults to None.
         limit (int, optional): The maximum number of history entries to retrieve. Defaults to 20.
         skip (int, optional): The number of history entries to skip. Defaults to 0.
+        cursor (str, optional): The next_cursor from the previous page; pages further back in time without skipping. Defaults to None.
+        include_total (bool, optional): Whether to report the total number of messages. Defaults to True.
+        profile (str, optional): The history projection profile ("chat" or "detail"). Defaults to "detail".
 
     Returns:
         dict: A dictionary containing the paginated chat history, sorted by timestamp descending.
@@ -296,7 +439,7 @@ def get_recent_history(session_id: str, user_id: str = None, limit: int = 20, sk
         ValueError: If the session is not found or if the user is not authorized to view the session.
     """
     db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     if user_id and session.get("user_id") != user_id:
@@ -306,27 +449,48 @@ def get_recent_history(session_id: str, user_id: str = None, limit: int = 20, sk
     if "agent_id" in session:
         session["agent_id"] = safe_convert_id(session["agent_id"])
     
-    total = db.history.count_documents({"session_id": ObjectId(session_id)})
+    # The chat window of a hot session is served from memory while the counter says it is current
+    use_buffer = profile == "chat" and not skip and not cursor
+    if use_buffer:
+        message_count = get_message_count(session_id)
+        buffered = history_buffer.get(session_id, limit, message_count)
+        if buffered is not None:
+            buffered.reverse()  # newest first, like the query below
+            return {
+                "history": buffered,
+                "total": message_count if include_total else None,
+                "skip": skip,
+                "limit": limit,
+                "next_cursor": None
+            }
+        total = message_count if include_total else None
+    else:
+        total = get_message_count(session_id) if include_total else None
     
     # Already correct - keep newest first, don't reverse
-    history_docs = list(db.history.find({"session_id": ObjectId(session_id)})
-                    .sort("timestamp", -1)  # Most recent first
-                    .skip(skip)
-                    .limit(limit))
+    history_docs, next_cursor = find_page(db.history, {"session_id": ObjectId(session_id)},
+                                          sort_by="timestamp", sort_order=-1,
+                                          limit=limit, skip=skip, cursor=cursor,
+                                          projection=HISTORY_PROJECTIONS[profile])
+    if use_buffer:
+        history_buffer.fill(session_id, [buffered_fields(doc) for doc in reversed(history_docs)], message_count)
     for doc in history_docs:
         if "_id" in doc:
             doc["_id"] = safe_convert_id(doc["_id"])
         if "session_id" in doc:
             doc["session_id"] = safe_convert_id(doc["session_id"])
+        if "timestamp" in doc:
+            doc["timestamp"] = format_timestamp(doc["timestamp"])
     
     return {
         "history": history_docs,
         "total": total,
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
-def get_all_sessions_for_user(user_id: str, limit: int = 20, skip: int = 0, sort_by: str = "created_at", sort_order: int = -1) -> list:
+def get_all_sessions_for_user(user_id: str, limit: int = 20, skip: int = 0, sort_by: str = "created_at", sort_order: int = -1, cursor: str = None) -> list:
     """
     Get all sessions belonging to a user with pagination and sorting.
 
@@ -336,22 +500,23 @@ def get_all_sessions_for_user(user_id: str, limit: int = 20, skip: int = 0, sort
         skip (int, optional): The number of sessions to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the sessions by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
 
     Returns:
-        list: A list of sessions belonging to the user.
+        list: A list of sessions belonging to the user. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
-    sessions = list(db.sessions.find({"user_id": str(user_id)})  # Query with string
-                .sort(sort_by, sort_order)
-                .skip(skip)
-                .limit(limit))
+    sessions, next_cursor = find_page(db.sessions, {"user_id": str(user_id)},  # Query with string
+                                      sort_by, sort_order, limit, skip, cursor)
     for s in sessions:
         s["_id"] = safe_convert_id(s["_id"])
         if "agent_id" in s:
             s["agent_id"] = safe_convert_id(s["agent_id"])
+    if cursor is not None:
+        return {"data": sessions, "next_cursor": next_cursor}
     return sessions
 
-def get_agent_sessions_for_user(agent_id: str, user_id: str = None, limit: int = 20, skip: int = 0, sort_by: str = "created_at", sort_order: int = -1) -> list:
+def get_agent_sessions_for_user(agent_id: str, user_id: str = None, limit: int = 20, skip: int = 0, sort_by: str = "created_at", sort_order: int = -1, cursor: str = None) -> list:
     """
     Get all sessions for a specific agent with optional user security check.
 
@@ -362,9 +527,10 @@ def get_agent_sessions_for_user(agent_id: str, user_id: str = None, limit: int =
         skip (int, optional): The number of sessions to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the sessions by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
 
     Returns:
-        list: A list of sessions for the specified agent.
+        list: A list of sessions for the specified agent. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
     
@@ -372,14 +538,13 @@ def get_agent_sessions_for_user(agent_id: str, user_id: str = None, limit: int =
     if user_id:
         query["user_id"] = str(user_id)  # Query with string
     
-    sessions = list(db.sessions.find(query)
-                .sort(sort_by, sort_order)                
-                .skip(skip)                
-                .limit(limit))
+    sessions, next_cursor = find_page(db.sessions, query, sort_by, sort_order, limit, skip, cursor)
     for s in sessions:
         s["_id"] = safe_convert_id(s["_id"])
         if "agent_id" in s:
             s["agent_id"] = safe_convert_id(s["agent_id"])
+    if cursor is not None:
+        return {"data": sessions, "next_cursor": next_cursor}
     return sessions
 
 def get_team_sessions_for_user(
@@ -387,7 +552,8 @@ def get_team_sessions_for_user(
     limit: int = 20,
     skip: int = 0,
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ) -> list:
     """
     Return sessions with session_type in ['team', 'team-managed', 'team-flow'].
@@ -398,23 +564,23 @@ def get_team_sessions_for_user(
         skip (int, optional): The number of sessions to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the sessions by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
 
     Returns:
-        list: A list of team sessions for the user.
+        list: A list of team sessions for the user. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
     query = {
         "user_id": str(user_id),
         "session_type": {"$in": ["team", "team-managed", "team-flow"]}
     }
-    sessions = list(db.sessions.find(query)
-                    .sort(sort_by, sort_order)
-                    .skip(skip)
-                    .limit(limit))
+    sessions, next_cursor = find_page(db.sessions, query, sort_by, sort_order, limit, skip, cursor)
     for s in sessions:
         s["_id"] = safe_convert_id(s["_id"])
         if "agent_id" in s:
             s["agent_id"] = safe_convert_id(s["agent_id"])
+    if cursor is not None:
+        return {"data": sessions, "next_cursor": next_cursor}
     return sessions
 
 def get_standalone_sessions_for_user(
@@ -422,7 +588,8 @@ def get_standalone_sessions_for_user(
     limit: int = 20,
     skip: int = 0,
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ) -> list:
     """
     Return sessions without a team session_type.
@@ -433,9 +600,10 @@ def get_standalone_sessions_for_user(
         skip (int, optional): The number of sessions to skip. Defaults to 0.
         sort_by (str, optional): The field to sort the sessions by. Defaults to "created_at".
         sort_order (int, optional): The sort order (1 for ascending, -1 for descending). Defaults to -1.
+        cursor (str, optional): Keyset cursor; "" for the first page, then the previous next_cursor. Defaults to None (offset paging).
 
     Returns:
-        list: A list of standalone sessions for the user.
+        list: A list of standalone sessions for the user. When a cursor is given, a dict with "data" and "next_cursor".
     """
     db = mongo_client.ai
     query = {
@@ -445,14 +613,13 @@ def get_standalone_sessions_for_user(
             {"session_type": {"$nin": ["team", "team-managed", "team-flow"]}}
         ]
     }
-    sessions = list(db.sessions.find(query)
-                    .sort(sort_by, sort_order)
-                    .skip(skip)
-                    .limit(limit))
+    sessions, next_cursor = find_page(db.sessions, query, sort_by, sort_order, limit, skip, cursor)
     for s in sessions:
         s["_id"] = safe_convert_id(s["_id"])
         if "agent_id" in s:
             s["agent_id"] = safe_convert_id(s["agent_id"])
+    if cursor is not None:
+        return {"data": sessions, "next_cursor": next_cursor}
     return sessions
 
 #! Team session functions ---------------------------------------------------
@@ -479,10 +646,11 @@ def create_team_session(agent_ids: list, max_context_results: int = 1, user_id:
     if session_type not in valid_session_types:
         raise ValueError(f"Invalid session type. Must be one of: {valid_session_types}")
 
-    # Validate agents exist and user has access
+    # Validate agents exist and user has access (single round trip for the whole team)
+    loaded_agents = get_agents_by_ids(agent_ids, projection={"name": 1, "agent_type": 1, "user_id": 1})
     agents = []
     for agent_id in agent_ids:
-        agent = db.agents.find_one({"_id": ObjectId(agent_id)})
+        agent = loaded_agents.get(str(agent_id))
         if not agent:
             raise ValueError(f"Agent {agent_id} not found")
         
@@ -501,7 +669,8 @@ def create_team_session(agent_ids: list, max_context_results: int = 1, user_id:
         "team_agents": agents,  # Store both ID and name
         "max_context_results": max_context_results,
         "created_at": datetime.now(timezone.utc),
-        "name": name or "Untitled Team Session"  # Default name if none provided
+        "name": name or "Untitled Team Session",  # Default name if none provided
+        "message_count": 0
     }
     if user_id:
         session_doc["user_id"] = str(user_id)
@@ -509,7 +678,7 @@ def create_team_session(agent_ids: list, max_context_results: int = 1, user_id:
     result = db.sessions.insert_one(session_doc)
     return str(result.inserted_id)
 
-def get_team_session_history(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0) -> dict:
+def get_team_session_history(session_id: str, user_id: str = None, limit: int = 20, skip: int = 0, cursor: str = None, include_total: bool = True, profile: str = "detail") -> dict:
     """
     Get paginated chat history for a team session with agent names.
 
@@ -518,6 +687,9 @@ def get_team_session_history(session_id: str, user_id: str = None, limit: int =
         user_id (str, optional): The ID of the user requesting the history. Defaults to None.
         limit (int, optional): The maximum number of history entries to retrieve. Defaults to 20.
         skip (int, optional): The number of history entries to skip. Defaults to 0.
+        cursor (str, optional): The next_cursor from the previous page; pages further back in time without skipping. Defaults to None.
+        include_total (bool, optional): Whether to report the total number of messages. Defaults to True.
+        profile (str, optional): The history projection profile ("chat" or "detail"). Defaults to "detail".
 
     Returns:
         dict: A dictionary containing the paginated chat history.
@@ -526,32 +698,52 @@ def get_team_session_history(session_id: str, user_id: str = None, limit: int =
         ValueError: If the session is not found or if the session is not a team session.
     """
     db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     if session.get("session_type") not in ["team", "team-managed", "team-flow"]:
         raise ValueError("Not a team session")
     
-    total = db.history.count_documents({"session_id": ObjectId(session_id)})
-    
-    history_docs = list(db.history.find({"session_id": ObjectId(session_id)})
-                    .sort("timestamp", -1)  # Latest first
-                    .skip(skip)
-                    .limit(limit))
+    # The chat window of a hot session is served from memory while the counter says it is current
+    use_buffer = profile == "chat" and not skip and not cursor
+    if use_buffer:
+        message_count = get_message_count(session_id)
+        buffered = history_buffer.get(session_id, limit, message_count)
+        if buffered is not None:
+            return {
+                "history": buffered,
+                "total": message_count if include_total else None,
+                "skip": skip,
+                "limit": limit,
+                "next_cursor": None
+            }
+        total = message_count if include_total else None
+    else:
+        total = get_message_count(session_id) if include_total else None
+    
+    history_docs, next_cursor = find_page(db.history, {"session_id": ObjectId(session_id)},
+                                          sort_by="timestamp", sort_order=-1,
+                                          limit=limit, skip=skip, cursor=cursor,
+                                          projection=HISTORY_PROJECTIONS[profile])
     
     # Reverse to maintain conversation flow and convert ObjectId fields
     history_docs.reverse()
+    if use_buffer:
+        history_buffer.fill(session_id, [buffered_fields(doc) for doc in history_docs], message_count)
     for doc in history_docs:
         if "_id" in doc:
             doc["_id"] = safe_convert_id(doc["_id"])
         if "session_id" in doc:
             doc["session_id"] = safe_convert_id(doc["session_id"])
+        if "timestamp" in doc:
+            doc["timestamp"] = format_timestamp(doc["timestamp"])
     
     return {
         "history": history_docs,
         "total": total,
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
 def update_team_session_history(session_id: str, agent_id: str, role: str, content: str, metadata: dict = None, user_id: str = None, summary: bool = False):
@@ -571,7 +763,7 @@ def update_team_session_history(session_id: str, agent_id: str, role: str, conte
         ValueError: If the session is not found, if the session is not a team session, or if the user is not authorized to update the session.
     """
     db = mongo_client.ai
-    session = db.sessions.find_one({"_id": ObjectId(session_id)})
+    session = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
     if not session:
         raise ValueError("Session not found")
     # Modified check to allow team, team-managed, and team-flow sessions
@@ -592,7 +784,7 @@ def update_team_session_history(session_id: str, agent_id: str, role: str, conte
         "session_id": ObjectId(session_id),
         "role": role,
         "content": content,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc)
     }
     
     if agent_id:
@@ -604,4 +796,5 @@ def update_team_session_history(session_id: str, agent_id: str, role: str, conte
     if summary:
         entry["type"] = "summary"
     
-    db.history.insert_one(entry)  # Instead of pushing to sessions
\ No newline at end of file
+    db.history.insert_one(entry)  # Instead of pushing to sessions
+    history_buffer.append(session_id, buffered_fields(entry), increment_message_count(session_id))
\ No newline at end of file
@@ -1,12 +1,13 @@
-from ultraconfiguration import UltraConfig
+from utilities.settings import config, settings
 from ultraprint.logging import logger
 from keys.keys import environment
 import importlib
 from llm.decision import analyze_tool_need
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from utilities.timing import span, timed, in_context
+from utilities import metrics
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('chat_log', 
             filename='debug/chat.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
@@ -31,12 +32,15 @@ def _execute_tool(tool, agent, message, history):
     """
     try:
         tool_module = importlib.import_module(f"tools.{tool}.main")
-        response = tool_module._execute(agent, message, history)
+        with span(f"tool.{tool}"):
+            response = tool_module._execute(agent, message, history)
         return {"tool": tool, "response": response}
     except ImportError as e:
         log.error("Could not import or use tool '%s': %s", tool, e)
+        metrics.inc("tool_errors_total", tool=tool)
         return {"tool": tool, "response": f"Error: {str(e)}"}
 
+@timed("tools.execute")
 def execute_tools(agent, message, history):
     """
     Execute multiple tools in parallel and combine their responses.
@@ -68,17 +72,18 @@ def execute_tools(agent, message, history):
                 tool_item = {"name": tool, "description": ""}
             updated_tools.append(tool_item)
         
-        response = analyze_tool_need(message, updated_tools)
+        with span("tools.decision"):
+            response = analyze_tool_need(message, updated_tools)
         tools_list = response.get("tools", [])
         if not tools_list:
             return {"text": "", "metadata": {"results": [], "used": [], "not_used": enabled_tools}}
         
         log.debug("Executing tools in parallel: %s", tools_list)
-        max_workers = min(len(tools_list), config.get("constraints.max_parallel_tools", 5))
+        max_workers = min(len(tools_list), settings().constraints.max_parallel_tools)
         responses = []
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_tool = {
-                executor.submit(_execute_tool, tool, agent, message, history): tool 
+                executor.submit(in_context(_execute_tool), tool, agent, message, history): tool 
                 for tool in tools_list
             }
             for future in as_completed(future_to_tool):
@@ -1,87 +1,135 @@
-from PyPDF2 import PdfReader
-import docx
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from utilities.s3_loader import download_from_s3, cleanup_cache
-from ultraconfiguration import UltraConfig
+from utilities.s3_loader import fetch_from_s3, S3Object
+from utilities.settings import config
 from ultraprint.logging import logger
 from keys.keys import environment
 from utilities.scraping import scrape_page
+from rag.pdf_extraction import iter_pdf_pages
+from contextlib import nullcontext
 
-config = UltraConfig('config.json')
 log = logger('file_handler_log', 
             filename='debug/file_handler.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
-def extract_from_pdf(s3_key, bucket_name):
-    """Extract text from PDF file stored in S3"""
-    local_path = None
-    try:
-        local_path = download_from_s3(s3_key, bucket_name=bucket_name, unique_filename=True)
-        with open(local_path, 'rb') as file:
-            reader = PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text.strip()
-    except Exception as e:
-        log.error(f"Error extracting PDF text: {str(e)}")
-        raise
-    finally:
-        if local_path:
-            cleanup_cache(local_path)
+#! Readers --------------------------------------------------------------------
+# Parsers are only needed by ingestion, so they are imported on first use.
+# Every reader takes a file path or a binary stream.
+def read_pdf(source):
+    """Extract text from a PDF file"""
+    return "\n".join(text for _, text in iter_pdf_pages(source)).strip()
 
-def extract_from_docx(s3_key, bucket_name):
-    """Extract text from DOCX file stored in S3"""
-    local_path = None
-    try:
-        local_path = download_from_s3(s3_key, bucket_name=bucket_name, unique_filename=True)
-        doc = docx.Document(local_path)
-        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        return text.strip()
-    except Exception as e:
-        log.error(f"Error extracting DOCX text: {str(e)}")
-        raise
-    finally:
-        if local_path:
-            cleanup_cache(local_path)
+def read_docx(source):
+    """Extract text from a DOCX file"""
+    import docx
+    doc = docx.Document(source)
+    text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    return text.strip()
+
+def format_row(values):
+    """Render spreadsheet cells as "a | b | c", dropping trailing empty cells; "" for an empty row"""
+    cells = ["" if value is None else str(value).strip() for value in values]
+    while cells and not cells[-1]:
+        cells.pop()
+    return " | ".join(cells)
 
-def extract_from_excel(s3_key, bucket_name):
-    """Extract text from Excel file stored in S3"""
-    local_path = None
+def iter_excel_rows(source):
+    """
+    Yield ([sheet, row_number], text) for every non-empty row of every sheet.
+
+    .xlsx files are streamed with a read-only openpyxl workbook, one row at a time. Legacy
+    .xls files, which openpyxl cannot read, are loaded one sheet at a time with pandas.
+    """
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    from zipfile import BadZipFile
     try:
-        local_path = download_from_s3(s3_key, bucket_name=bucket_name, unique_filename=True)
-        df = pd.read_excel(local_path)
-        text = df.to_string()
-        return text.strip()
-    except Exception as e:
-        log.error(f"Error extracting Excel text: {str(e)}")
-        raise
+        workbook = load_workbook(source, read_only=True, data_only=True)
+    except (InvalidFileException, BadZipFile):
+        import pandas as pd
+        if hasattr(source, "seek"):
+            source.seek(0)
+        with pd.ExcelFile(source) as excel:
+            for sheet in excel.sheet_names:
+                frame = excel.parse(sheet, header=None, dtype=object)
+                for number, values in enumerate(frame.itertuples(index=False, name=None), start=1):
+                    text = format_row(None if pd.isna(value) else value for value in values)
+                    if text:
+                        yield [sheet, number], text
+        return
+    try:
+        for sheet in workbook.worksheets:
+            for number, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+                text = format_row(values)
+                if text:
+                    yield [sheet.title, number], text
     finally:
-        if local_path:
-            cleanup_cache(local_path)
+        workbook.close()
+
+def read_excel(source):
+    """Extract text from an Excel file"""
+    return "\n".join(text for _, text in iter_excel_rows(source))
+
+READERS = {
+    "pdf": read_pdf,
+    "docx": read_docx,
+    "excel": read_excel
+}
+
+#! Download and extraction ----------------------------------------------------
+def download_source(file_type, details):
+    """
+    Fetch the file behind a job from S3, in memory unless it is above the spill threshold.
+
+    Returns:
+        S3Object or None: The file, to be closed by the caller, or None for webpages, which are read directly.
+    """
+    if file_type == "webpage":
+        return None
+    if file_type not in READERS:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    return fetch_from_s3(details["s3_key"], bucket_name=details["s3_bucket"])
 
-def extract_from_webpage(url):
-    """Extract text from webpage"""
+def _open(source):
+    """A fresh stream for a fetched S3 object; paths are passed through to the readers"""
+    return source.open() if isinstance(source, S3Object) else nullcontext(source)
+
+def extract_text(file_type, source=None, details=None):
+    """Extract text from a fetched file (an S3Object or a path), or scrape it for webpages"""
     try:
-        return scrape_page(url)
+        if file_type == "webpage":
+            return scrape_page(details["url"])
+        if file_type not in READERS:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        with _open(source) as stream:
+            return READERS[file_type](stream)
     except Exception as e:
-        log.error(f"Error extracting webpage text: {str(e)}")
+        log.error(f"Error extracting {file_type} text: {str(e)}")
         raise
 
+def iter_pages(file_type, source=None, details=None):
+    """
+    Yield the text of a fetched file (an S3Object or a path) as (page_number, text).
+
+    PDFs are read page by page and spreadsheets row by row, with [sheet, row_number] in place
+    of the page number. Other types have no pages and are yielded whole, with page_number None.
+    """
+    streams = {"pdf": iter_pdf_pages, "excel": iter_excel_rows}
+    if file_type in streams:
+        try:
+            with _open(source) as stream:
+                yield from streams[file_type](stream)
+        except Exception as e:
+            log.error(f"Error extracting {file_type} text: {str(e)}")
+            raise
+    else:
+        yield None, extract_text(file_type, source, details)
+
 def get_file_content(file_type, details):
     """Main function to extract text based on file type"""
-    handlers = {
-        "pdf": lambda d: extract_from_pdf(d["s3_key"], d["s3_bucket"]),
-        "docx": lambda d: extract_from_docx(d["s3_key"], d["s3_bucket"]),
-        "excel": lambda d: extract_from_excel(d["s3_key"], d["s3_bucket"]),
-        "webpage": lambda d: extract_from_webpage(d["url"])
-    }
-    
-    if file_type not in handlers:
-        raise ValueError(f"Unsupported file type: {file_type}")
-        
-    return handlers[file_type](details)
+    source = download_source(file_type, details)
+    try:
+        return extract_text(file_type, source, details)
+    finally:
+        if source:
+            source.close()
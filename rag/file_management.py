@@ -1,8 +1,11 @@
 from database.mongo import client as mongo_client
 from database.chroma import insert_documents, delete_file_documents
-from rag.file_processor import sentence_chunker, character_chunker
+from database.cache import agent_cache
+from rag.file_processor import sentence_chunker, character_chunker, stream_sentence_chunks, stream_character_chunks, stream_row_chunks
+from llm.prompt_builder import count_tokens
+from utilities.pagination import find_page
 from keys.keys import environment
-from ultraconfiguration import UltraConfig
+from utilities.settings import config, settings
 from ultraprint.logging import logger
 from datetime import datetime, timezone
 from bson import ObjectId
@@ -15,26 +18,20 @@ def to_obj(val):
     return val
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('file_management_log', 
             filename='debug/file_management.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
-def add_file(agent_id, text, file_name, file_type, chunk_size=3, overlap=1, chunk_type="sentence", 
-             *,  # force subsequent params to be keyword-only
-            collection_index: int = None, user_id=None, s3_bucket=None, s3_key=None):
-    """Chunk text and store vector embeddings using collection_index for bucket selection."""
-    # Convert supplied IDs
+def resolve_collection(agent_id, file_type, collection_index: int = None, user_id=None):
+    """Check the agent, owner and file type, and return the collection_id the file goes into."""
     agent_id = to_obj(agent_id)
     if user_id:
         user_id = to_obj(user_id)
-        
-    log.info(f"Adding file '{file_name}' for agent {agent_id}")
-    
+
     db = mongo_client.ai.agents
-    agent = db.find_one({"_id": agent_id})
+    agent = db.find_one({"_id": agent_id}, {"user_id": 1, "collection_ids": 1})
     if not agent:
         log.error(f"Agent {agent_id} not found")
         raise ValueError("Agent not found")
@@ -54,40 +51,87 @@ def add_file(agent_id, text, file_name, file_type, chunk_size=3, overlap=1, chun
     supported_types = config.get("supported.file_types", [])
     if file_type not in supported_types:
         raise ValueError(f"Unsupported file_type. Supported types: {supported_types}")
+    return collection_id
 
+def chunk_text(text, chunk_size=3, overlap=1, chunk_type="sentence"):
+    """Split text into chunks; the same text and settings always give the same chunks."""
     log.debug(f"Chunking text using {chunk_type} method with size {chunk_size} and overlap {overlap}")
     if chunk_type == "character":
-        chunks = character_chunker(text, chunk_size, overlap)
-    else:
-        chunks = sentence_chunker(text, chunk_size, overlap)
-    
-    log.info(f"Created {len(chunks)} chunks from file")
-    chunk_ids = []
-    file_id = str(ObjectId())
-    
-    for i, chunk in enumerate(chunks):
-        chunk_id = str(ObjectId())
-        log.debug(f"Processing chunk {i+1}/{len(chunks)} with ID {chunk_id}")
-        insert_documents(
-            agent_id=str(agent_id),
-            collection_id=collection_id,
-            documents=[chunk],
-            additional_metadata=[{
-                "file_name": file_name,
-                "file_id": file_id,
-                "chunk_number": i + 1
-            }]
-        )
-        chunk_ids.append(chunk_id)
-    
-    file_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-    log.debug(f"File hash: {file_hash}")
-    
-    files_collection = mongo_client.ai.files
+        return character_chunker(text, chunk_size, overlap)
+    return sentence_chunker(text, chunk_size, overlap)
+
+def stream_chunks(pages, chunk_size=3, overlap=1, chunk_type="sentence"):
+    """
+    Chunk (page, text) pages as they arrive, yielding (chunk, metadata).
+
+    The metadata locates the chunk: page_start and page_end for paged documents, or sheet,
+    row_start and row_end for spreadsheet rows (chunk_type "rows", where the pages are rows
+    and chunks are bounded by `ingestion.excel_chunk_tokens` instead of chunk_size).
+    """
+    if chunk_type == "rows":
+        model = settings().models.embedding
+        rows = stream_row_chunks(pages, config.get("ingestion.excel_chunk_tokens", 512), lambda text: count_tokens(text, model))
+        for chunk, (sheet, row_start), (_, row_end) in rows:
+            yield chunk, {"sheet": sheet, "row_start": row_start, "row_end": row_end}
+        return
+    chunker = stream_character_chunks if chunk_type == "character" else stream_sentence_chunks
+    for chunk, first, last in chunker(pages, chunk_size, overlap):
+        # Chroma metadata cannot hold None, so files without pages leave the keys out
+        yield chunk, ({"page_start": first, "page_end": last} if first is not None else {})
+
+def chunk_id(file_id, index):
+    """Stable vector ID of a file's chunk, so a retried batch overwrites instead of duplicating."""
+    return f"{file_id}-{index + 1}"
+
+def store_chunks(agent_id, collection_id, file_id, file_name, chunks, offset=0, locations=None):
+    """
+    Embed and upsert one batch of a file's chunks.
+
+    Args:
+        chunks (list): The batch, starting at chunk number `offset + 1` of the file.
+        locations (list, optional): Extra metadata per chunk, e.g. its pages or rows.
+
+    Returns:
+        list: The chunk IDs written.
+
+    Raises:
+        RuntimeError: If embedding or writing the batch failed.
+    """
+    ids = [chunk_id(file_id, offset + i) for i in range(len(chunks))]
+    metadata = []
+    for i in range(len(chunks)):
+        meta = {
+            "file_name": file_name,
+            "file_id": str(file_id),
+            "chunk_number": offset + i + 1
+        }
+        if locations:
+            meta.update(locations[i])
+        metadata.append(meta)
+    success, _ = insert_documents(
+        agent_id=str(agent_id),
+        collection_id=collection_id,
+        documents=list(chunks),
+        additional_metadata=metadata,
+        ids=ids
+    )
+    if not success:
+        raise RuntimeError(f"Failed to store chunks {offset + 1}-{offset + len(chunks)} of file {file_id}")
+    return ids
+
+def register_file(file_id, agent_id, file_name, file_type, collection_id, chunk_count, file_hash,
+                  *, user_id=None, s3_bucket=None, s3_key=None):
+    """
+    Record a file whose chunks are stored, once.
+
+    The files document uses `file_id` as its _id, so registering the same file again (a job
+    retried after this step) neither duplicates it nor counts it twice.
+    """
+    agent_id = to_obj(agent_id)
     file_doc = {
         "agent_id": agent_id,
         "filename": file_name,
-        "chunk_ids": chunk_ids,
+        "chunk_ids": [chunk_id(file_id, i) for i in range(chunk_count)],
         "file_hash": file_hash,
         "collection_id": collection_id,
         "file_type": file_type,  # Always record file type
@@ -100,18 +144,41 @@ def add_file(agent_id, text, file_name, file_type, chunk_size=3, overlap=1, chun
         file_doc["s3_key"] = s3_key
 
     if user_id:
-        file_doc["user_id"] = user_id
+        file_doc["user_id"] = to_obj(user_id)
     
-    result = files_collection.insert_one(file_doc)
-    file_doc["_id"] = result.inserted_id
-    mongo_client.ai.agents.update_one({"_id": agent_id}, {"$push": {"files": file_doc["_id"]}})
-    
-    log.success(f"Successfully added file '{file_name}' with {len(chunk_ids)} chunks")
+    result = mongo_client.ai.files.update_one({"_id": to_obj(file_id)}, {"$setOnInsert": file_doc}, upsert=True)
+    if result.upserted_id is not None:
+        # Membership lives in the files collection; the agent only keeps a per-collection count
+        mongo_client.ai.agents.update_one({"_id": agent_id}, {"$inc": {f"file_counts.{collection_id}": 1}})
+    agent_cache.invalidate(agent_id)
     return {
-        "chunks_added": len(chunk_ids),
-        "file_id": str(file_doc["_id"])
+        "chunks_added": chunk_count,
+        "file_id": str(file_id)
     }
 
+def add_file(agent_id, text, file_name, file_type, chunk_size=3, overlap=1, chunk_type="sentence", 
+             *,  # force subsequent params to be keyword-only
+            collection_index: int = None, user_id=None, s3_bucket=None, s3_key=None):
+    """Chunk text and store vector embeddings using collection_index for bucket selection."""
+    log.info(f"Adding file '{file_name}' for agent {agent_id}")
+    collection_id = resolve_collection(agent_id, file_type, collection_index, user_id)
+
+    chunks = chunk_text(text, chunk_size, overlap, chunk_type)
+    log.info(f"Created {len(chunks)} chunks from file")
+    # The vectors carry the same file_id as the files document, so delete_file removes them
+    file_id = str(ObjectId())
+    batch_size = config.get("ingestion.embed_batch_size", 64)
+    for offset in range(0, len(chunks), batch_size):
+        log.debug(f"Processing chunks {offset + 1}-{min(offset + batch_size, len(chunks))}/{len(chunks)}")
+        store_chunks(agent_id, collection_id, file_id, file_name, chunks[offset:offset + batch_size], offset)
+    
+    file_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
+    log.debug(f"File hash: {file_hash}")
+    result = register_file(file_id, agent_id, file_name, file_type, collection_id, len(chunks), file_hash,
+                           user_id=user_id, s3_bucket=s3_bucket, s3_key=s3_key)
+    log.success(f"Successfully added file '{file_name}' with {len(chunks)} chunks")
+    return result
+
 def delete_file(agent_id, file_id, user_id=None):
     """Remove specific file and its chunks with security check."""
     # Convert supplied IDs
@@ -129,7 +196,7 @@ def delete_file(agent_id, file_id, user_id=None):
         raise ValueError("File not found")
     
     db_agents = mongo_client.ai.agents
-    agent = db_agents.find_one({"_id": agent_id})
+    agent = db_agents.find_one({"_id": agent_id}, {"user_id": 1})
     if not agent:
         log.error(f"Agent {agent_id} not found")
         raise ValueError("Agent not found")
@@ -142,24 +209,26 @@ def delete_file(agent_id, file_id, user_id=None):
     delete_file_documents(str(agent_id), file_id)  # Use string version if needed
     
     # Delete metadata
-    db_files.delete_one({"_id": file_id_obj})
-    # NEW: Remove file reference from the agent document
-    db_agents.update_one({"_id": agent_id}, {"$pull": {"files": file_id_obj}})
+    if db_files.delete_one({"_id": file_id_obj}).deleted_count:
+        db_agents.update_one({"_id": agent_id}, {"$inc": {f"file_counts.{file_data['collection_id']}": -1}})
+    agent_cache.invalidate(agent_id)
     log.success(f"Successfully deleted file {file_id} and its chunks")
 
-def get_all_files_for_agent(agent_id, user_id=None, limit=20, skip=0, sort_by="uploaded_at", sort_order=-1):
-    """Return paginated and sorted list of files for a given agent with optional security check."""
+def get_all_files_for_agent(agent_id, user_id=None, limit=20, skip=0, sort_by="uploaded_at", sort_order=-1, cursor=None):
+    """Return paginated and sorted list of files for a given agent with optional security check.
+
+    Pass cursor="" (then the returned next_cursor) for keyset paging; the result is then a dict
+    with "data" and "next_cursor".
+    """
     agent_id = to_obj(agent_id)
     if user_id:
         user_id = to_obj(user_id)
-        agent = mongo_client.ai.agents.find_one({"_id": agent_id})
+        agent = mongo_client.ai.agents.find_one({"_id": agent_id}, {"user_id": 1})
         if agent and "user_id" in agent and str(agent["user_id"]) != str(user_id):
             raise ValueError("Not authorized to view files for this agent")
     
-    files = list(mongo_client.ai.files.find({"agent_id": agent_id})
-                .sort(sort_by, sort_order)
-                .skip(skip)
-                .limit(limit))
+    files, next_cursor = find_page(mongo_client.ai.files, {"agent_id": agent_id},
+                                   sort_by, sort_order, limit, skip, cursor)
     
     # Convert ObjectIds to strings
     for file in files:
@@ -168,6 +237,8 @@ def get_all_files_for_agent(agent_id, user_id=None, limit=20, skip=0, sort_by="u
         if 'user_id' in file:
             file['user_id'] = str(file['user_id'])
     
+    if cursor is not None:
+        return {"data": files, "next_cursor": next_cursor}
     return files
 
 def get_all_collections_for_agent(agent_id, user_id=None):
@@ -175,14 +246,14 @@ def get_all_collections_for_agent(agent_id, user_id=None):
     agent_id = to_obj(agent_id)
     if user_id:
         user_id = to_obj(user_id)
-    agent = mongo_client.ai.agents.find_one({"_id": agent_id})
+    agent = mongo_client.ai.agents.find_one({"_id": agent_id}, {"user_id": 1, "collection_ids": 1})
     if not agent:
         return []
     if user_id and "user_id" in agent and str(agent["user_id"]) != str(user_id):
         raise ValueError("Not authorized to view collections for this agent")
     return agent.get("collection_ids", [])
 
-def get_all_files_for_collection(agent_id, *, collection_index: int, user_id=None, limit=20, skip=0, sort_by="uploaded_at", sort_order=-1):
+def get_all_files_for_collection(agent_id, *, collection_index: int, user_id=None, limit=20, skip=0, sort_by="uploaded_at", sort_order=-1, cursor=None):
     """Return paginated and sorted list of files for a specific collection using collection_index.
     
     Args:
@@ -193,10 +264,12 @@ def get_all_files_for_collection(agent_id, *, collection_index: int, user_id=Non
         skip: Number of records to skip
         sort_by: Field to sort by
         sort_order: Sort direction (1 for ascending, -1 for descending)
+        cursor: Keyset cursor ("" for the first page, then the previous next_cursor). When given,
+            the result is a dict with "data" and "next_cursor".
     """
     agent_id = to_obj(agent_id)
     db_agents = mongo_client.ai.agents
-    agent = db_agents.find_one({"_id": agent_id})
+    agent = db_agents.find_one({"_id": agent_id}, {"user_id": 1, "collection_ids": 1})
     if not agent:
         raise ValueError("Agent not found")
         
@@ -211,12 +284,10 @@ def get_all_files_for_collection(agent_id, *, collection_index: int, user_id=Non
         if "user_id" in agent and str(agent["user_id"]) != str(user_id):
             raise ValueError("Not authorized to view files for this collection")
     
-    files = list(mongo_client.ai.files.find({
+    files, next_cursor = find_page(mongo_client.ai.files, {
         "agent_id": agent_id,
         "collection_id": target_collection_id
-    }).sort(sort_by, sort_order)
-      .skip(skip)
-      .limit(limit))
+    }, sort_by, sort_order, limit, skip, cursor)
     
     for file in files:
         file['_id'] = str(file['_id'])
@@ -224,4 +295,6 @@ def get_all_files_for_collection(agent_id, *, collection_index: int, user_id=Non
         if 'user_id' in file:
             file['user_id'] = str(file['user_id'])
     
+    if cursor is not None:
+        return {"data": files, "next_cursor": next_cursor}
     return files
\ No newline at end of file
@@ -1,32 +1,170 @@
 from keys.keys import environment
-from ultraconfiguration import UltraConfig
+from utilities.settings import config
 from ultraprint.logging import logger
+from collections import deque
+from itertools import islice
+import hashlib
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('file_processor_log', 
             filename='debug/file_processor.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
             write_to_file=config.get("logging.write_to_file", False), 
             log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
 
+#! Streaming chunkers ---------------------------------------------------------
+# Both take an iterable of (page_number, text) and yield (chunk, first_page, last_page) as soon
+# as a chunk is complete, so only the current page and one chunk window are held in memory.
+# Pages are joined with a newline, and a sentence or window may span a page boundary.
+# Repeated chunks are dropped; only their digests are remembered.
+
+def stream_sentence_chunks(pages, chunk_size=3, overlap=1):
+    """Yield windows of `chunk_size` sentences, advancing by `chunk_size - overlap` sentences."""
+    step = max(chunk_size - overlap, 1)
+    window = deque()        # (sentence, page) for the sentences still needed
+    first = 0               # index of window[0]
+    next_start = 0          # index of the first sentence of the next chunk
+    count = 0               # sentences seen so far
+    tail, tail_page = "", None
+    seen = set()
+
+    def emit(end):
+        items = list(islice(window, next_start - first, end - first))
+        chunk = '. '.join(sentence for sentence, _ in items)
+        digest = hashlib.md5(chunk.encode("utf-8")).digest()
+        if chunk and digest not in seen:
+            seen.add(digest)
+            return chunk, items[0][1], items[-1][1]
+        return None
+
+    for index, (page, text) in enumerate(pages):
+        buffer = tail + ("\n" if index else "") + text
+        # The unfinished sentence carried over starts on its own page
+        starts = [tail_page if tail.strip() else page]
+        parts = buffer.split('.')
+        tail = parts.pop()
+        for part in parts:
+            sentence = part.strip()
+            if sentence:
+                window.append((sentence, starts[-1]))
+                count += 1
+            starts.append(page)
+            while next_start + chunk_size <= count:
+                chunk = emit(next_start + chunk_size)
+                if chunk:
+                    yield chunk
+                next_start += step
+                while window and first < next_start:
+                    window.popleft()
+                    first += 1
+        tail_page = starts[-1]
+
+    if tail.strip():
+        window.append((tail.strip(), tail_page))
+        count += 1
+    while next_start < count:
+        chunk = emit(min(next_start + chunk_size, count))
+        if chunk:
+            yield chunk
+        next_start += step
+
+def stream_character_chunks(pages, chunk_size=500, overlap=100):
+    """Yield windows of `chunk_size` characters, advancing by `chunk_size - overlap` characters."""
+    step = max(chunk_size - overlap, 1)
+    buffer, base = "", 0    # unconsumed text and the offset of its first character
+    marks = deque()         # (offset, page) where each page starts
+    start = 0
+    seen = set()
+
+    def emit():
+        chunk = buffer[start - base:start - base + chunk_size]
+        digest = hashlib.md5(chunk.encode("utf-8")).digest()
+        if not chunk.strip() or digest in seen:
+            return None
+        seen.add(digest)
+        end = start + len(chunk)
+        covered = [page for offset, page in marks if offset < end]
+        return chunk, covered[0], covered[-1]
+
+    for index, (page, text) in enumerate(pages):
+        if index:
+            buffer += "\n"
+        marks.append((base + len(buffer), page))
+        buffer += text
+        while start + chunk_size <= base + len(buffer):
+            chunk = emit()
+            if chunk:
+                yield chunk
+            start += step
+            cut = min(start, base + len(buffer)) - base
+            buffer, base = buffer[cut:], base + cut
+            while len(marks) > 1 and marks[1][0] <= start:
+                marks.popleft()
+
+    while start < base + len(buffer):
+        chunk = emit()
+        if chunk:
+            yield chunk
+        start += step
+
+def stream_row_chunks(rows, max_tokens=512, count_tokens=None):
+    """
+    Yield groups of spreadsheet rows, each with its sheet name and header row on top.
+
+    Rows are ([sheet, row_number], text) and the first row of each sheet is taken as its
+    header. Rows are added to a group until the next one would take it over `max_tokens`; a
+    single row longer than that becomes a group on its own. Yields (chunk, [sheet, first_row],
+    [sheet, last_row]).
+    """
+    count_tokens = count_tokens or (lambda text: len(text) // 4 + 1)
+    sheet, head, head_row, head_tokens = None, None, None, 0
+    group, first, last, used = [], None, None, 0
+    seen = set()
+
+    def emit():
+        chunk = "\n".join([head] + group)
+        digest = hashlib.md5(chunk.encode("utf-8")).digest()
+        if digest in seen:
+            return None
+        seen.add(digest)
+        if not group:
+            return chunk, [sheet, head_row], [sheet, head_row]
+        return chunk, [sheet, first], [sheet, last]
+
+    for (name, number), text in rows:
+        if name != sheet:
+            # A sheet with only a header still gets a chunk, so its column names are searchable
+            if head is not None and (group or first is None):
+                chunk = emit()
+                if chunk:
+                    yield chunk
+            sheet, head, head_row = name, f"Sheet: {name}\n{text}", number
+            head_tokens = count_tokens(head)
+            group, first, last, used = [], None, None, 0
+            continue
+        tokens = count_tokens(text)
+        if group and head_tokens + used + tokens > max_tokens:
+            chunk = emit()
+            if chunk:
+                yield chunk
+            group, used = [], 0
+        if not group:
+            first = number
+        group.append(text)
+        last, used = number, used + tokens
+
+    if head is not None and (group or first is None):
+        chunk = emit()
+        if chunk:
+            yield chunk
+
 #! Chunking functions --------------------------------------------------------
 def sentence_chunker(text, chunk_size=3, overlap=1):
     """Split text into sentence-level chunks."""
     log.debug(f"Starting sentence chunking with size={chunk_size}, overlap={overlap}")
     log.debug(f"Input text length: {len(text)} characters")
     
-    sentences = [s.strip() for s in text.split('.') if s.strip()]
-    log.debug(f"Found {len(sentences)} sentences")
-    
-    chunks = set()
-    i = 0
-    while i < len(sentences):
-        chunk = '. '.join(sentences[i : i + chunk_size])
-        chunks.add(chunk)
-        i += (chunk_size - overlap)
-    
-    result = list(filter(None, chunks))
+    result = [chunk for chunk, _, _ in stream_sentence_chunks([(None, text)], chunk_size, overlap)]
     log.success(f"Created {len(result)} sentence chunks")
     return result
 
@@ -34,17 +172,6 @@ def character_chunker(text, chunk_size=500, overlap=100):
     log.debug(f"Starting character chunking with size={chunk_size}, overlap={overlap}")
     log.debug(f"Input text length: {len(text)} characters")
     
-    chunks = set()
-    start = 0
-    end = chunk_size
-    while start < len(text):
-        chunk = text[start:end]
-        if chunk.strip():
-            chunks.add(chunk)
-        start += (chunk_size - overlap)
-        end += (chunk_size - overlap)
-    
-    result = list(chunks)
+    result = [chunk for chunk, _, _ in stream_character_chunks([(None, text)], chunk_size, overlap)]
     log.success(f"Created {len(result)} character chunks")
     return result
-
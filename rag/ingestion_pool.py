@@ -0,0 +1,351 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from bson import ObjectId
+from pymongo import ReturnDocument, DESCENDING, ASCENDING
+from keys.keys import environment
+from utilities.settings import config
+from ultraprint.logging import logger
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+#! Initialize ---------------------------------------------------------------
+log = logger('ingestion_pool_log',
+            filename='debug/ingestion_pool.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False),
+            log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+
+# Job statuses in jobs.files
+QUEUED = "QUEUED"
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+
+class LeaseLost(Exception):
+    """The job's lease expired and another pool claimed it, so this attempt must stop writing."""
+
+#! Worker pool ----------------------------------------------------------------
+class IngestionPool:
+    """
+    A fixed set of worker processes that claim and run jobs from a MongoDB job collection.
+
+    The collection is the queue, so any number of pools on any number of nodes can share it:
+    - A pool claims the next QUEUED job (highest priority, then oldest) with a single
+      find_one_and_update that sets it IN_PROGRESS under a lease owned by this pool.
+    - While the job runs, the pool renews the lease every `heartbeat_interval` seconds.
+    - A lease that is not renewed for `lease_ttl` seconds (crashed node, killed process) has
+      expired, and the job is claimed again by whichever pool gets to it first. The target
+      gets the lease ID and fences its writes with it, raising LeaseLost once it is gone.
+    - A failed job goes back to QUEUED with an exponential backoff until `max_attempts` is
+      used up, then it is FAILED. Every attempt is kept in the job's `attempt_history`.
+
+    Leases compare against each node's clock, so nodes need reasonably synchronised clocks
+    (a few seconds of skew against a lease_ttl of a minute is harmless).
+
+    Args:
+        target (callable): Module-level function run in a worker as target(job_id, lease_id). It must raise on failure.
+        collection: The pymongo jobs collection.
+        workers (int): The number of worker processes.
+        max_attempts (int): Runs per job before it is marked FAILED.
+        backoff_base (float): Seconds before the first retry; doubled for every further attempt.
+        backoff_max (float): The longest wait between retries.
+        max_tasks_per_child (int, optional): Jobs a worker runs before it is replaced. Defaults to None (never).
+        lease_ttl (float): Seconds a claim stays valid without a heartbeat.
+        heartbeat_interval (float): Seconds between lease renewals.
+        poll_interval (float): Seconds between looks at the queue while it is empty.
+    """
+
+    def __init__(self, target, collection, workers=2, max_attempts=3, backoff_base=5, backoff_max=300,
+                max_tasks_per_child=None, lease_ttl=60, heartbeat_interval=15, poll_interval=2):
+        self.target = target
+        self.collection = collection
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_tasks_per_child = max_tasks_per_child
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.worker_id = None
+        self._slots = threading.Semaphore(workers)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._counters = {"claimed": 0, "reclaimed": 0, "completed": 0, "retried": 0, "failed": 0, "leases_lost": 0}
+
+    #* Lifecycle ----------------------------------------------------------------
+    def start(self):
+        """Start the workers, the dispatcher and the heartbeat. Does nothing if already started."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            # Identifies this pool's leases; the pid is read here so it is the serving process's
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+            self._threads = [
+                threading.Thread(target=self._dispatch, name="ingestion-dispatcher", daemon=True),
+                threading.Thread(target=self._heartbeat, name="ingestion-heartbeat", daemon=True)
+            ]
+            for thread in self._threads:
+                thread.start()
+        log.info(f"Started ingestion pool {self.worker_id} with {self.workers} workers")
+
+    @property
+    def started(self):
+        return bool(self._threads)
+
+    def shutdown(self, timeout=30):
+        """
+        Stop claiming jobs and wait up to `timeout` seconds for the running ones to finish.
+
+        Jobs still running after that are stopped and handed back to the queue straight away,
+        rather than waiting for their leases to expire.
+        """
+        if not self.started:
+            return
+        self._stopping.set()
+        self._wake.set()
+        # Once the dispatcher has exited nothing new is claimed
+        self._threads[0].join(timeout=self.poll_interval * 2)
+        with self._lock:
+            running = list(self._running.items())
+        deadline = time.monotonic() + timeout
+        for _, (future, _) in running:
+            try:
+                future.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception:
+                pass
+        with self._lock:
+            interrupted = list(self._running.items())
+        for job_id, (_, job) in interrupted:
+            self._release(job_id, job, "interrupted", "Worker shut down", retry_delay=0)
+        with self._executor_lock:
+            if self._executor is not None:
+                if interrupted:
+                    # The jobs are back in the queue, so their processes must not keep writing
+                    for process in list(getattr(self._executor, "_processes", {}).values()):
+                        process.terminate()
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+        with self._lock:
+            self._threads = []
+        log.info(f"Ingestion pool {self.worker_id} stopped ({len(interrupted)} jobs handed back)")
+
+    def notify(self):
+        """Wake the dispatcher after a job was queued, instead of waiting for the next poll."""
+        self._wake.set()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                options = {"max_workers": self.workers, "mp_context": multiprocessing.get_context("spawn")}
+                if self.max_tasks_per_child:
+                    options["max_tasks_per_child"] = self.max_tasks_per_child
+                self._executor = ProcessPoolExecutor(**options)
+            return self._executor
+
+    def _reset_executor_if_broken(self, error):
+        # A worker that dies (e.g. killed for memory) breaks the whole executor; start a fresh one
+        if isinstance(error, BrokenProcessPool):
+            with self._executor_lock:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+
+    #* Claiming -----------------------------------------------------------------
+    def claim(self):
+        """
+        Claim the next runnable job for this pool.
+
+        Expired leases are reclaimed before new jobs are started, so work abandoned by a dead
+        node is finished first. Expired jobs that have no attempts left are marked FAILED.
+
+        Returns:
+            dict: The claimed job (_id, attempts, priority), or None if there is nothing to run.
+        """
+        now = datetime.now(timezone.utc)
+        # Each claim gets its own lease ID, which also marks its entry in attempt_history
+        lease_id = uuid4().hex
+        lease = {
+            "status": IN_PROGRESS,
+            "lease_id": lease_id,
+            "lease_owner": self.worker_id,
+            "lease_expires_at": now + timedelta(seconds=self.lease_ttl),
+            "heartbeat_at": now,
+            "started_at": now
+        }
+        claim = {
+            "$set": lease,
+            "$inc": {"attempts": 1},
+            "$push": {"attempt_history": {"lease_id": lease_id, "worker": self.worker_id, "started_at": now}}
+        }
+        options = {"projection": {"attempts": 1, "priority": 1, "lease_id": 1}, "return_document": ReturnDocument.AFTER}
+
+        self._fail_exhausted(now)
+        # Read back the previous lease so its attempt can be closed
+        job = self.collection.find_one_and_update(
+            {"status": IN_PROGRESS, "lease_expires_at": {"$lt": now}, "attempts": {"$lt": self.max_attempts}},
+            claim, sort=[("lease_expires_at", ASCENDING)], **{**options, "return_document": ReturnDocument.BEFORE})
+        if job is not None:
+            expired = job.get("lease_id")
+            job.update(attempts=job.get("attempts", 0) + 1, lease_id=lease_id)
+            self.collection.update_one(
+                {"_id": job["_id"], "attempt_history.lease_id": expired},
+                {"$set": {"attempt_history.$.outcome": "lease_expired", "attempt_history.$.finished_at": now}})
+            self._count("reclaimed")
+            log.warning(f"Reclaimed job {job['_id']} after its lease expired (attempt {job['attempts']})")
+            return job
+
+        job = self.collection.find_one_and_update(
+            {"status": QUEUED, "$or": [{"next_attempt_at": None}, {"next_attempt_at": {"$lte": now}}]},
+            claim, sort=[("priority", DESCENDING), ("created_at", ASCENDING)], **options)
+        if job is not None:
+            self._count("claimed")
+        return job
+
+    def _fail_exhausted(self, now):
+        """Fail jobs whose lease expired on their last attempt."""
+        result = self.collection.update_many(
+            {"status": IN_PROGRESS, "lease_expires_at": {"$lt": now}, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"status": FAILED, "last_error": "Lease expired on the last attempt", "finished_at": now},
+             "$unset": {"lease_id": "", "lease_owner": "", "lease_expires_at": ""}})
+        if result.modified_count:
+            self._count("failed", result.modified_count)
+            log.error(f"Failed {result.modified_count} jobs whose lease expired on the last attempt")
+
+    #* Dispatching --------------------------------------------------------------
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            # Only claim a job once a worker is free to run it, so leases are never held while waiting
+            if not self._slots.acquire(timeout=self.poll_interval):
+                continue
+            try:
+                job = self.claim()
+            except Exception as e:
+                log.error(f"Could not claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self._slots.release()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            job_id = str(job["_id"])
+            if self._stopping.is_set():
+                self._slots.release()
+                self._release(job_id, job, "interrupted", "Worker shut down", retry_delay=0)
+                break
+            try:
+                future = self._get_executor().submit(self.target, job_id, job["lease_id"])
+            except Exception as e:
+                log.error(f"Could not start job {job_id}: {str(e)}")
+                self._slots.release()
+                self._reset_executor_if_broken(e)
+                self._release(job_id, job, "failed", str(e))
+                continue
+            with self._lock:
+                self._running[job_id] = (future, job)
+            future.add_done_callback(lambda future, job=job, job_id=job_id: self._finished(job_id, job, future))
+
+    def _finished(self, job_id, job, future):
+        with self._lock:
+            self._running.pop(job_id, None)
+        self._slots.release()
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self._close(job_id, job, "completed")
+            self._count("completed")
+            return
+        self._reset_executor_if_broken(error)
+        self._release(job_id, job, "failed", str(error))
+
+    def _heartbeat(self):
+        while not self._stopping.wait(self.heartbeat_interval):
+            with self._lock:
+                lease_ids = [job["lease_id"] for _, job in self._running.values()]
+            if not lease_ids:
+                continue
+            now = datetime.now(timezone.utc)
+            try:
+                result = self.collection.update_many(
+                    {"lease_id": {"$in": lease_ids}, "status": IN_PROGRESS},
+                    {"$set": {"heartbeat_at": now, "lease_expires_at": now + timedelta(seconds=self.lease_ttl)}})
+                if result.matched_count < len(lease_ids):
+                    # The lease expired (e.g. a long GC pause or network partition) and another pool took the job
+                    lost = len(lease_ids) - result.matched_count
+                    self._count("leases_lost", lost)
+                    log.warning(f"Pool {self.worker_id} lost the lease on {lost} running jobs")
+            except Exception as e:
+                log.error(f"Heartbeat failed: {str(e)}")
+
+    #* Job state ----------------------------------------------------------------
+    def _close(self, job_id, job, outcome, error=None, update=None):
+        """
+        Record the end of this pool's attempt and drop its lease, if it still holds it.
+
+        Returns:
+            int: 1 if the lease was still held and the job was updated, else 0.
+        """
+        fields = {
+            "attempt_history.$.outcome": outcome,
+            "attempt_history.$.finished_at": datetime.now(timezone.utc)
+        }
+        if error:
+            fields["attempt_history.$.error"] = error
+        fields.update(update or {})
+        return self.collection.update_one(
+            {"_id": ObjectId(job_id), "lease_id": job["lease_id"], "attempt_history.lease_id": job["lease_id"]},
+            {"$set": fields, "$unset": {"lease_id": "", "lease_owner": "", "lease_expires_at": ""}}).matched_count
+
+    def _release(self, job_id, job, outcome, error, retry_delay=None):
+        """Put a job back in the queue after a failed attempt, or fail it when it has no attempts left."""
+        attempts = job["attempts"]
+        now = datetime.now(timezone.utc)
+        if attempts < self.max_attempts or outcome == "interrupted":
+            delay = retry_delay if retry_delay is not None else min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+            # An interrupted run was not the job's fault, so it does not use up an attempt
+            update = {"status": QUEUED, "last_error": error, "next_attempt_at": now + timedelta(seconds=delay)}
+            if outcome == "interrupted":
+                update["attempts"] = attempts - 1
+            if self._close(job_id, job, outcome, error, update):
+                self._count("retried")
+                log.warning(f"Job {job_id} {outcome} (attempt {attempts}/{self.max_attempts}), queued again in {delay}s: {error}")
+        elif self._close(job_id, job, outcome, error, {"status": FAILED, "last_error": error, "finished_at": now}):
+            self._count("failed")
+            log.error(f"Job {job_id} failed after {attempts} attempts: {error}")
+
+    #* Stats --------------------------------------------------------------------
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def stats(self):
+        """
+        Return this pool's worker usage and job counters since it started.
+
+        Queue depth across all pools is exported by the `jobs` metric rather than here,
+        so /status does not query MongoDB.
+
+        Returns:
+            dict: The pool's ID, workers, running jobs and counters.
+        """
+        with self._lock:
+            return {
+                "started": bool(self._threads),
+                "worker_id": self.worker_id,
+                "workers": self.workers,
+                "running": len(self._running),
+                **self._counters
+            }
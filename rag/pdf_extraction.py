@@ -0,0 +1,144 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from utilities.settings import config
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+#! PDF page extraction ---------------------------------------------------------
+# Kept free of the app's heavier imports: worker processes import this module to run
+# extract_page_range, so it should load in milliseconds.
+
+# PdfReader keeps every object it has parsed, so long documents are read with a fresh reader
+# every this many pages to keep memory flat
+PDF_PAGES_PER_READER = 50
+
+def page_count(source):
+    """Return the number of pages in a PDF, given its path or a binary stream"""
+    from PyPDF2 import PdfReader
+    return len(PdfReader(source).pages)
+
+def extract_page_range(source, first, last):
+    """
+    Extract pages first..last-1 (0-based) of a PDF, given its path or a binary stream, with their own reader.
+
+    Returns:
+        list: (page_number, text) with 1-based page numbers.
+    """
+    from PyPDF2 import PdfReader
+    reader = PdfReader(source)
+    return [(number + 1, reader.pages[number].extract_text() or "") for number in range(first, last)]
+
+def iter_pages_sequential(source, pages=None):
+    """Yield (page_number, text) for each page of a PDF, given its path or a binary stream, one page at a time"""
+    pages = pages if pages is not None else page_count(source)
+    for first in range(0, pages, PDF_PAGES_PER_READER):
+        yield from extract_page_range(source, first, min(first + PDF_PAGES_PER_READER, pages))
+
+def iter_pages_parallel(local_path, pages=None, workers=None, shard_pages=None):
+    """
+    Yield (page_number, text) for each page of a local PDF file, extracting page ranges in parallel.
+
+    The document is split into shards of `shard_pages` pages that are extracted by a pool of
+    `workers` processes. Results are yielded in page order, and at most two shards per worker
+    are in flight, so memory stays bounded however long the document is.
+    """
+    pages = pages if pages is not None else page_count(local_path)
+    workers = workers or config.get("ingestion.pdf_workers", os.cpu_count())
+    shard_pages = shard_pages or config.get("ingestion.pdf_shard_pages", 25)
+    shards = deque((first, min(first + shard_pages, pages)) for first in range(0, pages, shard_pages))
+    pending = deque()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        while shards or pending:
+            while shards and len(pending) < 2 * workers:
+                pending.append(executor.submit(extract_page_range, local_path, *shards.popleft()))
+            yield from pending.popleft().result()
+    finally:
+        # A consumer that stops early should not wait for shards nobody will read
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _iter_pages_spilled(stream, pages, workers):
+    """Run iter_pages_parallel on a copy of an in-memory PDF, since the worker processes need a file"""
+    fd, local_path = tempfile.mkstemp(suffix=".pdf", dir=config.get("caching.dir", "cache"))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            stream.seek(0)
+            shutil.copyfileobj(stream, f)
+        yield from iter_pages_parallel(local_path, pages, workers)
+    finally:
+        os.remove(local_path)
+
+def iter_pdf_pages(source):
+    """
+    Yield (page_number, text) for each page of a PDF, given its path or a binary stream.
+
+    Documents with at least `ingestion.pdf_parallel_pages` pages are extracted across
+    `ingestion.pdf_workers` processes (at most one per core); shorter ones are not worth
+    starting a pool for. The workers open the file themselves, so a stream that is not
+    backed by a file is copied to a temp file first.
+    """
+    pages = page_count(source)
+    workers = min(config.get("ingestion.pdf_workers", os.cpu_count()), os.cpu_count() or 1)
+    if workers > 1 and pages >= config.get("ingestion.pdf_parallel_pages", 100):
+        if isinstance(source, (str, os.PathLike)):
+            return iter_pages_parallel(source, pages, workers)
+        name = getattr(source, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            return iter_pages_parallel(name, pages, workers)
+        return _iter_pages_spilled(source, pages, workers)
+    return iter_pages_sequential(source, pages)
+
+#! Benchmark ------------------------------------------------------------------
+def make_pdf(path, pages, lines_per_page=45):
+    """Write a synthetic text PDF with `pages` pages of `lines_per_page` lines each."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = " T* ".join(f"(Page {page + 1} line {line}: the quick brown fox jumps over the lazy dog.) Tj" for line in range(lines_per_page))
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {lines} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        f.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+
+def benchmark(sizes=(10, 100, 1000), workers=None):
+    """
+    Time sequential and parallel extraction of synthetic PDFs and print the results.
+
+    Run with `python -m rag.pdf_extraction [pages ...]`. Parallel times include starting the
+    worker processes, which is what the page threshold has to pay for.
+    """
+    workers = workers or config.get("ingestion.pdf_workers", os.cpu_count())
+    print(f"{'pages':>8}{'sequential s':>15}{'parallel s':>13}{'speedup':>10}  ({workers} workers, {os.cpu_count()} cores)")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f"synthetic_{size}.pdf")
+            make_pdf(path, size)
+            start = time.perf_counter()
+            sequential = list(iter_pages_sequential(path))
+            sequential_time = time.perf_counter() - start
+            start = time.perf_counter()
+            parallel = list(iter_pages_parallel(path, workers=workers))
+            parallel_time = time.perf_counter() - start
+            if parallel != sequential:
+                raise RuntimeError(f"Parallel extraction of {size} pages differs from sequential extraction")
+            print(f"{size:>8}{sequential_time:>15.2f}{parallel_time:>13.2f}{sequential_time / parallel_time:>9.2f}x")
+
+if __name__ == "__main__":
+    benchmark([int(size) for size in sys.argv[1:]] or (10, 100, 1000))
@@ -1,13 +1,37 @@
-from multiprocessing import Process
 from bson import ObjectId
 from datetime import datetime, timezone
+from itertools import islice
 import hashlib
+import json
+import os
+import threading
+import time
 import traceback
 from database.mongo import client as mongo_client
-from rag.file_handler import get_file_content
-from rag.file_management import add_file
+from database.chroma import delete_file_documents
+from rag.file_handler import download_source, iter_pages
+from rag.file_management import resolve_collection, stream_chunks, store_chunks, register_file
+from rag.ingestion_pool import IngestionPool, LeaseLost
+from utilities.settings import config
+from utilities import metrics
+from keys.keys import environment
+from ultraprint.logging import logger
 
-def update_progress(job_id: str, step: str, status: str = "IN_PROGRESS", error: str = None, details: dict = None):
+#! Initialize ---------------------------------------------------------------
+log = logger('rag_log',
+            filename='debug/rag.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False),
+            log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+
+def job_filter(job_id: str, lease_id: str = None) -> dict:
+    """The filter for a job's document, fenced to the lease of the attempt writing to it, if given."""
+    query = {"_id": ObjectId(job_id)}
+    if lease_id:
+        query["lease_id"] = lease_id
+    return query
+
+def update_progress(job_id: str, step: str, status: str = "IN_PROGRESS", error: str = None, details: dict = None, lease_id: str = None):
     """
     Update the progress of a file processing job in MongoDB.
 
@@ -21,6 +45,7 @@ def update_progress(job_id: str, step: str, status: str = "IN_PROGRESS", error:
                                  Defaults to "IN_PROGRESS". The status is converted to uppercase.
         error (str, optional): An error message if the step failed. Defaults to None.
         details (dict, optional): Additional details to store with the step. Defaults to None.
+        lease_id (str, optional): The lease of the attempt; once another worker holds the job the update is dropped. Defaults to None.
 
     Returns:
         None: This function updates the MongoDB document directly.
@@ -38,19 +63,215 @@ def update_progress(job_id: str, step: str, status: str = "IN_PROGRESS", error:
         "details.current_step": step,
         f"details.steps.{step}": step_data
     }
-    mongo_client.jobs.files.update_one({"_id": ObjectId(job_id)}, {"$set": update})
+    mongo_client.jobs.files.update_one(job_filter(job_id, lease_id), {"$set": update})
+
+def job_metrics():
+    """Export the number of ingestion jobs per status, leaving out completed ones."""
+    counts = mongo_client.jobs.files.aggregate([
+        {"$match": {"status": {"$ne": "COMPLETED"}}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ])
+    return {"jobs": {"type": "gauge", "help": "", "samples": [[{"status": str(item["_id"])}, item["count"]] for item in counts]}}
+
+# Job counts live in MongoDB, so only the worker serving the scrape reads them
+metrics.register_collector(job_metrics, per_process=False)
+
+#! Checkpoints ----------------------------------------------------------------
+# Stages of a file job, in order. The job's `checkpoint` holds the furthest stage reached and
+# what a retried run needs to skip it; embedding also records how many batches are stored.
+# Pages stream straight from extraction into chunking and embedding, so "extracted" and
+# "chunked" are reached at the end of the same pass.
+STAGES = ["downloaded", "extracted", "chunked", "embedded", "stored"]
+
+# Extracted pages are kept here between attempts, so a retry on the same node skips the download
+ARTIFACT_DIR = os.path.join(config.get("caching.dir", "cache"), "ingestion")
+
+class SourceChanged(Exception):
+    """The file produced different chunks than the batches already stored for the job."""
+
+def reached(checkpoint: dict, stage: str) -> bool:
+    """Whether a job's checkpoint is at or past a stage."""
+    current = checkpoint.get("stage")
+    return current in STAGES and STAGES.index(current) >= STAGES.index(stage)
+
+def save_checkpoint(job_id: str, checkpoint: dict, stage: str = None, lease_id: str = None, **fields):
+    """
+    Store checkpoint fields on the job and mirror them into `checkpoint`.
+
+    The stage only ever moves forward, so redoing an early stage on another node (whose
+    local files are missing) keeps the batches that are already stored.
+
+    Raises:
+        LeaseLost: If `lease_id` is given and no longer holds the job, so the attempt must stop.
+    """
+    checkpoint.update(fields)
+    if stage and not reached(checkpoint, stage):
+        checkpoint["stage"] = stage
+    update = {f"checkpoint.{key}": value for key, value in fields.items()}
+    update["checkpoint.stage"] = checkpoint.get("stage")
+    update["checkpoint.updated_at"] = datetime.now(timezone.utc)
+    if not mongo_client.jobs.files.update_one(job_filter(job_id, lease_id), {"$set": update}).matched_count:
+        raise LeaseLost(f"Job {job_id} is no longer held by lease {lease_id}")
+
+def _read_pages(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            yield item["page"], item["text"]
+
+def _save_pages(job_id, pages, on_complete):
+    """Pass pages through while writing them to the job's artifact, published once complete."""
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    path = os.path.join(ARTIFACT_DIR, f"{job_id}.jsonl")
+    # Written under a temporary name and renamed, so a crash never leaves a partial file behind
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for page, text in pages:
+                f.write(json.dumps({"page": page, "text": text}) + "\n")
+                yield page, text
+    except BaseException:
+        # Also reached when the consumer fails and the generator is closed
+        _remove(path + ".tmp")
+        raise
+    os.replace(path + ".tmp", path)
+    on_complete(path)
+
+def sweep_artifacts() -> int:
+    """
+    Remove the page artifacts of jobs that will not run again.
+
+    A completed job removes its own artifact, but a job that ends FAILED (possibly marked by
+    a pool on another node) would keep a full-text copy of its document here for good. Files
+    of jobs that are no longer QUEUED or IN_PROGRESS, including the leftovers of interrupted
+    writes, are removed.
+
+    Returns:
+        int: The number of files removed.
+    """
+    if not os.path.isdir(ARTIFACT_DIR):
+        return 0
+    files = {}
+    for name in os.listdir(ARTIFACT_DIR):
+        job_id = name.split(".")[0]
+        if ObjectId.is_valid(job_id):
+            files.setdefault(job_id, []).append(os.path.join(ARTIFACT_DIR, name))
+    if not files:
+        return 0
+    active = {str(job["_id"]) for job in mongo_client.jobs.files.find(
+        {"_id": {"$in": [ObjectId(job_id) for job_id in files]}, "status": {"$in": ["QUEUED", "IN_PROGRESS"]}},
+        {"_id": 1})}
+    removed = 0
+    for job_id, paths in files.items():
+        if job_id in active:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+_sweeper_started = False
+
+def start_artifact_sweeper():
+    """
+    Sweep page artifacts now and then every `ingestion.artifact_sweep_interval` seconds.
+
+    Returns:
+        bool: True if the sweeper was started by this call.
+    """
+    global _sweeper_started
+    if _sweeper_started:
+        return False
+    _sweeper_started = True
+
+    def _sweep_forever():
+        while True:
+            try:
+                sweep_artifacts()
+            except Exception as e:
+                log.error(f"Artifact sweep failed: {str(e)}")
+            time.sleep(config.get("ingestion.artifact_sweep_interval", 3600))
+
+    threading.Thread(target=_sweep_forever, name="artifact-sweeper", daemon=True).start()
+    return True
 
-# Updated process_file_job to pass s3_bucket and s3_key directly
+def _hash_pages(pages, file_hash):
+    for index, (page, text) in enumerate(pages):
+        file_hash.update((("\n" if index else "") + text).encode("utf-8"))
+        yield page, text
+
+def _remove(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def embed_pages(job_id: str, checkpoint: dict, pages, agent_id: str, collection_id: str, file_name: str,
+                chunk_size: int, overlap: int, chunk_type: str, lease_id: str = None) -> str:
+    """
+    Chunk pages as they stream in and store the chunks in batches of `ingestion.embed_batch_size`.
+
+    Batches already stored by an earlier attempt are regenerated but not embedded again. A
+    digest of every chunk stored so far is checkpointed with each batch; if the regenerated
+    chunks do not match it, the source has changed and SourceChanged is raised.
+
+    Returns:
+        str: The MD5 of the file's text.
+
+    Raises:
+        SourceChanged: If the stored batches no longer match the file.
+        LeaseLost: If another worker took the job over.
+    """
+    file_id = checkpoint.get("file_id") or str(ObjectId())
+    # Pinned for the job, so a config change between attempts cannot shift the batch boundaries
+    batch_size = checkpoint.get("batch_size") or config.get("ingestion.embed_batch_size", 64)
+    done = checkpoint.get("batches_done", 0)
+    save_checkpoint(job_id, checkpoint, file_id=file_id, batch_size=batch_size, collection_id=collection_id, lease_id=lease_id)
+
+    file_hash, digest = hashlib.md5(), hashlib.md5()
+    chunks = stream_chunks(_hash_pages(pages, file_hash), chunk_size, overlap, chunk_type)
+    batch, count = 0, 0
+    while True:
+        items = list(islice(chunks, batch_size))
+        if batch == done and done and digest.hexdigest() != checkpoint.get("digest"):
+            raise SourceChanged(f"File {file_id} no longer matches the {done} batches already stored")
+        if not items:
+            if batch < done:
+                raise SourceChanged(f"File {file_id} now has fewer chunks than the {done} batches already stored")
+            break
+        for chunk, _ in items:
+            digest.update(hashlib.md5(chunk.encode("utf-8")).digest())
+        if batch >= done:
+            store_chunks(agent_id, collection_id, file_id, file_name, [chunk for chunk, _ in items], count,
+                         locations=[location for _, location in items])
+            save_checkpoint(job_id, checkpoint, batches_done=batch + 1, digest=digest.hexdigest(), lease_id=lease_id)
+            update_progress(job_id, "embedding", details={"batches_done": batch + 1, "chunks": count + len(items)}, lease_id=lease_id)
+        batch, count = batch + 1, count + len(items)
+    save_checkpoint(job_id, checkpoint, "embedded", chunk_count=count, file_hash=file_hash.hexdigest(), lease_id=lease_id)
+    return checkpoint["file_hash"]
+
+#! File jobs ------------------------------------------------------------------
 def process_file_job(job_id: str, agent_id: str, user_id: str,
                     file_name: str, file_type: str,
                     chunk_size: int, overlap: int, chunk_type: str,
                     s3_bucket: str = None, s3_key: str = None,
-                    collection_index: int = None):
+                    collection_index: int = None, lease_id: str = None):
     """
-    Background process for handling file processing using dedicated functions with step timing.
+    Background process for handling file processing in checkpointed stages with step timing.
+
+    The file is fetched from S3 (in memory unless it is large), then its pages stream through extraction, chunking and embedding
+    (in batches of `ingestion.embed_batch_size`), so memory does not grow with the document and
+    the first batches are stored while later pages are still being read. Chunks keep the pages
+    (or spreadsheet rows) they came from in their metadata. Finally the file is registered with
+    the agent.
+
+    Each stage and batch is checkpointed in the job document, so a retried job resumes after
+    the last completed stage or batch. Chunk IDs are derived from the file ID, which makes
+    re-storing a batch an overwrite.
 
-    This function processes a file by downloading its content, chunking it, and adding it to the
-    specified agent's knowledge base. It also updates the job's progress in MongoDB.
+    Every write to the job document is fenced to `lease_id`: once the lease has expired and
+    another worker has claimed the job, this attempt stops at its next checkpoint instead of
+    overwriting the new owner's progress or marking the job COMPLETED.
 
     Args:
         job_id (str): The ID of the job to process.
@@ -64,62 +285,148 @@ def process_file_job(job_id: str, agent_id: str, user_id: str,
         s3_bucket (str, optional): The name of the S3 bucket where the file is stored. Defaults to None.
         s3_key (str, optional): The key of the file in the S3 bucket. Defaults to None.
         collection_index (int, optional): The index of the collection to add the file to. Defaults to None.
+        lease_id (str, optional): The lease this attempt runs under. Defaults to None (unfenced).
 
     Returns:
         None: This function updates the MongoDB document and interacts with external services.
+
+    Raises:
+        Exception: Any failure, after it is recorded as the "failed" step, so the pool can retry the job.
     """
+    job = mongo_client.jobs.files.find_one({"_id": ObjectId(job_id)}, {"checkpoint": 1})
+    checkpoint = dict((job or {}).get("checkpoint") or {})
+    source = None
     try:
         # Build details based on file type: if webpage, use s3_key as URL; else use bucket/key
         if file_type == "webpage":
             details = {"url": s3_key}
         else:
             details = {"s3_key": s3_key, "s3_bucket": s3_bucket}
+        # Fail on a bad agent or collection before doing any expensive work
+        collection_id = resolve_collection(agent_id, file_type, collection_index, user_id)
+        # Spreadsheets are chunked by rows, whatever chunking the job asked for
+        if file_type == "excel":
+            chunk_type = "rows"
+
+        # Everything up to the stored vectors is skipped once all batches are in
+        if not reached(checkpoint, "embedded"):
+            pages_path = checkpoint.get("pages_path")
+            if reached(checkpoint, "extracted") and pages_path and os.path.exists(pages_path):
+                pages = _read_pages(pages_path)
+            else:
+                # Downloading step with timing
+                update_progress(job_id, "downloading", details={"input": details}, lease_id=lease_id)
+                download_start = datetime.now(timezone.utc)
+                source = download_source(file_type, details)
+                download_duration = (datetime.now(timezone.utc) - download_start).total_seconds()
+                update_progress(job_id, "downloading", status="COMPLETED", details={"duration": download_duration}, lease_id=lease_id)
+                save_checkpoint(job_id, checkpoint, "downloaded", size=source.size if source else None, lease_id=lease_id)
+                pages = _save_pages(job_id, iter_pages(file_type, source, details),
+                                    lambda path: save_checkpoint(job_id, checkpoint, "extracted", pages_path=path, lease_id=lease_id))
+
+            # Extracting, chunking and embedding step, one checkpoint per stored batch
+            update_progress(job_id, "embedding", details={"resumed_at_batch": checkpoint.get("batches_done", 0)}, lease_id=lease_id)
+            embedding_start = datetime.now(timezone.utc)
+            try:
+                embed_pages(job_id, checkpoint, pages, agent_id, collection_id, file_name, chunk_size, overlap, chunk_type, lease_id=lease_id)
+            except SourceChanged:
+                # Start the vectors over; the retry downloads and reads the file from scratch.
+                # The checkpoint is reset first, so a worker that lost the job deletes nothing
+                checkpoint["stage"] = None
+                save_checkpoint(job_id, checkpoint, batches_done=0, digest=None, pages_path=None, lease_id=lease_id)
+                delete_file_documents(agent_id, checkpoint["file_id"])
+                _remove(pages_path)
+                raise
+            embedding_duration = (datetime.now(timezone.utc) - embedding_start).total_seconds()
+            update_progress(job_id, "embedding", status="COMPLETED", details={"duration": embedding_duration}, lease_id=lease_id)
+
+        # Storing step: register the file with the agent
+        update_progress(job_id, "storing", lease_id=lease_id)
+        add_file_result = register_file(checkpoint["file_id"], agent_id, file_name, file_type, collection_id,
+                                        checkpoint["chunk_count"], checkpoint["file_hash"],
+                                        user_id=user_id, s3_bucket=s3_bucket, s3_key=s3_key)
+        save_checkpoint(job_id, checkpoint, "stored", lease_id=lease_id)
+        update_progress(job_id, "storing", status="COMPLETED", lease_id=lease_id)
         
-        # Downloading step with timing
-        update_progress(job_id, "downloading", details={"input": details})
-        download_start = datetime.now(timezone.utc)
-        text = get_file_content(file_type, details)
-        download_duration = (datetime.now(timezone.utc) - download_start).total_seconds()
-        update_progress(job_id, "downloading", status="COMPLETED", details={"duration": download_duration})
-        
-        # Chunking step with timing
-        update_progress(job_id, "chunking")
-        chunking_start = datetime.now(timezone.utc)
-        # Pass s3_bucket and s3_key to add_file unconditionally
-        add_file_result = add_file(agent_id, text, file_name, file_type,
-                                chunk_size=chunk_size, overlap=overlap,
-                                chunk_type=chunk_type, user_id=user_id,
-                                s3_bucket=s3_bucket, s3_key=s3_key,
-                                collection_index=collection_index)
-        chunking_duration = (datetime.now(timezone.utc) - chunking_start).total_seconds()
-        update_progress(job_id, "chunking", status="COMPLETED", details={"duration": chunking_duration})
-        
-        file_hash = hashlib.md5(text.encode("utf-8")).hexdigest()
-        update_progress(job_id, "completed", status="COMPLETED")
-        mongo_client.jobs.files.update_one(
-            {"_id": ObjectId(job_id)},
+        update_progress(job_id, "completed", status="COMPLETED", lease_id=lease_id)
+        completed = mongo_client.jobs.files.update_one(
+            job_filter(job_id, lease_id),
             {"$set": {
                 "status": "COMPLETED",
                 "chunks_added": add_file_result["chunks_added"],
-                "file_hash": file_hash,
+                "file_hash": checkpoint["file_hash"],
                 "file_id": add_file_result["file_id"]
             }}
         )
+        if not completed.matched_count:
+            raise LeaseLost(f"Job {job_id} is no longer held by lease {lease_id}")
+        _remove(checkpoint.get("pages_path"))
         
     except Exception as e:
         error_msg = traceback.format_exc()  # Capture full traceback
-        update_progress(job_id, "failed", status="FAILED", error=error_msg)
-    
+        update_progress(job_id, "failed", status="FAILED", error=error_msg, lease_id=lease_id)
+        raise
+    finally:
+        if source:
+            source.close()
+
+def run_job(job_id: str, lease_id: str = None):
+    """
+    Run a stored file job in an ingestion worker.
+
+    The job's inputs and chunking options are read from its record in `jobs.files`, so
+    only the ID and the lease are sent to the worker process.
+
+    Args:
+        job_id (str): The ID of the job to run.
+        lease_id (str, optional): The lease the pool claimed the job under. Defaults to None.
+
+    Raises:
+        LeaseLost: If the lease no longer holds the job, before or while it runs.
+    """
+    job = mongo_client.jobs.files.find_one({"_id": ObjectId(job_id)})
+    if job is None:
+        raise ValueError(f"Job {job_id} not found")
+    if lease_id and job.get("lease_id") != lease_id:
+        raise LeaseLost(f"Job {job_id} is no longer held by lease {lease_id}")
+    options = job.get("options", {})
+    # Webpage jobs keep their URL where the S3 key would be
+    s3_key = job.get("url") if job["file_type"] == "webpage" else job.get("s3_key")
+    process_file_job(job_id, job["agent_id"], job.get("user_id"), job["file_name"], job["file_type"],
+                    options.get("chunk_size", 3), options.get("overlap", 1), options.get("chunk_type", "sentence"),
+                    s3_bucket=job.get("s3_bucket"), s3_key=s3_key,
+                    collection_index=options.get("collection_index"), lease_id=lease_id)
+
+# One pool per process. It runs in the API processes unless ingestion.run_in_api is false,
+# and always in the standalone worker (_worker.py)
+ingestion_pool = IngestionPool(
+    run_job, mongo_client.jobs.files,
+    workers=config.get("ingestion.workers", 2),
+    max_attempts=config.get("ingestion.max_attempts", 3),
+    backoff_base=config.get("ingestion.backoff_base", 5),
+    backoff_max=config.get("ingestion.backoff_max", 300),
+    max_tasks_per_child=config.get("ingestion.max_tasks_per_child"),
+    lease_ttl=config.get("ingestion.lease_ttl", 60),
+    heartbeat_interval=config.get("ingestion.heartbeat_interval", 15),
+    poll_interval=config.get("ingestion.poll_interval", 2)
+)
+
+def start_ingestion():
+    """Start this API process's ingestion workers, unless ingestion runs on dedicated worker nodes."""
+    if config.get("ingestion.run_in_api", True):
+        ingestion_pool.start()
+        start_artifact_sweeper()
+
 # Updated start_file_job signature with optional s3_bucket and s3_key
 def start_file_job(agent_id: str, user_id: str, file_name: str, file_type: str,
                 s3_bucket: str = None, s3_key: str = None,
                 chunk_size: int = 3, overlap: int = 1, chunk_type: str = "sentence",
-                collection_index: int = None) -> dict:
+                collection_index: int = None, priority: int = None) -> dict:
     """
     Start a file processing job.
 
-    This function creates a job record in the 'jobs' collection with the status 'IN_PROGRESS'
-    and spawns a background process to handle the file processing.
+    This function creates a job record in the 'jobs' collection with the status 'QUEUED'.
+    Any ingestion worker, on this node or another, claims it when it has a free slot.
 
     Args:
         agent_id (str): The ID of the agent to associate the file with.
@@ -132,10 +439,13 @@ def start_file_job(agent_id: str, user_id: str, file_name: str, file_type: str,
         overlap (int, optional): The amount of overlap between chunks. Defaults to 1.
         chunk_type (str, optional): The type of chunking to use (e.g., "sentence"). Defaults to "sentence".
         collection_index (int, optional): The index of the collection to add the file to. Defaults to None.
+        priority (int, optional): Higher runs first. Defaults to `ingestion.default_priority`.
 
     Returns:
         dict: A dictionary containing the job ID.
     """
+    if priority is None:
+        priority = config.get("ingestion.default_priority", 0)
     job_collection = mongo_client.jobs.files
     job_record = {
         "job_type": "file_upload",
@@ -143,7 +453,15 @@ def start_file_job(agent_id: str, user_id: str, file_name: str, file_type: str,
         "user_id": user_id,
         "file_name": file_name,
         "file_type": file_type,
-        "status": "IN_PROGRESS",  # Updated to uppercase
+        "status": "QUEUED",
+        "priority": priority,
+        "attempts": 0,
+        "options": {
+            "chunk_size": chunk_size,
+            "overlap": overlap,
+            "chunk_type": chunk_type,
+            "collection_index": collection_index
+        },
         "created_at": datetime.now(timezone.utc),
         "details": {
             "current_step": None,
@@ -160,10 +478,7 @@ def start_file_job(agent_id: str, user_id: str, file_name: str, file_type: str,
     result = job_collection.insert_one(job_record)
     job_id = str(result.inserted_id)
     
-    # Spawn background process to process the file job
-    Process(
-        target=process_file_job,
-        args=(job_id, agent_id, user_id, file_name, file_type, chunk_size, overlap, chunk_type, s3_bucket, s3_key, collection_index)
-    ).start()
+    # Saves the local pool a poll; other nodes pick the job up on theirs
+    ingestion_pool.notify()
     
     return {"job_id": job_id}
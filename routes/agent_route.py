@@ -13,6 +13,7 @@ from llm.agents import (
     search_agents  # add import for search
 )
 from errors.error_logger import log_exception_with_request
+from utilities.pagination import page_fields
 
 router = APIRouter()
 
@@ -110,7 +111,8 @@ async def list_public_agents(
     skip: int = 0, 
     sort_by: str = "created_at",
     sort_order: int = -1,
-    user_id: str = Query(None)  # Add optional user_id parameter
+    user_id: str = Query(None),  # Add optional user_id parameter
+    cursor: str = None
 ):
     try:
         agents = get_all_public_agents(
@@ -118,11 +120,12 @@ async def list_public_agents(
             skip=skip, 
             sort_by=sort_by, 
             sort_order=sort_order,
-            user_id=user_id  # Pass user_id to function
+            user_id=user_id,  # Pass user_id to function
+            cursor=cursor
         )
         return {
             "message": "Public agents retrieved successfully.",
-            "data": agents
+            **page_fields(agents)
         }
     except Exception as e:
         log_exception_with_request(e, list_public_agents, request)
@@ -138,7 +141,8 @@ async def list_approved_agents(
     skip: int = 0, 
     sort_by: str = "created_at",
     sort_order: int = -1,
-    user_id: str = Query(None)  # Add optional user_id parameter
+    user_id: str = Query(None),  # Add optional user_id parameter
+    cursor: str = None
 ):
     try:
         agents = get_all_approved_agents(
@@ -146,11 +150,12 @@ async def list_approved_agents(
             skip=skip, 
             sort_by=sort_by, 
             sort_order=sort_order,
-            user_id=user_id  # Pass user_id to function
+            user_id=user_id,  # Pass user_id to function
+            cursor=cursor
         )
         return {
             "message": "Approved agents retrieved successfully.",
-            "data": agents
+            **page_fields(agents)
         }
     except Exception as e:
         log_exception_with_request(e, list_approved_agents, request)
@@ -166,7 +171,8 @@ async def list_system_agents(
     skip: int = 0, 
     sort_by: str = "created_at",
     sort_order: int = -1,
-    user_id: str = Query(None)  # Add optional user_id parameter
+    user_id: str = Query(None),  # Add optional user_id parameter
+    cursor: str = None
 ):
     try:
         agents = get_all_system_agents(
@@ -174,11 +180,12 @@ async def list_system_agents(
             skip=skip, 
             sort_by=sort_by, 
             sort_order=sort_order,
-            user_id=user_id  # Pass user_id to function
+            user_id=user_id,  # Pass user_id to function
+            cursor=cursor
         )
         return {
             "message": "System agents retrieved successfully.",
-            "data": agents
+            **page_fields(agents)
         }
     except Exception as e:
         log_exception_with_request(e, list_system_agents, request)
@@ -194,13 +201,14 @@ async def list_user_agents(
     limit: int = 20, 
     skip: int = 0, 
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ):
     try:
-        agents = get_all_agents_for_user(user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order)
+        agents = get_all_agents_for_user(user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order, cursor=cursor)
         return {
             "message": "User agents retrieved successfully.",
-            "data": agents
+            **page_fields(agents)
         }
     except Exception as e:
         log_exception_with_request(e, list_user_agents, request)
@@ -216,13 +224,14 @@ async def list_user_nonprivate_agents(
     limit: int = 20, 
     skip: int = 0, 
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ):
     try:
-        agents = get_all_nonprivate_agents_for_user(user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order)
+        agents = get_all_nonprivate_agents_for_user(user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order, cursor=cursor)
         return {
             "message": "User non-private agents retrieved successfully.",
-            "data": agents
+            **page_fields(agents)
         }
     except Exception as e:
         log_exception_with_request(e, list_user_nonprivate_agents, request)
@@ -281,7 +290,8 @@ async def search_agent(
     types: list = Query([], description="Agent types to filter (e.g., public, private, approved, system)"),
     sort_by: str = Query("created_at", description="Field to sort results by"),
     sort_order: int = Query(-1, description="Sort order (-1 for descending, 1 for ascending)"),
-    user_id: str = Query(None)  # Add optional user_id parameter
+    user_id: str = Query(None),  # Add optional user_id parameter
+    cursor: str = Query(None, description="Keyset cursor: empty for the first page, then the previous next_cursor")
 ):
     try:
         agents = search_agents(
@@ -291,11 +301,12 @@ async def search_agent(
             types, 
             sort_by, 
             sort_order,
-            user_id=user_id  # Pass user_id to function
+            user_id=user_id,  # Pass user_id to function
+            cursor=cursor
         )
         return {
             "message": "Agents retrieved successfully.",
-            "data": agents
+            **page_fields(agents)
         }
     except Exception as e:
         log_exception_with_request(e, search_agent, request)
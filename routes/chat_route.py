@@ -3,8 +3,8 @@ from fastapi.responses import StreamingResponse
 from llm.chat import chat, team_chat, team_chat_managed, team_chat_flow
 from errors.error_logger import log_exception_with_request
 from typing import Optional
-from bson import ObjectId
-from database.mongo import client as mongo_client
+from database.cache import session_cache
+from llm.sessions import SESSION_PROJECTIONS
 
 router = APIRouter()
 
@@ -16,12 +16,12 @@ async def chat_endpoint(
     stream: Optional[bool] = False,
     use_rag: Optional[bool] = True,
     include_rich_response: Optional[bool] = True,
+    include_timings: Optional[bool] = False,
     user_id: Optional[str] = None,
     request: Request = None
 ):
     try:
-        db = mongo_client.ai
-        session_doc = db.sessions.find_one({"_id": ObjectId(session_id)})
+        session_doc = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
         if not session_doc:
             raise HTTPException(status_code=404, detail="Session not found")
         # Updated check: trim and lower-case the session_type
@@ -45,7 +45,8 @@ async def chat_endpoint(
                     stream=True,
                     use_rag=use_rag,
                     user_id=user_id,
-                    include_rich_response=include_rich_response
+                    include_rich_response=include_rich_response,
+                    include_timings=include_timings
                 ),
                 media_type='text/event-stream',
                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
@@ -58,7 +59,8 @@ async def chat_endpoint(
                 stream=False,
                 use_rag=use_rag,
                 user_id=user_id,
-                include_rich_response=include_rich_response
+                include_rich_response=include_rich_response,
+                include_timings=include_timings
             )
             return {
                 "message": "Chat completed successfully.",
@@ -84,12 +86,12 @@ async def team_chat_endpoint(
     stream: bool = False,
     use_rag: bool = True,
     include_rich_response: bool = True,
+    include_timings: bool = False,
     user_id: Optional[str] = None,
     request: Request = None
 ):
     try:
-        db = mongo_client.ai
-        session_doc = db.sessions.find_one({"_id": ObjectId(session_id)})
+        session_doc = session_cache.get(session_id, SESSION_PROJECTIONS["chat"])
         if not session_doc:
             raise HTTPException(status_code=404, detail="Session not found")
 
@@ -119,7 +121,8 @@ async def team_chat_endpoint(
                     stream=True,
                     use_rag=use_rag,
                     user_id=user_id,
-                    include_rich_response=include_rich_response
+                    include_rich_response=include_rich_response,
+                    include_timings=include_timings
                 ),
                 media_type='text/event-stream',
                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
@@ -131,7 +134,8 @@ async def team_chat_endpoint(
                 stream=False,
                 use_rag=use_rag,
                 user_id=user_id,
-                include_rich_response=include_rich_response
+                include_rich_response=include_rich_response,
+                include_timings=include_timings
             )
             # Ensure we return a valid JSON response
             return {"status": "success", "data": response}
@@ -4,6 +4,7 @@ from database.mongo import client as mongo_client
 from bson import ObjectId
 from utilities.save_json import convert_objectid_to_str
 from errors.error_logger import log_exception_with_request
+from utilities.pagination import page_fields
 from rag.file_management import delete_file, get_all_files_for_agent, get_all_collections_for_agent, get_all_files_for_collection, to_obj  # Add to_obj import
 
 router = APIRouter()
@@ -20,9 +21,10 @@ async def start_job(
     s3_key: str = None,       
     chunk_size: int = 3,
     overlap: int = 1,
-    chunk_type: str = "sentence"
+    chunk_type: str = "sentence",
+    priority: int = None
 ):
-    """Start a file processing job."""
+    """Queue a file processing job; higher priority jobs run first."""
     try:
         job_data = start_file_job(
             agent_id=agent_id,
@@ -34,7 +36,8 @@ async def start_job(
             s3_key=s3_key,
             chunk_size=chunk_size,
             overlap=overlap,
-            chunk_type=chunk_type
+            chunk_type=chunk_type,
+            priority=priority
         )
         return {
             "message": "File processing job started successfully.",
@@ -81,11 +84,11 @@ async def delete_file_endpoint(agent_id: str, file_id: str, request: Request, us
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/files/all/{agent_id}")
-async def retrieve_all_files_for_agent(agent_id: str, request: Request, user_id: str = None, limit: int = 20, skip: int = 0):
+async def retrieve_all_files_for_agent(agent_id: str, request: Request, user_id: str = None, limit: int = 20, skip: int = 0, cursor: str = None):
     """Return paginated list of all files for an agent."""
     try:
-        data = get_all_files_for_agent(agent_id, user_id=user_id, limit=limit, skip=skip)
-        return {"message": "Files retrieved successfully.", "data": data}
+        data = get_all_files_for_agent(agent_id, user_id=user_id, limit=limit, skip=skip, cursor=cursor)
+        return {"message": "Files retrieved successfully.", **page_fields(data)}
     except Exception as e:
         log_exception_with_request(e, retrieve_all_files_for_agent, request)
         raise HTTPException(status_code=500, detail={
@@ -113,7 +116,8 @@ async def retrieve_all_files_for_collection(
     request: Request, 
     user_id: str = None, 
     limit: int = 20, 
-    skip: int = 0
+    skip: int = 0,
+    cursor: str = None
 ):
     """Return paginated list of files for a collection using collection index."""
     try:
@@ -122,9 +126,10 @@ async def retrieve_all_files_for_collection(
             collection_index=collection_index,  # Pass as named parameter
             user_id=user_id, 
             limit=limit, 
-            skip=skip
+            skip=skip,
+            cursor=cursor
         )
-        return {"message": "Collection files retrieved successfully.", "data": data}
+        return {"message": "Collection files retrieved successfully.", **page_fields(data)}
     except Exception as e:
         log_exception_with_request(e, retrieve_all_files_for_collection, request)
         raise HTTPException(status_code=500, detail={
@@ -17,6 +17,7 @@ from llm.sessions import (
     update_session_name
 )
 from errors.error_logger import log_exception_with_request
+from utilities.pagination import page_fields
 
 router = APIRouter()
 
@@ -112,10 +113,11 @@ async def get_history_endpoint(
     request: Request,
     user_id: str = None,
     limit: int = 20,
-    skip: int = 0
+    skip: int = 0,
+    cursor: str = None
 ):
     try:
-        history = get_session_history(session_id, user_id, limit=limit, skip=skip)
+        history = get_session_history(session_id, user_id, limit=limit, skip=skip, cursor=cursor)
         return {
             "message": "Session history retrieved successfully.",
             "data": history
@@ -139,10 +141,11 @@ async def get_team_session_history_endpoint(
     request: Request,
     user_id: str = None,
     limit: int = 20,
-    skip: int = 0
+    skip: int = 0,
+    cursor: str = None
 ):
     try:
-        history = get_team_session_history(session_id, user_id, limit, skip)
+        history = get_team_session_history(session_id, user_id, limit, skip, cursor=cursor)
         return {
             "message": "Team session history retrieved successfully.",
             "data": history
@@ -214,10 +217,11 @@ async def get_recent_history_endpoint(
     request: Request,
     user_id: str = None,
     limit: int = 20,
-    skip: int = 0
+    skip: int = 0,
+    cursor: str = None
 ):
     try:
-        recent_history = get_recent_history(session_id, user_id, limit=limit, skip=skip)
+        recent_history = get_recent_history(session_id, user_id, limit=limit, skip=skip, cursor=cursor)
         return {
             "message": "Recent session history retrieved successfully.",
             "data": recent_history
@@ -241,13 +245,14 @@ async def list_user_sessions(
     limit: int = 20,
     skip: int = 0,
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ):
     try:
-        sessions = get_all_sessions_for_user(user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order)
+        sessions = get_all_sessions_for_user(user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order, cursor=cursor)
         return {
             "message": "User sessions retrieved successfully.",
-            "data": sessions
+            **page_fields(sessions)
         }
     except Exception as e:
         log_exception_with_request(e, list_user_sessions, request)
@@ -263,15 +268,16 @@ async def list_user_team_sessions(
     limit: int = 20,
     skip: int = 0,
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ):
     try:
         sessions = get_team_sessions_for_user(
-            user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order
+            user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order, cursor=cursor
         )
         return {
             "message": "Team sessions retrieved successfully.",
-            "data": sessions
+            **page_fields(sessions)
         }
     except Exception as e:
         log_exception_with_request(e, list_user_team_sessions, request)
@@ -287,15 +293,16 @@ async def list_user_standalone_sessions(
     limit: int = 20,
     skip: int = 0,
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ):
     try:
         sessions = get_standalone_sessions_for_user(
-            user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order
+            user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order, cursor=cursor
         )
         return {
             "message": "Standalone sessions retrieved successfully.",
-            "data": sessions
+            **page_fields(sessions)
         }
     except Exception as e:
         log_exception_with_request(e, list_user_standalone_sessions, request)
@@ -312,13 +319,14 @@ async def list_agent_sessions(
     limit: int = 20,
     skip: int = 0,
     sort_by: str = "created_at",
-    sort_order: int = -1
+    sort_order: int = -1,
+    cursor: str = None
 ):
     try:
-        sessions = get_agent_sessions_for_user(agent_id, user_id=user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order)
+        sessions = get_agent_sessions_for_user(agent_id, user_id=user_id, limit=limit, skip=skip, sort_by=sort_by, sort_order=sort_order, cursor=cursor)
         return {
             "message": "Agent sessions retrieved successfully.",
-            "data": sessions
+            **page_fields(sessions)
         }
     except ValueError as e:
         raise HTTPException(status_code=403, detail={
@@ -338,10 +346,11 @@ async def get_session_endpoint(
     request: Request,
     user_id: str = None,
     limit: int = 20,
-    skip: int = 0
+    skip: int = 0,
+    cursor: str = None
 ):
     try:
-        session = get_session(session_id, user_id, limit=limit, skip=skip)
+        session = get_session(session_id, user_id, limit=limit, skip=skip, cursor=cursor)
         return {
             "message": "Session details retrieved successfully.",
             "data": session
@@ -379,11 +388,12 @@ async def get_session_details(
     session_id: str,
     limit: int = Query(20, ge=1),
     skip: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
     user_id: Optional[str] = None,
     request: Request = None  # Add request parameter
 ):
     try:
-        session_data = get_session(session_id, user_id=user_id, limit=limit, skip=skip)
+        session_data = get_session(session_id, user_id=user_id, limit=limit, skip=skip, cursor=cursor)
         if not session_data:
             raise HTTPException(status_code=404, detail="Session not found")
         return session_data
@@ -0,0 +1,86 @@
+from keys.keys import openai_api_key, cohere_api_key, chroma_host, chroma_port, aws_access_key_id, aws_secret
+from utilities.settings import config
+import threading
+
+#! Shared clients -------------------------------------------------------------
+# Each client is created on first use and then shared by the whole process. The SDKs are
+# imported at the same time, so a process that never needs one (e.g. a chat-only worker
+# and boto3) never pays for importing it.
+_clients = {}
+_lock = threading.Lock()
+
+def _get(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def _make_openai():
+    from openai import OpenAI
+    return OpenAI(api_key=openai_api_key)
+
+def _make_cohere():
+    import cohere
+    return cohere.Client(cohere_api_key)
+
+def _make_chroma():
+    import chromadb
+    return chromadb.HttpClient(host=chroma_host, port=chroma_port)
+
+def _make_s3():
+    import boto3
+    region = config.get("aws.region", "us-east-1")
+    session = boto3.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret,
+        region_name=region)
+    return session.client("s3", region_name=region)
+
+FACTORIES = {
+    "openai": _make_openai,
+    "cohere": _make_cohere,
+    "chroma": _make_chroma,
+    "s3": _make_s3
+}
+
+def openai_client():
+    """Return the shared OpenAI client."""
+    return _get("openai", _make_openai)
+
+def cohere_client():
+    """Return the shared Cohere client."""
+    return _get("cohere", _make_cohere)
+
+def chroma_client():
+    """Return the shared ChromaDB HTTP client."""
+    return _get("chroma", _make_chroma)
+
+def s3_client():
+    """Return the shared S3 client (boto3 clients are thread-safe)."""
+    return _get("s3", _make_s3)
+
+def warm_up(names=None):
+    """
+    Create clients ahead of their first use, e.g. on a background thread after startup.
+
+    Args:
+        names (list, optional): Client names from FACTORIES. Defaults to `startup.warm_clients`.
+
+    Returns:
+        dict: A mapping of client name to None on success or the error message.
+    """
+    results = {}
+    for name in names if names is not None else config.get("startup.warm_clients", ["openai", "cohere", "chroma"]):
+        try:
+            _get(name, FACTORIES[name])
+            results[name] = None
+        except Exception as e:
+            results[name] = str(e)
+    return results
+
+def loaded_clients():
+    """Return the names of the clients created so far."""
+    return sorted(_clients)
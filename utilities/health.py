@@ -0,0 +1,166 @@
+from database.mongo import client as mongo_client, check_mongo_structure
+from utilities.clients import chroma_client
+from keys.keys import environment
+from utilities.settings import config
+from ultraprint.logging import logger
+from utilities import metrics
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+import threading
+import time
+
+#! Initialize ---------------------------------------------------------------
+log = logger('health_log',
+            filename='debug/health.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False),
+            log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+
+metrics.registry.describe("dependency_up", "gauge", "1 if the last health probe of a dependency succeeded, by dependency.")
+metrics.registry.describe("health_probe_duration_seconds", "histogram", "Health probe latency, by dependency and mode (light or deep).")
+
+#! Probes ---------------------------------------------------------------------
+def _chroma_collections():
+    """Deep check: every configured Chroma collection exists."""
+    existing = chroma_client().list_collections()
+    missing = [name for name in config.get("chroma.structure", []) if name not in existing]
+    if missing:
+        raise RuntimeError(f"Missing collections: {missing}")
+
+def _mongo_structure():
+    """Deep check: every configured database, collection and index exists."""
+    if not check_mongo_structure(verbose=False):
+        raise RuntimeError("MongoDB structure or indexes are incomplete")
+
+# Light probes are a single round trip; deep probes verify the configured structure
+PROBES = {
+    "mongodb": {"light": lambda: mongo_client.admin.command("ping"), "deep": _mongo_structure},
+    "chromadb": {"light": lambda: chroma_client().heartbeat(), "deep": _chroma_collections}
+}
+
+# Probes get their own threads so a hung dependency cannot block the prober or the caller
+_executor = ThreadPoolExecutor(max_workers=2 * len(PROBES), thread_name_prefix="health-probe")
+_pending = {}
+_pending_lock = threading.Lock()
+
+def run_probe(name, mode="light", timeout=None):
+    """
+    Run one probe with a timeout.
+
+    While an earlier probe of the same dependency and mode is still hanging, no new one is
+    started and the dependency is reported as down, so slow dependencies do not pile up
+    probe threads.
+
+    Args:
+        name (str): The dependency ("mongodb" or "chromadb").
+        mode (str, optional): "light" or "deep". Defaults to "light".
+        timeout (float, optional): Seconds to wait for the probe. Defaults to `health.timeout`.
+
+    Returns:
+        dict: status ("up" or "down"), latency_ms, checked_at and, on failure, error.
+    """
+    timeout = timeout or config.get("health.timeout", 5)
+    key = (name, mode)
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is None or future.done():
+            future = _pending[key] = _executor.submit(PROBES[name][mode])
+            started = time.perf_counter()
+        else:
+            started = None
+    result = {"status": "down", "checked_at": datetime.now(timezone.utc).isoformat()}
+    if started is None:
+        result.update(latency_ms=None, error="Previous probe is still running")
+    else:
+        try:
+            future.result(timeout=timeout)
+            result["status"] = "up"
+        except FutureTimeoutError:
+            result["error"] = f"Timed out after {timeout}s"
+        except Exception as e:
+            result["error"] = str(e)
+        elapsed = time.perf_counter() - started
+        result["latency_ms"] = round(elapsed * 1000, 2)
+        metrics.observe("health_probe_duration_seconds", elapsed, dependency=name, mode=mode)
+    if result["status"] != "up":
+        log.warning(f"Health probe {name} ({mode}) failed: {result.get('error')}")
+    return result
+
+def probe_all(mode="light"):
+    """Run every probe concurrently and return {dependency: result}."""
+    with ThreadPoolExecutor(max_workers=len(PROBES)) as pool:
+        return dict(zip(PROBES, pool.map(lambda name: run_probe(name, mode), PROBES)))
+
+#! Cached snapshot ------------------------------------------------------------
+_snapshot = {"results": None, "updated": None}
+_snapshot_lock = threading.Lock()
+
+def refresh():
+    """Probe every dependency and store the results as the current snapshot."""
+    results = probe_all("light")
+    with _snapshot_lock:
+        _snapshot["results"] = results
+        _snapshot["updated"] = time.monotonic()
+    return results
+
+def snapshot():
+    """
+    Return the latest background probe results without touching any dependency.
+
+    Returns:
+        dict: {dependency: result}. A dependency whose result is missing or older than
+            `health.stale_after` seconds has status "unknown".
+    """
+    with _snapshot_lock:
+        results, updated = _snapshot["results"], _snapshot["updated"]
+    if results is None:
+        return {name: {"status": "unknown"} for name in PROBES}
+    # An old snapshot means the prober is stuck, so the results can no longer be trusted
+    if time.monotonic() - updated > config.get("health.stale_after", 60):
+        return {name: {**result, "status": "unknown", "stale": True} for name, result in results.items()}
+    return dict(results)
+
+def dependency_metrics():
+    """
+    Export the latest probe results as the dependency_up gauge.
+
+    Every worker runs its own prober, so the gauge comes from the snapshot of the worker
+    serving the scrape instead of being summed across workers.
+    """
+    samples = [[{"dependency": name}, 1 if result["status"] == "up" else 0]
+               for name, result in snapshot().items() if result["status"] in ("up", "down")]
+    return {"dependency_up": {"type": "gauge", "help": "", "samples": samples}}
+
+metrics.register_collector(dependency_metrics, per_process=False)
+
+_prober_started = False
+_prober_lock = threading.Lock()
+
+def start_prober():
+    """
+    Start the background prober if `health.enabled` is set.
+
+    It refreshes the snapshot immediately and then every `health.interval` seconds.
+
+    Returns:
+        bool: True if the prober was started by this call.
+    """
+    global _prober_started
+    if not config.get("health.enabled", True):
+        return False
+    with _prober_lock:
+        if _prober_started:
+            return False
+        _prober_started = True
+
+    def _probe_forever():
+        while True:
+            try:
+                refresh()
+            except Exception as e:
+                log.error(f"Health prober error: {str(e)}")
+            time.sleep(config.get("health.interval", 15))
+
+    threading.Thread(target=_probe_forever, name="health-prober", daemon=True).start()
+    log.info("Started health prober")
+    return True
@@ -0,0 +1,362 @@
+from utilities.settings import config
+from utilities.timing import Histogram, DEFAULT_BUCKETS, timing_stats
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+#! Initialize ---------------------------------------------------------------
+enabled = config.get("metrics.enabled", True)
+NAMESPACE = config.get("metrics.namespace", "aiml")
+# Shared directory every uvicorn worker writes its snapshot to; None for a single process
+MULTIPROCESS_DIR = config.get("metrics.multiprocess_dir", None)
+FLUSH_INTERVAL = config.get("metrics.flush_interval", 15)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#! Registry -------------------------------------------------------------------
+class MetricsRegistry:
+    """
+    Thread-safe store of counters, gauges and histograms, each keyed by name and labels.
+
+    Usage:
+        registry.inc("llm_requests_total", provider="openai", model="gpt-4o")
+        registry.observe("http_request_duration_seconds", 0.12, route="/chat/agent/{session_id}")
+
+    Names are given without the namespace prefix; it is added on export. A metric keeps the
+    type it was first used with.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _family(self, name, kind, help_text=""):
+        family = self._metrics.get(name)
+        if family is None:
+            family = self._metrics.setdefault(name, {"type": kind, "help": help_text, "samples": {}})
+        if family["type"] != kind:
+            raise ValueError(f"Metric {name} is a {family['type']}, not a {kind}")
+        return family
+
+    def describe(self, name, kind, help_text):
+        """Declare a metric's type and help text, so it is exported even before its first sample."""
+        with self._lock:
+            self._family(name, kind)["help"] = help_text
+
+    def inc(self, name, value=1, **labels):
+        """Add `value` to a counter."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._family(name, "counter")["samples"]
+            samples[key] = samples.get(key, 0) + value
+
+    def add(self, name, value, **labels):
+        """Add `value` (which may be negative) to a gauge."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._family(name, "gauge")["samples"]
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._family(name, "gauge")["samples"][key] = value
+
+    def observe(self, name, seconds, buckets=DEFAULT_BUCKETS, **labels):
+        """Add an observation to a histogram."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._family(name, "histogram")["samples"]
+            histogram = samples.get(key)
+            if histogram is None:
+                histogram = samples[key] = Histogram(buckets)
+        histogram.observe(seconds)
+
+    def snapshot(self):
+        """
+        Return every metric as plain data, ready to be written to JSON or rendered.
+
+        Returns:
+            dict: name -> {"type", "help", "samples": [[labels, value], ...]}. Histogram values
+                are {"buckets", "sum", "count"} with cumulative bucket counts.
+        """
+        with self._lock:
+            families = {name: (family["type"], family["help"], list(family["samples"].items()))
+                        for name, family in self._metrics.items()}
+        snapshot = {}
+        for name, (kind, help_text, samples) in families.items():
+            snapshot[name] = {
+                "type": kind,
+                "help": help_text,
+                "samples": [[dict(key), _histogram_value(value) if kind == "histogram" else value]
+                            for key, value in samples]
+            }
+        return snapshot
+
+def _histogram_value(histogram):
+    """Convert a Histogram snapshot into JSON-friendly form (bucket bounds as strings)."""
+    snapshot = histogram.snapshot()
+    return {
+        "buckets": {_format_bound(bound): count for bound, count in snapshot["buckets"].items()},
+        "sum": snapshot["sum"],
+        "count": snapshot["count"]
+    }
+
+def _format_bound(bound):
+    return bound if isinstance(bound, str) else repr(float(bound))
+
+registry = MetricsRegistry()
+
+# The metrics reported by the service, so they show up (with help text) before their first sample
+for _name, _kind, _help in [
+    ("http_requests_total", "counter", "HTTP requests by route, method and status code."),
+    ("http_request_duration_seconds", "histogram", "Time to the response headers, by route."),
+    ("http_streams_in_flight", "gauge", "Streaming responses currently being sent, by route."),
+    ("http_stream_duration_seconds", "histogram", "Time to send a whole streaming response, by route."),
+    ("llm_requests_total", "counter", "Chat completion requests by provider, model and mode (sync or stream)."),
+    ("llm_errors_total", "counter", "Chat completion requests that raised, by provider and model."),
+    ("llm_tokens_total", "counter", "Tokens reported by the provider, by provider, model and type (prompt, cached, completion)."),
+    ("embedding_requests_total", "counter", "Embedding requests by model."),
+    ("embedding_texts_total", "counter", "Texts embedded, by model."),
+    ("embedding_errors_total", "counter", "Embedding requests that failed, by model."),
+    ("tool_errors_total", "counter", "Tool executions that failed to load, by tool."),
+    ("mongo_command_duration_seconds", "histogram", "MongoDB command latency by database and command."),
+    ("mongo_command_errors_total", "counter", "Failed MongoDB commands by database and command."),
+    ("stage_duration_seconds", "histogram", "Duration of timed pipeline stages (chat, RAG, embeddings, Chroma, tools, LLM calls)."),
+    ("cache_hits_total", "counter", "Cache hits by cache."),
+    ("cache_misses_total", "counter", "Cache misses by cache."),
+    ("cache_entries", "gauge", "Entries currently held, by cache."),
+    ("jobs", "gauge", "Ingestion jobs that have not completed, by status."),
+]:
+    registry.describe(_name, _kind, _help)
+
+# Shorthands for instrumented modules; all of them are no-ops when metrics are disabled
+def inc(name, value=1, **labels):
+    if enabled:
+        registry.inc(name, value, **labels)
+
+def add(name, value, **labels):
+    if enabled:
+        registry.add(name, value, **labels)
+
+def set_gauge(name, value, **labels):
+    if enabled:
+        registry.set(name, value, **labels)
+
+def observe(name, seconds, **labels):
+    if enabled:
+        registry.observe(name, seconds, **labels)
+
+#! Collectors -----------------------------------------------------------------
+_collectors = []
+
+def register_collector(collect, per_process=True):
+    """
+    Register a function that returns extra metrics at export time.
+
+    `collect()` returns a snapshot-shaped dict (see MetricsRegistry.snapshot). Per-process
+    collectors (e.g. cache counters) are included in each worker's snapshot and summed across
+    workers; the others (e.g. job queue depth, which is read from MongoDB) describe shared
+    state and are only run by the worker serving the scrape.
+
+    Args:
+        collect (callable): The collector.
+        per_process (bool, optional): Whether its values are local to this process. Defaults to True.
+    """
+    _collectors.append((collect, per_process))
+
+def _collect(per_process):
+    snapshot = {}
+    for collect, local in _collectors:
+        if local != per_process:
+            continue
+        try:
+            snapshot = merge_snapshots([snapshot, collect()])
+        except Exception:
+            # A failing collector must not take the whole endpoint down
+            inc("metrics_collector_errors_total", collector=getattr(collect, "__name__", "collector"))
+    return snapshot
+
+def stage_metrics():
+    """Export the stage timings of utilities.timing as one labelled histogram."""
+    return {"stage_duration_seconds": {
+        "type": "histogram",
+        "help": "",
+        "samples": [[{"stage": stage}, {
+            "buckets": {_format_bound(bound): count for bound, count in stats["buckets"].items()},
+            "sum": stats["sum"],
+            "count": stats["count"]
+        }] for stage, stats in timing_stats().items()]
+    }}
+
+register_collector(stage_metrics)
+
+def process_snapshot():
+    """Return this process's registry plus its per-process collectors."""
+    return merge_snapshots([registry.snapshot(), _collect(per_process=True)])
+
+#! Aggregation ----------------------------------------------------------------
+def merge_snapshots(snapshots):
+    """
+    Sum snapshots sample by sample: counters, gauges and histogram buckets all add up.
+
+    Args:
+        snapshots (list): Snapshots from MetricsRegistry.snapshot or collectors.
+
+    Returns:
+        dict: The merged snapshot.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, {"type": family["type"], "help": family.get("help", ""), "samples": {}})
+            target["help"] = target["help"] or family.get("help", "")
+            for labels, value in family["samples"]:
+                key = tuple(sorted(labels.items()))
+                current = target["samples"].get(key)
+                if family["type"] == "histogram":
+                    if current is None:
+                        current = target["samples"][key] = {"buckets": {}, "sum": 0.0, "count": 0}
+                    for bound, count in value["buckets"].items():
+                        current["buckets"][bound] = current["buckets"].get(bound, 0) + count
+                    current["sum"] += value["sum"]
+                    current["count"] += value["count"]
+                else:
+                    target["samples"][key] = (current or 0) + value
+    return {name: {"type": family["type"], "help": family["help"],
+                   "samples": [[dict(key), value] for key, value in family["samples"].items()]}
+            for name, family in merged.items()}
+
+def _snapshot_path(pid):
+    return os.path.join(MULTIPROCESS_DIR, f"metrics-{pid}.json")
+
+def write_snapshot():
+    """Write this worker's snapshot to the shared directory (atomically, via rename)."""
+    if not MULTIPROCESS_DIR:
+        return
+    os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"pid": os.getpid(), "time": time.time(), "metrics": process_snapshot()}, f)
+    os.replace(temp_path, path)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def read_snapshots():
+    """
+    Read the snapshots of every worker that has written one.
+
+    Counters and histograms of workers that have exited are kept, so totals never go
+    backwards while the service runs; their gauges are dropped. Clear the directory when
+    the service is redeployed.
+
+    Returns:
+        list: The snapshots.
+    """
+    snapshots = []
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        metrics = data.get("metrics", {})
+        if not _pid_alive(data.get("pid", 0)):
+            metrics = {name: family for name, family in metrics.items() if family["type"] != "gauge"}
+        snapshots.append(metrics)
+    return snapshots
+
+def collect_all():
+    """
+    Return the metrics of the whole service.
+
+    With `metrics.multiprocess_dir` set, the snapshots of all uvicorn workers are summed;
+    otherwise only this process is reported.
+
+    Returns:
+        dict: The merged snapshot.
+    """
+    if MULTIPROCESS_DIR:
+        write_snapshot()
+        snapshots = read_snapshots()
+    else:
+        snapshots = [process_snapshot()]
+    return merge_snapshots(snapshots + [_collect(per_process=False)])
+
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+def start_snapshot_writer():
+    """Periodically write this worker's snapshot so the other workers can aggregate it."""
+    global _flusher_started
+    if not (enabled and MULTIPROCESS_DIR):
+        return
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+
+    def _flush():
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+
+    threading.Thread(target=_flush, name="metrics-writer", daemon=True).start()
+
+#! Exposition -----------------------------------------------------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+def render(snapshot):
+    """
+    Render a snapshot in the Prometheus text exposition format.
+
+    Args:
+        snapshot (dict): A snapshot from collect_all.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+    for name in sorted(snapshot):
+        family = snapshot[name]
+        full_name = f"{NAMESPACE}_{name}" if NAMESPACE else name
+        if family.get("help"):
+            lines.append(f"# HELP {full_name} {family['help']}")
+        lines.append(f"# TYPE {full_name} {family['type']}")
+        for labels, value in family["samples"]:
+            if family["type"] == "histogram":
+                for bound, count in sorted(value["buckets"].items(), key=lambda item: float(item[0].replace("+Inf", "inf"))):
+                    lines.append(f"{full_name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,275 @@
+from utilities.settings import config
+from ultraprint.logging import logger
+from keys.keys import environment
+from utilities import metrics
+from contextlib import contextmanager
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows: workers may then fetch the same object twice, which the
+    # atomic rename makes harmless, and eviction relies on open files refusing to be removed
+    fcntl = None
+
+#! Initialize ---------------------------------------------------------------
+log = logger('object_cache_log',
+            filename='debug/object_cache.log',
+            include_extra_info=config.get("logging.include_extra_info", False),
+            write_to_file=config.get("logging.write_to_file", False),
+            log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+
+metrics.registry.describe("object_cache_lookups_total", "counter", "Local S3 object cache lookups, by result (hit or miss).")
+metrics.registry.describe("object_cache_evictions_total", "counter", "Entries evicted from the local S3 object cache.")
+
+# Leftovers of writers that died mid-download are removed once they are this old
+STALE_TEMP_SECONDS = 3600
+
+#! Entries --------------------------------------------------------------------
+class CacheEntry:
+    """
+    A cached object in use. It holds a shared lock on the file so eviction leaves it alone
+    until `close()`; use it as a context manager.
+    """
+
+    def __init__(self, path, handle):
+        self.path = path
+        self.size = os.fstat(handle.fileno()).st_size
+        self._handle = handle
+
+    def close(self):
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _lock(handle, exclusive=False, blocking=True):
+    """flock a file; returns False if a non-blocking lock is held elsewhere"""
+    if fcntl is None:
+        return True
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    try:
+        fcntl.flock(handle.fileno(), flags if blocking else flags | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+#! Cache ----------------------------------------------------------------------
+class ObjectCache:
+    """
+    Size-bounded, content-addressed disk cache for S3 objects, shared by every worker on a node.
+
+    Entries are named by a hash of bucket/key/ETag, so a changed object gets a new entry and
+    the old one ages out. Entries are written to a temp file and renamed into place, so no
+    reader ever sees a partial file. On a miss the downloading worker holds a lock file for
+    the entry, and workers that want the same object wait for it instead of downloading it
+    again. Hits refresh an entry's mtime, and once the directory holds more than `max_bytes`
+    the least recently used entries that no reader has open are evicted.
+    """
+
+    def __init__(self, directory, max_bytes, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, bucket, key, etag):
+        """The file an object version is cached in; the key's extension is kept for readers that sniff it"""
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + os.path.splitext(key)[1].lower())
+
+    def _acquire(self, path):
+        """Open and share-lock an entry, or return None if it is not (or no longer) cached"""
+        try:
+            handle = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        _lock(handle)
+        try:
+            # Evicted between open and lock: the file is gone even though we hold it
+            if os.fstat(handle.fileno()).st_nlink == 0:
+                handle.close()
+                return None
+            os.utime(path)
+        except OSError:
+            handle.close()
+            return None
+        return CacheEntry(path, handle)
+
+    @contextmanager
+    def _download_lock(self, path):
+        lock_path = path + ".lock"
+        with open(lock_path, "a") as handle:
+            _lock(handle, exclusive=True)
+            try:
+                yield
+            finally:
+                # Removed while still held, so the next worker to miss starts a fresh lock
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+
+    def _count(self, result):
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("object_cache_lookups_total", result=result)
+
+    def read_through(self, bucket, key, etag, download):
+        """
+        Return the cached copy of an object version, downloading it on a miss.
+
+        Args:
+            bucket (str): The S3 bucket.
+            key (str): The S3 key.
+            etag (str): The object's ETag.
+            download (callable): Called on a miss; returns (data, local_path), the body as bytes
+                or as a file in the same file system as the cache, which is moved into it.
+
+        Returns:
+            CacheEntry or None: The open entry, or None if the object is larger than the whole
+                cache and was left where download() put it.
+        """
+        path = self.entry_path(bucket, key, etag)
+        entry = self._acquire(path)
+        if entry is None:
+            with self._download_lock(path):
+                entry = self._acquire(path)
+                if entry is None:
+                    self._count("miss")
+                    data, local_path = download()
+                    return self._store(path, data, local_path)
+        self._count("hit")
+        return entry
+
+    def _store(self, path, data, local_path):
+        size = len(data) if local_path is None else os.path.getsize(local_path)
+        if size > self.max_bytes:
+            return None
+        if local_path is None:
+            local_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            try:
+                with open(local_path, "wb") as f:
+                    f.write(data)
+            except BaseException:
+                os.remove(local_path)
+                raise
+        os.replace(local_path, path)
+        entry = self._acquire(path)
+        self.evict()
+        return entry
+
+    def _files(self):
+        """(path, stat) of every entry, plus the temp files, in the cache directory"""
+        entries, temps = [], []
+        for item in os.scandir(self.directory):
+            if item.name.endswith(".lock") or not item.is_file():
+                continue
+            try:
+                stat = item.stat()
+            except FileNotFoundError:
+                continue
+            (temps if item.name.endswith(".tmp") else entries).append((item.path, stat))
+        return entries, temps
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in `max_bytes`.
+
+        Only one worker evicts at a time; the others skip the pass. Entries a reader has
+        open are kept, even if that leaves the cache over its limit for now.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        removed = 0
+        with open(os.path.join(self.directory, ".evict.lock"), "a") as guard:
+            if not _lock(guard, exclusive=True, blocking=False):
+                return 0
+            entries, temps = self._files()
+            for path, stat in temps:
+                if time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+                    self._remove(path)
+            total = sum(stat.st_size for _, stat in entries)
+            for path, stat in sorted(entries, key=lambda item: item[1].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    with open(path, "rb") as handle:
+                        if not _lock(handle, exclusive=True, blocking=False):
+                            continue
+                        os.remove(path)
+                except OSError:
+                    continue
+                total -= stat.st_size
+                removed += 1
+        if removed:
+            with self._lock:
+                self.evictions += removed
+            metrics.inc("object_cache_evictions_total", removed)
+            log.info(f"Evicted {removed} objects from {self.directory}, {total} bytes remain")
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def usage(self):
+        """Return (entries, bytes) currently on disk"""
+        entries, _ = self._files()
+        return len(entries), sum(stat.st_size for _, stat in entries)
+
+    def stats(self):
+        """
+        Return hit ratio statistics for this cache.
+
+        Only in-process counters, so /status never touches the disk; the size of the shared
+        directory is exported by the object_cache_bytes metric.
+
+        Returns:
+            dict: This process's counters and hit ratio.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+object_cache = ObjectCache(
+    os.path.join(config.get("caching.dir", "cache"), "objects"),
+    int(config.get("caching.s3.max_size_mb", 2048) * 1024 * 1024),
+    enabled=config.get("caching.s3.enabled", True)
+)
+
+def object_cache_metrics():
+    """Export the size of the shared cache directory."""
+    entries, size = object_cache.usage() if object_cache.enabled else (0, 0)
+    return {
+        "object_cache_entries": {"type": "gauge", "help": "", "samples": [[{}, entries]]},
+        "object_cache_bytes": {"type": "gauge", "help": "", "samples": [[{}, size]]}
+    }
+
+metrics.register_collector(object_cache_metrics, per_process=False)
@@ -0,0 +1,94 @@
+import base64
+from datetime import datetime
+from bson import json_util
+
+def encode_cursor(document, sort_by):
+    """Encode the position of a document (sort key, _id) as an opaque cursor string."""
+    payload = json_util.dumps([document.get(sort_by), document["_id"]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor back into (sort value, _id)."""
+    try:
+        value, doc_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return value, doc_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def keyset_query(query, sort_by, sort_order, cursor):
+    """Restrict a query to the documents that come after the cursor in (sort_by, _id) order."""
+    if not cursor:
+        return query
+    value, doc_id = decode_cursor(cursor)
+    op = "$lt" if sort_order == -1 else "$gt"
+    if sort_by == "_id":
+        after = {"_id": {op: doc_id}}
+    else:
+        after = {"$or": [
+            {sort_by: {op: value}},
+            {sort_by: value, "_id": {op: doc_id}}
+        ]}
+        # Range operators only match values of the same BSON type, and BSON sorts every string
+        # before every date. While a field is being migrated from ISO strings to dates, a page
+        # boundary can fall between the two, so pull in the other type explicitly.
+        if sort_order == -1 and isinstance(value, datetime):
+            after["$or"].append({sort_by: {"$type": "string"}})
+        elif sort_order != -1 and isinstance(value, str):
+            after["$or"].append({sort_by: {"$type": "date"}})
+    return {"$and": [query, after]} if query else after
+
+def find_page(collection, query, sort_by="created_at", sort_order=-1, limit=20, skip=0, cursor=None, projection=None):
+    """
+    Fetch one page of a sorted query, by offset or by keyset cursor.
+
+    Results are ordered by (sort_by, _id) so pages are stable even when sort values repeat.
+    With a cursor, MongoDB seeks straight to the position on the (filter, sort_by, _id) index,
+    so every page costs the same no matter how deep it is.
+
+    Args:
+        collection: The pymongo collection to query.
+        query (dict): The filter.
+        sort_by (str, optional): The field to sort by. Defaults to "created_at".
+        sort_order (int, optional): 1 for ascending, -1 for descending. Defaults to -1.
+        limit (int, optional): The maximum number of documents to return. Defaults to 20.
+        skip (int, optional): The number of documents to skip. Defaults to 0.
+        cursor (str, optional): The next_cursor returned with the previous page. Defaults to None.
+        projection (dict, optional): The projection to apply. The sort key is always included. Defaults to None.
+
+    Returns:
+        tuple: (documents, next_cursor). next_cursor is None on the last page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if projection and any(include for field, include in projection.items() if field != "_id"):
+        # The next cursor is built from the sort key, so an inclusion projection must carry it
+        projection = {**projection, sort_by: 1}
+    documents = list(collection.find(keyset_query(query, sort_by, sort_order, cursor), projection)
+                    .sort([(sort_by, sort_order), ("_id", sort_order)])
+                    .skip(skip)
+                    .limit(limit + 1 if limit else 0))
+    return split_page(documents, sort_by, limit)
+
+def split_page(documents, sort_by, limit):
+    """
+    Trim a result fetched with limit + 1 back to `limit` and build the cursor for the next page.
+
+    Args:
+        documents (list): The documents, in page order, with at most one extra.
+        sort_by (str): The field the documents are sorted by.
+        limit (int): The page size. 0 means unlimited.
+
+    Returns:
+        tuple: (documents, next_cursor). next_cursor is None on the last page.
+    """
+    if limit and len(documents) > limit:
+        documents = documents[:limit]
+        return documents, encode_cursor(documents[-1], sort_by)
+    return documents, None
+
+def page_fields(result):
+    """Build the "data" (and "next_cursor") fields of an API response from a listing result."""
+    if isinstance(result, dict):
+        return {"data": result["data"], "next_cursor": result["next_cursor"]}
+    return {"data": result}
@@ -1,17 +1,18 @@
-import boto3
 import os
+import io
 import time
 import uuid
 import glob
-import psutil
-import time
+import shutil
+import tempfile
 from functools import wraps
-from ultraconfiguration import UltraConfig
+from utilities.settings import config
 from ultraprint.logging import logger
-from keys.keys import aws_access_key_id, aws_secret , environment
+from keys.keys import environment
+from utilities.clients import s3_client
+from utilities.object_cache import object_cache
 
 #! Initialize ---------------------------------------------------------------
-config = UltraConfig('config.json')
 log = logger('s3_loader_log', 
             filename='debug/s3_loader.log', 
             include_extra_info=config.get("logging.include_extra_info", False), 
@@ -20,18 +21,13 @@ log = logger('s3_loader_log',
 
 # essential variables
 temp_dir = config.get("caching.dir", "cache")
-aws_region = config.get("aws.region", "us-east-1")
 default_bucket_name = config.get("aws.default_bucket_name", "infinite-v2-data")
 
 # Ensure Temp directory exists
 os.makedirs(temp_dir, exist_ok=True)
 
-def generate_unique_filename(original_filename):
-    """Generate a unique filename using timestamp and UUID"""
-    timestamp = int(time.time())
-    unique_id = str(uuid.uuid4())[:8]
-    extension = os.path.splitext(original_filename)[1]
-    return f"{timestamp}_{unique_id}{extension}"
+# Bytes copied per read when a large object is streamed to disk
+STREAM_CHUNK_SIZE = 1024 * 1024
 
 def get_unique_filename():
     """Generate a unique filename using timestamp and UUID"""
@@ -58,20 +54,6 @@ def retry_on_file_access_error(max_attempts=3, delay=1):
         return wrapper
     return decorator
 
-def force_close_file_handles(file_path):
-    """Force close any open handles to the specified file"""
-    try:
-        for proc in psutil.process_iter():
-            try:
-                for item in proc.open_files():
-                    if file_path in item.path:
-                        proc.kill()
-                        log.warning(f"Forced close of process using file: {file_path}")
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-    except Exception as e:
-        log.error(f"Error while trying to force close file handles: {str(e)}")
-
 @retry_on_file_access_error(max_attempts=3, delay=1)
 def cleanup_cache(file_path=None):
     """
@@ -81,48 +63,147 @@ def cleanup_cache(file_path=None):
     try:
         if file_path:
             if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except PermissionError:
-                    force_close_file_handles(file_path)
-                    os.remove(file_path)
+                os.remove(file_path)
                 log.success(f"Deleted file {file_path}")
             else:
                 log.warning(f"File {file_path} not found, skipping deletion")
         else:
-            files = glob.glob(os.path.join(temp_dir, "*"))
-            for f in files:
-                try:
-                    os.remove(f)
-                except PermissionError:
-                    force_close_file_handles(f)
+            for f in glob.glob(os.path.join(temp_dir, "*")):
+                if os.path.isfile(f):
                     os.remove(f)
             log.success(f"Deleted all files in cache directory")
     except Exception as e:
         log.error(f"Error during cleanup: {str(e)}")
         raise
 
-def download_from_s3(key, unique_filename=False, bucket_name=default_bucket_name):
+#! Streamed objects -------------------------------------------------------------
+class S3Object:
     """
-    Downloads a file directly from S3 to cache directory.
-    Returns the local file path.
+    The body of an S3 object: in memory, in a temp file above the spill threshold, or an
+    entry of the local object cache.
+
+    Readers take `open()`, a fresh binary stream over the body, so small and medium objects
+    are never read back from disk. `path()` gives a real file for code that needs one,
+    spilling an in-memory body on first use. `close()` removes any temp file and releases
+    the cache entry; use the object as a context manager.
     """
-    if unique_filename:
-        name = generate_unique_filename(key)
-    else:
-        name = key.split("/")[-1]
-        
-    local_path = os.path.join(temp_dir, name)
-    session = boto3.Session( 
-        aws_access_key_id=aws_access_key_id, 
-        aws_secret_access_key=aws_secret, 
-        region_name=aws_region 
-        )
-    s3 = session.client("s3", region_name=aws_region)
-    s3.download_file(bucket_name, key, local_path)
-    log.success(f"Downloaded {key} from S3 bucket {bucket_name} to {local_path}")
+
+    def __init__(self, key, bucket_name, size, etag=None, data=None, local_path=None, entry=None):
+        self.key = key
+        self.bucket_name = bucket_name
+        self.size = size
+        self.etag = etag
+        self.data = data
+        self.local_path = local_path
+        self.entry = entry
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+    @property
+    def cached(self):
+        return self.entry is not None
+
+    def open(self):
+        """Return a new binary stream positioned at the start of the body"""
+        if self.in_memory:
+            return io.BytesIO(self.data)
+        return open(self.path(), "rb")
+
+    def path(self):
+        """Return a local file with the body, writing one to the cache directory if needed"""
+        if self.entry:
+            return self.entry.path
+        if self.local_path is None:
+            self.local_path = _spill(lambda f: f.write(self.data), self.key)
+        return self.local_path
+
+    def close(self):
+        # Temp files are ours to delete; cache entries stay for the next reader
+        if self.entry:
+            self.entry.close()
+            self.entry = None
+        elif self.local_path:
+            cleanup_cache(self.local_path)
+        self.local_path = None
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _spill(write, key):
+    """Create a temp file in the cache directory, fill it with write(file) and return its path"""
+    fd, local_path = tempfile.mkstemp(prefix=get_unique_filename() + "_", suffix=os.path.splitext(key)[1], dir=temp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+    except BaseException:
+        os.remove(local_path)
+        raise
     return local_path
 
+def _get_object(key, bucket_name, spill_threshold, etag=None):
+    """get_object into memory, or into a temp file above spill_threshold bytes"""
+    params = {"Bucket": bucket_name, "Key": key}
+    if etag:
+        # Fail rather than cache a body that changed since its ETag was read
+        params["IfMatch"] = etag
+    response = s3_client().get_object(**params)
+    body, size = response["Body"], response["ContentLength"]
+    try:
+        if size <= spill_threshold:
+            return S3Object(key, bucket_name, size, response.get("ETag"), data=body.read())
+        local_path = _spill(lambda f: shutil.copyfileobj(body, f, STREAM_CHUNK_SIZE), key)
+        return S3Object(key, bucket_name, size, response.get("ETag"), local_path=local_path)
+    finally:
+        body.close()
+
+def fetch_from_s3(key, bucket_name=default_bucket_name, spill_threshold=None):
+    """
+    Read an S3 object through the local object cache, without a download-then-reopen round trip.
+
+    The object's ETag is read with head_object and looked up in the cache (see
+    utilities.object_cache). On a miss, bodies up to `caching.s3.spill_threshold_mb` are read
+    into memory with get_object and larger ones are streamed to disk in chunks; either way
+    the body is then added to the cache, so re-ingesting the same object (other chunking
+    settings, other agents) does not download it again.
+
+    Args:
+        key (str): The S3 object key.
+        bucket_name (str, optional): The S3 bucket name.
+        spill_threshold (int, optional): Size in bytes above which the body goes to disk.
+
+    Returns:
+        S3Object: The body; close it when done.
+    """
+    if spill_threshold is None:
+        spill_threshold = config.get("caching.s3.spill_threshold_mb", 32) * 1024 * 1024
+    if not object_cache.enabled:
+        obj = _get_object(key, bucket_name, spill_threshold)
+        log.success(f"Fetched {key} ({obj.size} bytes) from S3 bucket {bucket_name}")
+        return obj
+
+    etag = s3_client().head_object(Bucket=bucket_name, Key=key)["ETag"]
+    fetched = []
+    def download():
+        fetched.append(_get_object(key, bucket_name, spill_threshold, etag))
+        return fetched[0].data, fetched[0].local_path
+    entry = object_cache.read_through(bucket_name, key, etag, download)
+    if not fetched:
+        log.success(f"Read {key} from the object cache ({entry.size} bytes)")
+        return S3Object(key, bucket_name, entry.size, etag, entry=entry)
+
+    obj = fetched[0]
+    if entry:
+        # A spilled body was moved into the cache; an in-memory one is still read from memory
+        obj.entry, obj.local_path = entry, None
+    log.success(f"Fetched {key} ({obj.size} bytes) from S3 bucket {bucket_name}{' and cached it' if entry else ''}")
+    return obj
+
 def upload_to_s3(key, local_path, bucket_name=default_bucket_name):
     """
     Uploads a file directly to S3 from the local path.
@@ -131,12 +212,7 @@ def upload_to_s3(key, local_path, bucket_name=default_bucket_name):
     if not os.path.exists(local_path):
         raise FileNotFoundError(f"Local file {local_path} not found")
     
-    session = boto3.Session( 
-        aws_access_key_id=aws_access_key_id, 
-        aws_secret_access_key=aws_secret, 
-        region_name=aws_region 
-        )
-    s3 = session.client("s3", region_name=aws_region)
+    s3 = s3_client()
     s3.upload_file(local_path, bucket_name, key)
     log.success(f"Uploaded {local_path} to S3 bucket {bucket_name} as {key}")
     
@@ -148,12 +224,7 @@ def list_files_in_s3_directory(directory, only_files=True, recursive=False, buck
     If only_files is True, ignore any subdirectories.
     If recursive is False, do not go into subdirectories.
     """
-    session = boto3.Session( 
-        aws_access_key_id=aws_access_key_id, 
-        aws_secret_access_key=aws_secret, 
-        region_name=aws_region 
-        )
-    s3 = session.client("s3", region_name=aws_region)
+    s3 = s3_client()
     response = s3.list_objects_v2(Bucket=bucket_name, Prefix=directory)
     
     if 'Contents' not in response:
@@ -185,12 +256,7 @@ def generate_download_link(key, expiration=3600, bucket_name=default_bucket_name
     Returns:
         str: A pre-signed URL that can be used to download the object
     """
-    session = boto3.Session( 
-        aws_access_key_id=aws_access_key_id, 
-        aws_secret_access_key=aws_secret, 
-        region_name=aws_region 
-    )
-    s3 = session.client("s3", region_name=aws_region)
+    s3 = s3_client()
     
     try:
         url = s3.generate_presigned_url(
@@ -1,7 +1,8 @@
-from bs4 import BeautifulSoup
 import requests
 
 def scrape_page(url):
+    # Only ingestion scrapes pages, so the parser is imported on first use
+    from bs4 import BeautifulSoup
     response = requests.get(url)
     response.raise_for_status()
     soup = BeautifulSoup(response.text, 'html.parser')
@@ -0,0 +1,275 @@
+from collections.abc import Mapping
+from functools import lru_cache
+from types import MappingProxyType
+import json
+import os
+import threading
+import time
+
+#! Config snapshot --------------------------------------------------------------
+CONFIG_PATH = "config.json"
+
+class ConfigNode(Mapping):
+    """
+    One immutable section of the configuration.
+
+    Keys are read as attributes (`settings().prompt.budget.max_input_tokens`) or by item.
+    Nested sections are ConfigNodes and lists are tuples, so a snapshot can be shared by
+    every thread without copying.
+    """
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        object.__setattr__(self, "_data", MappingProxyType({key: _freeze(value) for key, value in data.items()}))
+
+    def __getattr__(self, name):
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(f"No config key '{name}'") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config snapshots are read-only")
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"ConfigNode({dict(self._data)!r})"
+
+    def get(self, path, default=None):
+        """
+        Look up a dotted path, e.g. get("caching.documents.ttl", 300).
+
+        Returns:
+            The value, or `default` if any part of the path is missing.
+        """
+        node = self
+        for key in _split(path):
+            if not isinstance(node, ConfigNode) or key not in node._data:
+                return default
+            node = node._data[key]
+        return node
+
+    def to_dict(self):
+        """Return a mutable deep copy as plain dicts and lists."""
+        return {key: _thaw(value) for key, value in self._data.items()}
+
+@lru_cache(maxsize=1024)
+def _split(path):
+    return tuple(path.split("."))
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return ConfigNode(value)
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _thaw(value):
+    if isinstance(value, ConfigNode):
+        return value.to_dict()
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+#! Validation -------------------------------------------------------------------
+def _positive(value):
+    return value > 0
+
+def _non_negative(value):
+    return value >= 0
+
+def _ratio(value):
+    return 0 <= value <= 1
+
+NUMBER = (int, float)
+
+# (path, required, type, check). Optional settings are only checked when present.
+RULES = [
+    ("models.dicision", True, str, None),
+    ("models.embedding", True, str, None),
+    ("chroma.threshold", True, NUMBER, _ratio),
+    ("constraints.max_num_collections", False, int, _positive),
+    ("constraints.max_memory_size", False, int, _positive),
+    ("constraints.max_parallel_tools", True, int, _positive),
+    ("caching.dir", False, str, None),
+    ("caching.documents.ttl", False, NUMBER, _non_negative),
+    ("caching.documents.max_size", False, int, _positive),
+    ("caching.history.max_sessions", False, int, _positive),
+    ("caching.history.window", False, int, _positive),
+    ("caching.s3.spill_threshold_mb", False, NUMBER, _non_negative),
+    ("caching.s3.max_size_mb", False, NUMBER, _positive),
+    ("mongo.migrations.batch_size", False, int, _positive),
+    ("mongo.migrations.pause", False, NUMBER, _non_negative),
+    ("mongo.migrations.stale_after", False, NUMBER, _positive),
+    ("mongo.migrations.run_on_startup", False, tuple, None),
+    ("prompt.layout", False, str, lambda value: value in ("prefix_cache", "legacy")),
+    ("prompt.budget.max_input_tokens", False, int, _positive),
+    ("prompt.budget.reserve_output_tokens", False, int, _non_negative),
+    ("health.interval", False, NUMBER, _positive),
+    ("health.timeout", False, NUMBER, _positive),
+    ("metrics.flush_interval", False, NUMBER, _positive),
+    ("config_reload.interval", False, NUMBER, _positive),
+    ("ingestion.workers", False, int, _positive),
+    ("ingestion.max_attempts", False, int, _positive),
+    ("ingestion.backoff_base", False, NUMBER, _non_negative),
+    ("ingestion.backoff_max", False, NUMBER, _non_negative),
+    ("ingestion.lease_ttl", False, NUMBER, _positive),
+    ("ingestion.heartbeat_interval", False, NUMBER, _positive),
+    ("ingestion.poll_interval", False, NUMBER, _positive),
+    ("ingestion.embed_batch_size", False, int, _positive),
+    ("ingestion.pdf_workers", False, int, _positive),
+    ("ingestion.pdf_parallel_pages", False, int, _positive),
+    ("ingestion.pdf_shard_pages", False, int, _positive),
+    ("ingestion.excel_chunk_tokens", False, int, _positive),
+    ("ingestion.artifact_sweep_interval", False, NUMBER, _positive),
+]
+
+def validate(snapshot):
+    """
+    Check a snapshot against RULES.
+
+    Args:
+        snapshot (ConfigNode): The parsed configuration.
+
+    Raises:
+        ValueError: Listing every setting that is missing, of the wrong type or out of range.
+    """
+    missing = object()
+    problems = []
+    for path, required, expected, check in RULES:
+        value = snapshot.get(path, missing)
+        if value is missing:
+            if required:
+                problems.append(f"{path} is required")
+            continue
+        # bool is an int subclass, but true is never a valid size
+        if isinstance(value, bool) or not isinstance(value, expected):
+            problems.append(f"{path} has the wrong type ({type(value).__name__})")
+        elif check and not check(value):
+            problems.append(f"{path} is out of range ({value!r})")
+    if problems:
+        raise ValueError("Invalid configuration: " + "; ".join(problems))
+
+def load(path=CONFIG_PATH):
+    """
+    Parse and validate a config file into an immutable snapshot.
+
+    Args:
+        path (str, optional): The config file. Defaults to CONFIG_PATH.
+
+    Returns:
+        ConfigNode: The snapshot.
+
+    Raises:
+        ValueError: If the file is not valid JSON or fails validation.
+    """
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid configuration: {path} is not valid JSON ({str(e)})")
+    snapshot = ConfigNode(data)
+    validate(snapshot)
+    return snapshot
+
+_snapshot = load()
+_loaded_mtime = os.path.getmtime(CONFIG_PATH)
+
+def settings():
+    """
+    Return the current config snapshot.
+
+    Take it once per request (or per loop) and read from it; a reload swaps in a whole new
+    snapshot, so one snapshot never mixes old and new values.
+    """
+    return _snapshot
+
+class _ConfigView:
+    """`config.get("a.b.c", default)` for modules written against UltraConfig, always reading the current snapshot."""
+
+    def get(self, path, default=None):
+        return _snapshot.get(path, default)
+
+config = _ConfigView()
+
+#! Hot reload -------------------------------------------------------------------
+_reload_lock = threading.Lock()
+
+def reload(path=CONFIG_PATH):
+    """
+    Re-read the config file and swap the snapshot in if it is valid.
+
+    An invalid file leaves the current snapshot in place.
+
+    Returns:
+        bool: True if a new snapshot was installed.
+    """
+    global _snapshot, _loaded_mtime
+    with _reload_lock:
+        mtime = os.path.getmtime(path)
+        try:
+            snapshot = load(path)
+        except (OSError, ValueError) as e:
+            _log().error(f"Config reload rejected, keeping the current settings: {str(e)}")
+            _loaded_mtime = mtime
+            return False
+        # A single reference assignment, so readers see either the old or the new snapshot
+        _snapshot = snapshot
+        _loaded_mtime = mtime
+    _log().info(f"Reloaded configuration from {path}")
+    return True
+
+_watcher_started = False
+
+def start_watcher():
+    """
+    Poll the config file and reload it when it changes, if `config_reload.enabled` is set.
+
+    Values that modules read per call (model names, thresholds, limits, budgets) follow the
+    reload; values read once at import (cache and pool sizes, intervals) need a restart.
+
+    Returns:
+        bool: True if the watcher was started by this call.
+    """
+    global _watcher_started
+    if not _snapshot.get("config_reload.enabled", False):
+        return False
+    with _reload_lock:
+        if _watcher_started:
+            return False
+        _watcher_started = True
+
+    def _watch():
+        while True:
+            time.sleep(_snapshot.get("config_reload.interval", 5))
+            try:
+                if os.path.getmtime(CONFIG_PATH) != _loaded_mtime:
+                    reload()
+            except OSError as e:
+                _log().error(f"Could not check {CONFIG_PATH}: {str(e)}")
+
+    threading.Thread(target=_watch, name="config-watcher", daemon=True).start()
+    return True
+
+def _log():
+    # The logger is configured from this module's settings, so it is created on first use
+    global _logger
+    if _logger is None:
+        from ultraprint.logging import logger
+        from keys.keys import environment
+        _logger = logger('settings_log',
+                        filename='debug/settings.log',
+                        include_extra_info=config.get("logging.include_extra_info", False),
+                        write_to_file=config.get("logging.write_to_file", False),
+                        log_level=config.get("logging.development_level", "DEBUG") if environment == 'development' else config.get("logging.production_level", "INFO"))
+    return _logger
+
+_logger = None
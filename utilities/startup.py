@@ -0,0 +1,129 @@
+import importlib
+import importlib.abc
+import sys
+import time
+
+#! Startup timeline -----------------------------------------------------------
+# Import this module first so its load time approximates the start of the process
+STARTED = time.perf_counter()
+_marks = []
+
+# Slow-to-import libraries. The SDKs are loaded with their clients (utilities.clients) and
+# the parsers only when a file is ingested, so none of them should load at import time.
+HEAVY_MODULES = ["pandas", "PyPDF2", "docx", "bs4", "boto3", "duckduckgo_search", "cohere", "chromadb", "openai"]
+
+def mark(label):
+    """Record how long after process start a startup step finished."""
+    _marks.append((label, time.perf_counter() - STARTED))
+
+def startup_report():
+    """
+    Return the startup timeline and which heavy libraries are loaded.
+
+    Returns:
+        dict: "marks" as label and milliseconds since start, and "heavy_modules_loaded".
+    """
+    return {
+        "marks": [{"label": label, "ms": round(elapsed * 1000, 1)} for label, elapsed in _marks],
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules]
+    }
+
+#! Import profiling -----------------------------------------------------------
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module loader to measure how long executing the module takes."""
+
+    def __init__(self, loader, profiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.profiler.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.profiler.stack.pop()
+            if self.profiler.stack:
+                self.profiler.stack[-1] += elapsed
+            self.profiler.times[module.__name__] = (elapsed - children, elapsed)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """
+    Meta path finder that times every module imported while it is installed.
+
+    Usage:
+        with ImportProfiler() as profiler:
+            import _server
+        profiler.report()
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.stack = []
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def __enter__(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        sys.meta_path.remove(self)
+        return False
+
+    def report(self, top=25):
+        """
+        Summarise the import times by top-level package.
+
+        Args:
+            top (int, optional): How many packages to list. Defaults to 25.
+
+        Returns:
+            list: (package, self milliseconds, module count), slowest first.
+        """
+        packages = {}
+        for name, (self_time, _) in self.times.items():
+            package = name.split(".")[0]
+            total, count = packages.get(package, (0.0, 0))
+            packages[package] = (total + self_time, count + 1)
+        ranked = sorted(packages.items(), key=lambda item: -item[1][0])[:top]
+        return [(package, round(total * 1000, 1), count) for package, (total, count) in ranked]
+
+def profile_imports(modules):
+    """
+    Import modules under the profiler and print a per-package breakdown.
+
+    Run in a fresh process, e.g. `python -m utilities.startup _server`, so nothing is cached.
+
+    Args:
+        modules (list): The modules to import.
+    """
+    start = time.perf_counter()
+    with ImportProfiler() as profiler:
+        for name in modules:
+            importlib.import_module(name)
+    total = time.perf_counter() - start
+    print(f"Imported {', '.join(modules)} in {total * 1000:.1f} ms ({len(profiler.times)} modules)")
+    print(f"{'package':<30}{'ms':>10}{'modules':>10}")
+    for package, ms, count in profiler.report():
+        print(f"{package:<30}{ms:>10}{count:>10}")
+    print(f"Heavy libraries loaded: {startup_report()['heavy_modules_loaded']}")
+
+if __name__ == "__main__":
+    profile_imports(sys.argv[1:] or ["_server"])
@@ -0,0 +1,240 @@
+from utilities.settings import config
+from contextvars import ContextVar, copy_context
+from functools import wraps
+import bisect
+import threading
+import time
+
+#! Initialize ---------------------------------------------------------------
+enabled = config.get("instrumentation.enabled", True)
+
+# Upper bounds in seconds; the last bucket catches everything slower
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+#! Histograms -----------------------------------------------------------------
+class Histogram:
+    """Thread-safe fixed-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record one duration."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """
+        Return the cumulative bucket counts, sum and count.
+
+        Returns:
+            dict: "buckets" maps each upper bound ("+Inf" last) to the number of observations at or below it.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            running += bucket_count
+            cumulative[bound] = running
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def observe(name, seconds):
+    """Add a duration to the named in-process histogram."""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    histogram.observe(seconds)
+
+def timing_stats():
+    """
+    Return a summary of every timing histogram.
+
+    Returns:
+        dict: A mapping of span name to count, total and average seconds, and cumulative buckets.
+    """
+    with _histograms_lock:
+        histograms = dict(_histograms)
+    stats = {}
+    for name, histogram in sorted(histograms.items()):
+        snapshot = histogram.snapshot()
+        snapshot["avg"] = round(snapshot["sum"] / snapshot["count"], 6) if snapshot["count"] else 0.0
+        snapshot["sum"] = round(snapshot["sum"], 6)
+        stats[name] = snapshot
+    return stats
+
+#! Request traces -------------------------------------------------------------
+class Trace:
+    """The spans recorded while handling one request, for reporting back to the caller."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, duration):
+        """Record a span that started at perf_counter() value `start` and lasted `duration` seconds."""
+        with self._lock:
+            self.spans.append((name, start - self.started, duration))
+
+    def report(self):
+        """
+        Return the recorded spans in milliseconds.
+
+        Returns:
+            dict: "total" since the trace started and "spans" as name, start offset and duration, in start order.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span[1])
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": [{"name": name, "start_ms": round(offset * 1000, 2), "duration_ms": round(duration * 1000, 2)}
+                      for name, offset, duration in spans]
+        }
+
+_current_trace = ContextVar("timing_trace", default=None)
+
+def current_trace():
+    """Return the trace of the current request, or None if timings were not requested."""
+    return _current_trace.get()
+
+class trace_request:
+    """
+    Collect the spans of the enclosed block into a Trace.
+
+    Usage:
+        with trace_request(include_timings) as trace:
+            ...
+        trace.report() if trace else None
+
+    When `active` is false (or instrumentation is disabled) nothing is collected and the
+    context manager yields None.
+    """
+
+    def __init__(self, active=True):
+        self.active = active and enabled
+        self.trace = None
+        self._token = None
+
+    def __enter__(self):
+        if self.active:
+            self.trace = Trace()
+            self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current_trace.reset(self._token)
+        return False
+
+def in_context(function):
+    """
+    Bind a function to a copy of the current context, so spans recorded on a worker thread
+    (e.g. inside a ThreadPoolExecutor) land in the request's trace.
+    """
+    if not enabled or _current_trace.get() is None:
+        return function
+    context = copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+#! Spans ----------------------------------------------------------------------
+def record(name, seconds, start=None, trace=None):
+    """
+    Record a measured duration directly.
+
+    Args:
+        name (str): The span name.
+        seconds (float): The duration.
+        start (float, optional): The perf_counter() value it started at. Defaults to now minus the duration.
+        trace (Trace, optional): The trace to add it to. Defaults to the current request's trace.
+    """
+    if not enabled:
+        return
+    observe(name, seconds)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.add(name, start if start is not None else time.perf_counter() - seconds, seconds)
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.start, self.start)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name):
+    """
+    Time the enclosed block under `name`.
+
+    Usage:
+        with span("chat.rag"):
+            ...
+    """
+    return _Span(name) if enabled else _NOOP_SPAN
+
+def timed(name):
+    """Decorator that times every call of a function under `name`."""
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start, start)
+        return wrapper
+    return decorator
+
+def traced(name):
+    """
+    Decorator for request entry points: times every call under `name` and, when the caller
+    passes include_timings=True, collects the spans of the call into a Trace that the
+    function can reach through current_trace().
+    """
+    def decorator(function):
+        if not enabled:
+            @wraps(function)
+            def passthrough(*args, include_timings=False, **kwargs):
+                return function(*args, **kwargs)
+            return passthrough
+
+        @wraps(function)
+        def wrapper(*args, include_timings=False, **kwargs):
+            with trace_request(include_timings):
+                with span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator